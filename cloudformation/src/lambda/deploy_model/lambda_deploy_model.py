@@ -18,6 +18,7 @@ logger.addHandler(logging.StreamHandler())
 
 MODEL_MIN_CAPACITY = int(os.environ.get("MODEL_MIN_CAPACITY"))
 MODEL_MAX_CAPACITY = int(os.environ.get("MODEL_MAX_CAPACITY"))
+SERVED_MODEL_TAG = "ServedModelName"
 
 
 def _await_endpoint(sm_client, event):
@@ -64,6 +65,120 @@ def _update_endpoint(sm_client, event, endpoint_config_name):
     return True
 
 
+def _pointer_location(pointer_uri):
+    return pointer_uri.replace("s3://", "", 1).split("/", 1)
+
+
+def _read_pointer(s3_client, pointer_uri):
+    bucket, key = _pointer_location(pointer_uri)
+    try:
+        return s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] != "NoSuchKey":
+            raise
+        return None
+
+
+def _write_pointer(s3_client, pointer_uri, body):
+    """Writes the model pointer, or deletes it when body is None."""
+    bucket, key = _pointer_location(pointer_uri)
+    if body is None:
+        s3_client.delete_object(Bucket=bucket, Key=key)
+        logger.info(f"Model pointer {pointer_uri} cleared")
+    else:
+        s3_client.put_object(
+            Bucket=bucket, Key=key, Body=body, ContentType="application/json"
+        )
+        logger.info(f"Model pointer {pointer_uri} updated")
+
+
+def _pointer_body(event, container):
+    return json.dumps(
+        {"version": event["model_name"], "model_data": container["ModelDataUrl"]}
+    )
+
+
+def _tag_served_model(sm_client, endpoint_arn, event):
+    # The endpoint config keeps naming the model of the last full deployment,
+    # the tag names the model actually served after hot swaps
+    sm_client.add_tags(
+        ResourceArn=endpoint_arn,
+        Tags=[{"Key": SERVED_MODEL_TAG, "Value": event["model_name"]}],
+    )
+
+
+def _served_model_name(sm_client, endpoint):
+    tags = sm_client.list_tags(ResourceArn=endpoint["EndpointArn"])["Tags"]
+    for tag in tags:
+        if tag["Key"] == SERVED_MODEL_TAG:
+            return tag["Value"]
+    endpoint_config = sm_client.describe_endpoint_config(
+        EndpointConfigName=endpoint["EndpointConfigName"]
+    )
+    return endpoint_config["ProductionVariants"][0]["ModelName"]
+
+
+def _hot_swap_model(sm_client, s3_client, event, new_container):
+    """Refreshes a running endpoint in place by moving its model pointer.
+
+    Only applies when the endpoint is in service, its container follows a model
+    pointer (MODEL_POINTER_URI) and the new model uses the same image and
+    inference code as the served one. The instances load, verify and swap the
+    new model themselves.
+    """
+    try:
+        endpoint = sm_client.describe_endpoint(EndpointName=event["endpoint_name"])
+    except ClientError as ex:
+        if "Could not find endpoint" not in str(ex):
+            raise
+        return False
+    if endpoint["EndpointStatus"] != "InService":
+        return False
+
+    current_container = sm_client.describe_model(
+        ModelName=_served_model_name(sm_client, endpoint)
+    )["PrimaryContainer"]
+    current_env = current_container.get("Environment", {})
+    new_env = new_container.get("Environment", {})
+    pointer_uri = current_env.get("MODEL_POINTER_URI")
+    if (
+        not pointer_uri
+        or pointer_uri != new_env.get("MODEL_POINTER_URI")
+        or current_container["Image"] != new_container["Image"]
+        or current_env.get("INFERENCE_CODE_VERSION")
+        != new_env.get("INFERENCE_CODE_VERSION")
+    ):
+        return False
+
+    _write_pointer(s3_client, pointer_uri, _pointer_body(event, new_container))
+    _tag_served_model(sm_client, endpoint["EndpointArn"], event)
+    return True
+
+
+def _deploy_endpoint(sm_client, as_client, event):
+    logger.info("Creating endpoint config")
+    endpoint_config_name = _create_endpoint_config(sm_client, event)
+
+    try:
+        logger.info("Trying to update endpoint")
+        _update_endpoint(sm_client, event, endpoint_config_name)
+        _await_endpoint(sm_client, event)
+        logger.info("Endpoint updated successfully!")
+    except ClientError as ex:
+        if "Could not find endpoint" not in str(ex):
+            raise
+        logger.warning("Endpoint not found! Creating new endpoint")
+        sm_client.create_endpoint(
+            EndpointName=event["endpoint_name"], EndpointConfigName=endpoint_config_name
+        )
+        _await_endpoint(sm_client, event)
+        logger.info("Endpoint created successfully!")
+
+        logger.info("Applying application auto-scaling configuration")
+        _apply_autoscaling(as_client, event)
+        _await_endpoint(sm_client, event)
+
+
 def _apply_autoscaling(as_client, event):
     resource_id = f"endpoint/{event['endpoint_name']}/variant/main"
 
@@ -95,30 +210,40 @@ def _apply_autoscaling(as_client, event):
 def lambda_handler(event, context):
     sm_client = boto3.client("sagemaker")
     as_client = boto3.client("application-autoscaling")
+    s3_client = boto3.client("s3")
 
     logger.info("Received event: " + json.dumps(event, indent=2))
 
-    logger.info("Creating endpoint config")
-    endpoint_config_name = _create_endpoint_config(sm_client, event)
-
+    new_container = sm_client.describe_model(ModelName=event["model_name"])[
+        "PrimaryContainer"
+    ]
+    if event.get("hot_swap"):
+        logger.info("Trying to hot swap the endpoint model")
+        if _hot_swap_model(sm_client, s3_client, event, new_container):
+            logger.info("Endpoint model hot swapped successfully!")
+            return
+        logger.info("Hot swap not applicable, falling back to endpoint update")
+
+    pointer_uri = new_container.get("Environment", {}).get("MODEL_POINTER_URI")
+    if not pointer_uri:
+        _deploy_endpoint(sm_client, as_client, event)
+        return
+
+    # New instances follow the pointer as soon as they boot, so a pointer left by
+    # an earlier hot swap must not send them back to that model. It is cleared
+    # during the deployment, restored if it fails and moved to the new model once
+    # the endpoint serves it.
+    previous_pointer = _read_pointer(s3_client, pointer_uri)
+    _write_pointer(s3_client, pointer_uri, None)
     try:
-        logger.info("Trying to update endpoint")
-        _update_endpoint(sm_client, event, endpoint_config_name)
-        _await_endpoint(sm_client, event)
-        logger.info("Endpoint updated successfully!")
-    except ClientError as ex:
-        if "Could not find endpoint" not in str(ex):
-            raise
-        logger.warning("Endpoint not found! Creating new endpoint")
-        sm_client.create_endpoint(
-            EndpointName=event["endpoint_name"], EndpointConfigName=endpoint_config_name
-        )
-        _await_endpoint(sm_client, event)
-        logger.info("Endpoint created successfully!")
-
-        logger.info("Applying application auto-scaling configuration")
-        _apply_autoscaling(as_client, event)
-        _await_endpoint(sm_client, event)
+        _deploy_endpoint(sm_client, as_client, event)
+    except Exception:
+        if previous_pointer is not None:
+            _write_pointer(s3_client, pointer_uri, previous_pointer)
+        raise
+    _write_pointer(s3_client, pointer_uri, _pointer_body(event, new_container))
+    endpoint = sm_client.describe_endpoint(EndpointName=event["endpoint_name"])
+    _tag_served_model(sm_client, endpoint["EndpointArn"], event)
 
 
 if __name__ == "__main__":
@@ -2,6 +2,8 @@
 
 import argparse
 
+from botocore.exceptions import WaiterError
+
 from sagemaker.workflow.pipeline import Pipeline
 from sagemaker.workflow.conditions import ConditionGreaterThanOrEqualTo
 from sagemaker.workflow.condition_step import ConditionStep
@@ -9,7 +11,11 @@ from sagemaker.workflow.functions import JsonGet
 
 from credit_fraud.utils import Logger
 from credit_fraud.pipeline.context import CreditFraudPipelineContext
-from credit_fraud.pipeline.steps.preprocess import PreprocessStepJob
+from credit_fraud.pipeline.local import LocalPipelineRunner
+from credit_fraud.pipeline.steps.preprocess import (
+    PreprocessStepJob,
+    PysparkFrameworkStrategy,
+)
 from credit_fraud.pipeline.steps.train import TrainStepJob
 from credit_fraud.pipeline.steps.evaluate import EvaluateStepJob
 from credit_fraud.pipeline.steps.create_model import CreateModelStepJob
@@ -34,44 +40,95 @@ def run():
     parser.add_argument("-ce", "--cache-evaluate", action="store_true")
     parser.add_argument("-dr", "--dry-run", action="store_true")
     parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("-w", "--wait", action="store_true")
     parser.add_argument("--local-run", action="store_true")
+    parser.add_argument("-s", "--smoke", action="store_true")
     args, _ = parser.parse_known_args()
 
+    if args.local_run:
+        try:
+            from moto import mock_aws
+        except ImportError as error:
+            raise SystemExit(
+                "--local-run needs moto, install it with: pip install '.[local]'"
+            ) from error
+        # In-process stand-ins of S3, Lambda, Secrets Manager and the other AWS
+        # APIs, for both the pipeline build and its local execution
+        with mock_aws():
+            run_pipeline(args, logger)
+    else:
+        run_pipeline(args, logger)
+
+
+def run_pipeline(args, logger):
+    """
+    Builds the credit fraud pipeline and starts it on SageMaker, or runs it on
+    this machine with `--local-run`.
+    """
     logger.info("Loading pipeline context.")
     context = CreditFraudPipelineContext(args=args, logger=logger)
 
     logger.info("Building pipeline steps.")
-    preprocess_step = PreprocessStepJob(context).build()
+    # Steps whose content-addressed outputs already exist are skipped, the
+    # following steps read those outputs instead
+    steps = []
+    metrics_uri = None
+    if context.processed_data_cached:
+        logger.info("Skipping preprocessing step, processed data already exists.")
+        train_data_uri = context.processed_train_data_folder
+        validation_data_uri = context.processed_validation_data_folder
+        test_data_uri = context.processed_test_data_folder
+    else:
+        preprocess_step_job = PreprocessStepJob(context)
+        preprocess_step = preprocess_step_job.build()
+        processed_outputs = preprocess_step.properties.ProcessingOutputConfig.Outputs
+        train_data_uri = processed_outputs["train.parquet"].S3Output.S3Uri
+        validation_data_uri = processed_outputs["validation.parquet"].S3Output.S3Uri
+        test_data_uri = processed_outputs["test.parquet"].S3Output.S3Uri
+        # Only the PySpark job saves the metrics of its stages
+        if isinstance(
+            preprocess_step_job.strategy_framework, PysparkFrameworkStrategy
+        ):
+            metrics_uri = processed_outputs["metrics"].S3Output.S3Uri
+        steps.append(preprocess_step)
 
     train_step_job = TrainStepJob(context)
-    train_step = train_step_job.build(
-        train_data_uri=preprocess_step.properties.ProcessingOutputConfig.Outputs[
-            "train.parquet"
-        ].S3Output.S3Uri,
-        validation_data_uri=preprocess_step.properties.ProcessingOutputConfig.Outputs[
-            "validation.parquet"
-        ].S3Output.S3Uri,
+    model_artifact_s3_uri = train_step_job.strategy_algorithm.cached_model_artifact_uri
+    if model_artifact_s3_uri:
+        logger.info("Skipping training step, model artifact already exists.")
+        train_step = None
+    else:
+        train_step = train_step_job.build(
+            train_data_uri=train_data_uri,
+            validation_data_uri=validation_data_uri,
+        )
+        model_artifact_s3_uri = train_step.properties.ModelArtifacts.S3ModelArtifacts
+        steps.append(train_step)
+    # Evaluation and registration only need the model, not the inference code
+    model_only_artifact_s3_uri = (
+        train_step_job.strategy_algorithm.get_model_only_artifact_uri(train_step)
     )
 
     evaluation_model_image_uri = train_step_job.strategy_algorithm.get_image_uri(
         scope="training"
     )
     evaluation_step = EvaluateStepJob(context, evaluation_model_image_uri).build(
-        model_artifact_s3_uri=train_step.properties.ModelArtifacts.S3ModelArtifacts,
-        test_data_uri=preprocess_step.properties.ProcessingOutputConfig.Outputs[
-            "test.parquet"
-        ].S3Output.S3Uri,
+        model_artifact_s3_uri=model_only_artifact_s3_uri,
+        test_data_uri=test_data_uri,
+        metrics_uri=metrics_uri,
+        model_fingerprint=train_step_job.strategy_algorithm.model_fingerprint,
     )
 
     inference_model_image_uri = train_step_job.strategy_algorithm.get_image_uri(
         scope="inference"
     )
-    create_model_step = CreateModelStepJob(context, inference_model_image_uri).build(
-        model_artifact_s3_uri=train_step.properties.ModelArtifacts.S3ModelArtifacts
-    )
+    inference_env = train_step_job.strategy_algorithm.get_inference_environment()
+    create_model_step = CreateModelStepJob(
+        context, inference_model_image_uri, env=inference_env
+    ).build(model_artifact_s3_uri=model_artifact_s3_uri)
 
     register_model_step = RegisterModelStepJob(context).build(
-        model_artifact_s3_uri=train_step.properties.ModelArtifacts.S3ModelArtifacts,
+        model_artifact_s3_uri=model_only_artifact_s3_uri,
     )
 
     deploy_step = DeployEndpointStepJob(context).build(
@@ -96,24 +153,51 @@ def run():
     pipeline = Pipeline(
         name=context.cfg["Global"]["PipelineName"],
         parameters=list(context.pipeline_params.values()),
-        steps=[
-            preprocess_step,
-            train_step,
-            evaluation_step,
-            validate_performance_condition_step,
-        ],
+        steps=steps + [evaluation_step, validate_performance_condition_step],
         sagemaker_session=context,
     )
 
+    for step in steps + [evaluation_step]:
+        if step.cache_config and step.cache_config.enable_caching:
+            logger.info(
+                f"Caching enabled for step {step.name}, "
+                f"expires after {step.cache_config.expire_after}."
+            )
+
     if args.verbose:
         logger.info(f"Full pipeline description: {pipeline.definition()}")
-    if not args.dry_run:
+    if args.local_run and not args.dry_run:
+        logger.info("Running pipeline locally.")
+        LocalPipelineRunner(context, pipeline).run()
+    elif not args.dry_run:
         logger.info("Upserting pipeline manifest.")
         pipeline.upsert(role_arn=context.sagemaker_role)
         logger.info("Starting pipeline.")
         start_response = pipeline.start(execution_display_name=context.execution_name)
         if args.verbose:
             logger.info(f"Pipeline start response: {start_response.describe()}")
+        if args.wait:
+            log_execution_steps(start_response, logger)
+
+
+def log_execution_steps(execution, logger):
+    """
+    Waits for a pipeline execution and logs the status of its steps.
+
+    Steps reused from a previous execution are logged with the ARN of the
+    execution whose results they reused.
+    """
+    logger.info("Waiting for pipeline execution.")
+    try:
+        execution.wait(delay=60, max_attempts=240)
+    except WaiterError as ex:
+        logger.warning(f"Pipeline execution did not succeed: {ex}")
+    for step in reversed(execution.list_steps()):
+        cache_hit = step.get("CacheHitResult", {}).get("SourcePipelineExecutionArn")
+        logger.info(
+            f"Step {step['StepName']}: {step['StepStatus']}"
+            + (f" (cache hit from {cache_hit})" if cache_hit else "")
+        )
 
 
 if __name__ == "__main__":
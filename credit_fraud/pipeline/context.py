@@ -1,11 +1,15 @@
 """File used for setting up the pipeline context with configurations and parameters"""
 
 import os
+import hashlib
 import logging
 from datetime import datetime
+from urllib.parse import urlparse
 import pytz
 import boto3
 import json
+import io
+import zipfile
 
 import yaml
 from dotenv import load_dotenv
@@ -14,9 +18,11 @@ from sagemaker.workflow.parameters import (
     ParameterString,
     ParameterFloat,
 )
+from sagemaker.workflow.functions import Join
+from sagemaker.workflow.steps import CacheConfig
 import mlflow
 
-from credit_fraud.utils import S3ScriptManager, PyProjectHelper
+from credit_fraud.utils import S3ScriptManager, PyProjectHelper, ArtifactCache
 from credit_fraud.pipeline.exceptions import InvalidAlgorithmFramework
 
 
@@ -25,18 +31,14 @@ class MLFlowContext:
     A class representing the MLFlow server context for tracking experiments and runs.
 
     Parameters:
-    - mlflow_server_arn (str): The ARN (Amazon Resource Name) of the MLFlow server.
+    - mlflow_server_arn (str): The ARN (Amazon Resource Name) of the MLFlow server,
+        or the URI of the file store of local runs.
     - run_name (str, optional): The name of the MLFlow run. Defaults to None.
-    - local_run (bool, optional): Flag indicating whether the run is local or remote.
-        Defaults to False.
     """
 
-    def __init__(
-        self, mlflow_server_arn: str, run_name: str = None, local_run: bool = False
-    ):
+    def __init__(self, mlflow_server_arn: str, run_name: str = None):
         self.server_arn = mlflow_server_arn
-        if not local_run:
-            mlflow.set_tracking_uri(self.server_arn)
+        mlflow.set_tracking_uri(self.server_arn)
         run_context = mlflow.start_run(run_name=run_name)
         self.experiment_run_id = run_context.info.run_id
         mlflow.end_run()
@@ -51,18 +53,65 @@ class LambdaFunctionsContext:
         register_model_func_name: The name of the Lambda function used 
             for registering models.
         deploy_func_name: The name of the Lambda function used for deploying models.
+        local_handlers: The handler files of the functions created on the Lambda
+            stand-in by local runs, by function name.
 
     Args:
         cfg: A dictionary containing the configuration settings.
         region (str): The AWS region to use for the Lambda client.
+        local_run (bool, optional): Whether to create the functions on the Lambda
+            stand-in of a local run. Defaults to False.
     """
 
-    def __init__(self, cfg, region: str = None):
+    handlers_folder = "cloudformation/src/lambda"
+
+    def __init__(self, cfg, region: str = None, local_run: bool = False):
         self.client = boto3.client("lambda", region_name=region)
         self.register_model_func_name = cfg["Registry"][
             "RegisterModelLambdaFunctionName"
         ]
         self.deploy_func_name = cfg["Deployment"]["DeployLambdaFunctionName"]
+        self.local_handlers = {}
+        if local_run:
+            self.__create_local_functions(cfg, region)
+
+    def __create_local_functions(self, cfg, region: str):
+        """
+        Creates the functions of the pipeline on the Lambda stand-in, with the
+        handlers and environment of the CloudFormation template. Local runs
+        invoke the handlers in-process.
+        """
+        deployment = cfg["Deployment"]
+        functions = {
+            self.register_model_func_name: (
+                "register_model/lambda_register_model.py",
+                {},
+            ),
+            self.deploy_func_name: (
+                "deploy_model/lambda_deploy_model.py",
+                {
+                    "MODEL_MIN_CAPACITY": str(deployment["DeployModelMinCapacity"]),
+                    "MODEL_MAX_CAPACITY": str(deployment["DeployModelMaxCapacity"]),
+                },
+            ),
+        }
+        role_arn = boto3.client("iam", region_name=region).create_role(
+            RoleName="local-lambda-role", AssumeRolePolicyDocument="{}"
+        )["Role"]["Arn"]
+        for function_name, (handler, variables) in functions.items():
+            handler_path = os.path.join(self.handlers_folder, handler)
+            code = io.BytesIO()
+            with zipfile.ZipFile(code, "w") as archive:
+                archive.write(handler_path, os.path.basename(handler_path))
+            self.client.create_function(
+                FunctionName=function_name,
+                Runtime="python3.11",
+                Role=role_arn,
+                Handler=f"{os.path.basename(handler)[:-3]}.lambda_handler",
+                Code={"ZipFile": code.getvalue()},
+                Environment={"Variables": variables},
+            )
+            self.local_handlers[function_name] = handler_path
 
 
 class CreditFraudPipelineContext(PipelineSession):
@@ -87,15 +136,43 @@ class CreditFraudPipelineContext(PipelineSession):
         processed_validation_data_folder: Folder for storing processed 
             validation data in S3.
         processed_test_data_folder: Folder for storing processed test data in S3.
+        processed_scalers_folder: Folder for storing the fitted scaler statistics in S3.
+        processed_metrics_folder: Folder for storing the Spark stage metrics of the
+            preprocessing in S3.
+        raw_cache_folder: Folder for storing the parquet copies of the raw data in S3.
+        incremental_state_uri: S3 URI of the incremental preprocessing state. With
+            `IncrementalMode`, the processed folders are persistent across runs.
+        feature_store_uri: S3 URI of the persistent store of scaled features, see
+            `credit_fraud.utils.FeatureStore`.
+        data_quality_profile_uri: S3 URI of the raw data profile checked by the data
+            quality gate. None in `IncrementalMode`, where runs see only new rows.
+        model_pointer_uri: S3 URI of the pointer followed by hot-swapping endpoints.
+        raw_data_version: Hash of the raw S3 files and their ETags, only computed
+            when preprocessing is cached so that cache hits see raw data changes.
+        artifact_cache: ArtifactCache object for content-addressed step outputs.
+        processed_data_fingerprint: Fingerprint of the processed data, without
+            the split ratios. None when the processed folders are per-run.
+        processed_data_cached: Whether the processed data of this fingerprint
+            already exists, so the preprocessing step can be skipped.
+        preprocess_cache_config: CacheConfig of the preprocessing step.
+        training_cache_config: CacheConfig of the training step.
+        evaluate_cache_config: CacheConfig of the evaluation step.
         training_algorithm: Training algorithm of the ML model.
         s3_script_manager: S3ScriptManager object for managing scripts in S3.
         mlflow: MLFlowContext object for managing MLflow runs.
         lambda_functions: LambdaFunctionsContext object for managing 
             AWS Lambda functions.
+        local_run: Whether the pipeline runs on this machine, against in-process
+            AWS stand-ins, instead of SageMaker.
+        local_working_directory: Folder of the job files and MLflow file store
+            of local runs.
 
     Methods:
         __set_execution_name: Sets the execution name for the pipeline.
         __init_pipeline_params: Initializes the pipeline parameters.
+        __init_step_caching: Initializes the step cache configurations and the
+            content-addressed processed data folders.
+        get_artifact_folder: Returns the content-addressed folder of a step output.
     """
 
     def __init__(self, args, logger=logging):
@@ -104,6 +181,8 @@ class CreditFraudPipelineContext(PipelineSession):
 
         self.logger.info("Loading configurations from config.yml file.")
         self.cfg = yaml.safe_load(open("config.yml"))
+        if args.smoke:
+            self.__apply_smoke_overrides()
         self.logger.debug(f"Configurations loaded: {self.cfg}")
 
         self.logger.info("Loading environment variables from .env file.")
@@ -112,6 +191,9 @@ class CreditFraudPipelineContext(PipelineSession):
             f"Environment variables from .env files are loaded: {is_env_loaded}"
         )
         self.logger.debug(f"Current Environment: {os.environ}")
+        self.local_run = args.local_run
+        if self.local_run:
+            self.__init_local_environment()
 
         super().__init__(
             default_bucket=os.environ.get("AWS_SAGEMAKER_S3_BUCKET_NAME", None),
@@ -148,6 +230,40 @@ class CreditFraudPipelineContext(PipelineSession):
         self.processed_test_data_folder = (
             f"{self.bucket_folder}/runs/{self.execution_name}/processed/test.parquet"
         )
+        self.processed_scalers_folder = (
+            f"{self.bucket_folder}/runs/{self.execution_name}/processed/scalers"
+        )
+        self.processed_metrics_folder = (
+            f"{self.bucket_folder}/runs/{self.execution_name}/processed/metrics"
+        )
+        self.raw_cache_folder = (
+            f"{self.bucket_folder}/raw-cache/"
+            f"{self.cfg['Preprocess']['PreprocessFramework'].lower()}"
+        )
+        incremental_folder = (
+            f"{self.bucket_folder}/processed/incremental/"
+            f"{self.cfg['Preprocess']['PreprocessFramework'].lower()}"
+        )
+        self.incremental_state_uri = f"{incremental_folder}/state.json"
+        self.feature_store_uri = f"{self.bucket_folder}/feature-store"
+        if self.cfg["Preprocess"]["IncrementalMode"]:
+            self.processed_train_data_folder = f"{incremental_folder}/train.parquet"
+            self.processed_validation_data_folder = (
+                f"{incremental_folder}/validation.parquet"
+            )
+            self.processed_test_data_folder = f"{incremental_folder}/test.parquet"
+        self.data_quality_profile_uri = (
+            None
+            if self.cfg["Preprocess"]["IncrementalMode"]
+            else f"{self.bucket_folder}/data-quality/profile.json"
+        )
+        self.model_pointer_uri = (
+            f"{self.bucket_folder}/deployment/"
+            f"{self.cfg['Deployment']['EndpointName']}/model-pointer.json"
+        )
+
+        if self.local_run:
+            self.__upload_local_data()
 
         self.training_algorithm = os.environ.get(
             "TRAINING_ALGORITHM", str(self.cfg["Training"]["DefaultTrainingAlgorithm"])
@@ -157,19 +273,99 @@ class CreditFraudPipelineContext(PipelineSession):
         self.s3_script_manager = S3ScriptManager(
             region=self.region,
             destination_bucket_name=self.bucket_name,
-            destination_folder=f"{self.bucket_folder_prefix}/runs/{self.execution_name}/scripts",
+            destination_folder=f"{self.bucket_folder_prefix}/scripts",
             logger=logger,
         )
 
         self.__init_pipeline_params(args)
+        self.__init_step_caching(args)
 
         self.mlflow = MLFlowContext(
             mlflow_server_arn=os.environ.get("MLFLOW_ARN"),
             run_name=self.execution_name,
-            local_run=args.local_run,
         )
 
-        self.lambda_functions = LambdaFunctionsContext(cfg=self.cfg, region=self.region)
+        self.lambda_functions = LambdaFunctionsContext(
+            cfg=self.cfg, region=self.region, local_run=self.local_run
+        )
+
+    def __init_local_environment(self):
+        """
+        Points the pipeline to the in-process AWS stand-ins of a `--local-run`.
+
+        The stand-ins replace every AWS API while the pipeline is built and run,
+        see `credit_fraud.pipeline.local`. Artifacts go to a stand-in bucket and
+        MLflow tracks to a file store in the local working directory. The
+        LightGBM scripts and model are JumpStart artifacts, which the stand-ins
+        do not hold, so local runs train the XGBoost model.
+        """
+        self.local_working_directory = os.path.abspath(
+            self.cfg["Local"]["WorkingDirectory"]
+        )
+        self.logger.info(f"Local run in {self.local_working_directory}")
+        os.environ.setdefault(
+            "AWS_DEFAULT_REGION", os.environ.get("AWS_REGION", "us-east-1")
+        )
+        os.environ["AWS_SAGEMAKER_S3_BUCKET_NAME"] = self.cfg["Local"]["BucketName"]
+        os.environ["MLFLOW_ARN"] = f"file://{self.local_working_directory}/mlruns"
+        os.environ["TRAINING_ALGORITHM"] = "xgboost"
+        for variable in ("AWS_SAGEMAKER_ROLE_IAM", "S3_RAW_DATA_KEY"):
+            os.environ.pop(variable, None)
+
+    def __upload_local_data(self):
+        """
+        Uploads the local raw data to the S3 stand-in. With an RDS source, the
+        RDS secret is created on the Secrets Manager stand-in from the
+        `RDS_SECRET_USERNAME` and `RDS_SECRET_PASSWORD` variables instead.
+        """
+        if self.cfg["Preprocess"]["SourceMethod"].lower() == "rds":
+            boto3.client("secretsmanager", region_name=self.region).create_secret(
+                Name=self.rds_secret_name,
+                SecretString=json.dumps(
+                    {
+                        "username": os.environ.get("RDS_SECRET_USERNAME"),
+                        "password": os.environ.get("RDS_SECRET_PASSWORD"),
+                    }
+                ),
+            )
+            return
+        raw_data_path = self.cfg["Local"]["RawDataPath"]
+        paths = (
+            [
+                os.path.join(root, file_name)
+                for root, _, file_names in os.walk(raw_data_path)
+                for file_name in sorted(file_names)
+            ]
+            if os.path.isdir(raw_data_path)
+            else [raw_data_path]
+        )
+        location = urlparse(self.s3_raw_data_key)
+        s3_client = boto3.client("s3", region_name=self.region)
+        for path in paths:
+            key = location.path.lstrip("/")
+            if os.path.isdir(raw_data_path):
+                key = f"{key}/{os.path.relpath(path, raw_data_path)}"
+            self.logger.info(f"Uploading {path} to the S3 stand-in")
+            s3_client.upload_file(path, location.netloc, key)
+
+    def __apply_smoke_overrides(self):
+        """
+        Overrides the configurations with the `Smoke` section for a `--smoke` run.
+
+        Smoke runs build the same step graph on a sample of the raw data, with
+        capped boosting rounds and the smallest instances. They upsert their own
+        pipeline and their ROC-AUC threshold cannot be reached, so their models
+        are never registered nor deployed.
+        """
+        self.logger.info("Smoke run: overriding configurations with the Smoke section.")
+        for section, overrides in self.cfg["Smoke"].items():
+            self.cfg[section].update(overrides)
+        if self.cfg["Evaluation"]["ROCAUCMinThreshold"] > 1:
+            self.logger.warning(
+                "Smoke run: the ROC-AUC threshold "
+                + f"{self.cfg['Evaluation']['ROCAUCMinThreshold']} is unreachable, "
+                + "the register, create model and deploy steps are skipped."
+            )
 
     def __set_execution_name(self):
         """
@@ -210,6 +406,145 @@ class CreditFraudPipelineContext(PipelineSession):
             ),
         }
 
+    def __init_step_caching(self, args):
+        """
+        Initializes the cache configurations of the preprocessing, training and
+        evaluation steps from the `--cache-*` command-line flags.
+
+        Cache keys are computed by SageMaker from the step arguments, so a cached
+        preprocessing step receives the raw data version. With step caching or
+        `ArtifactCache`, the full preprocessing of S3 sources writes to folders
+        keyed by its configuration, job scripts, raw data version and split
+        ratios instead of the execution name. With `ArtifactCache`, those
+        folders are looked up and the preprocessing step is skipped when they
+        already hold the processed data. RDS sources have no version and write
+        to per-run folders, so their preprocessing is never cached.
+
+        Args:
+            args: Command-line arguments passed to the pipeline.
+        """
+        expire_after = self.cfg["Global"]["CacheExpireAfter"]
+        is_s3_source = self.cfg["Preprocess"]["SourceMethod"].lower() == "s3"
+        if args.cache_preprocess and not is_s3_source:
+            self.logger.warning(
+                "Preprocessing caching has no effect with RDS sources, whose table "
+                + "changes are not detected. It is disabled for this execution."
+            )
+        self.preprocess_cache_config = CacheConfig(
+            enable_caching=args.cache_preprocess and is_s3_source,
+            expire_after=expire_after,
+        )
+        self.training_cache_config = CacheConfig(
+            enable_caching=args.cache_training, expire_after=expire_after
+        )
+        self.evaluate_cache_config = CacheConfig(
+            enable_caching=args.cache_evaluate, expire_after=expire_after
+        )
+
+        self.artifact_cache = ArtifactCache(
+            destination_bucket_name=self.bucket_name,
+            destination_folder=f"{self.bucket_folder_prefix}/artifacts",
+            region=self.region,
+            logger=self.logger,
+        )
+        self.raw_data_version = None
+        self.processed_data_fingerprint = None
+        self.processed_data_cached = False
+        use_artifact_cache = self.cfg["Global"]["ArtifactCache"]
+        if not (args.cache_preprocess or use_artifact_cache) or not is_s3_source:
+            return
+        self.raw_data_version = self.__get_raw_data_version()
+        self.logger.info(f"Raw data version: {self.raw_data_version}")
+        if self.cfg["Preprocess"]["IncrementalMode"]:
+            return
+
+        jobs_folder = self.cfg["Global"]["JobsScriptsFolder"]
+        fingerprint = ArtifactCache.fingerprint(
+            self.cfg["Preprocess"],
+            self.raw_data_version,
+            paths=[
+                os.path.join(jobs_folder, script_name)
+                for script_name in sorted(os.listdir(jobs_folder))
+                if script_name.startswith("preprocess_") and script_name.endswith(".py")
+            ],
+        )
+        self.processed_data_fingerprint = fingerprint
+        folders = {
+            name: self.get_artifact_folder("processed", fingerprint, name)
+            for name in [
+                "train.parquet",
+                "validation.parquet",
+                "test.parquet",
+                "scalers",
+                "metrics",
+            ]
+        }
+        # Only the PySpark job writes metrics, they never decide a cache hit
+        if use_artifact_cache and all(
+            self.artifact_cache.exists(default_folder)
+            for name, (_, default_folder) in folders.items()
+            if name != "metrics"
+        ):
+            self.logger.info(f"Reusing processed data {fingerprint}")
+            self.processed_data_cached = True
+            # The preprocessing step is skipped, so nothing depends on the ratios
+            folders = {name: default for name, (_, default) in folders.items()}
+        else:
+            folders = {name: folder for name, (folder, _) in folders.items()}
+        self.processed_train_data_folder = folders["train.parquet"]
+        self.processed_validation_data_folder = folders["validation.parquet"]
+        self.processed_test_data_folder = folders["test.parquet"]
+        self.processed_scalers_folder = folders["scalers"]
+        self.processed_metrics_folder = folders["metrics"]
+
+    def get_artifact_folder(self, kind: str, fingerprint: str, name: str):
+        """
+        Returns the content-addressed folder of a step output, which depends on
+        the split ratios too.
+
+        Lookups can only resolve the default split ratios, executions started
+        with other ratios run the steps into their own folders.
+
+        Args:
+            kind (str): The kind of output, e.g. `processed` or `model`.
+            fingerprint (str): The fingerprint of the step output.
+            name (str): The name of the output folder.
+
+        Returns:
+            Tuple[Join, str]: The folder for the pipeline definition and the
+                folder with the default split ratios, for lookups.
+        """
+        ratios = [
+            self.pipeline_params["preprocess_train_ratio"],
+            self.pipeline_params["preprocess_validation_ratio"],
+            self.pipeline_params["preprocess_test_ratio"],
+        ]
+        folder = self.artifact_cache.get_uri(kind, fingerprint)
+        return (
+            Join(on="/", values=[folder] + ratios + [name]),
+            "/".join([folder] + [ratio.default_value for ratio in ratios] + [name]),
+        )
+
+    def __get_raw_data_version(self) -> str:
+        """
+        Hashes the keys and ETags of the raw data files in S3.
+
+        Returns:
+            str: The raw data version, which changes whenever a file is added,
+                removed or rewritten.
+        """
+        location = urlparse(self.s3_raw_data_key)
+        paginator = boto3.client("s3", region_name=self.region).get_paginator(
+            "list_objects_v2"
+        )
+        digest = hashlib.sha256()
+        for page in paginator.paginate(
+            Bucket=location.netloc, Prefix=location.path.lstrip("/")
+        ):
+            for item in page.get("Contents", []):
+                digest.update(f"{item['Key']}\0{item['ETag']}\n".encode())
+        return digest.hexdigest()[:16]
+
     def __init_model_params(self):
         """
         Initializes the model parameters based on the training algorithm.
@@ -223,7 +558,8 @@ class CreditFraudPipelineContext(PipelineSession):
         After loading the default model parameters, it checks for any
             environment variables that match the model parameter prefix
         (either 'XGBOOST_' or 'LIGHTGBM_') and updates the corresponding
-            model parameter with the environment variable value.
+            model parameter with the environment variable value. The boosting
+        rounds are then capped to `MaxBoostingRounds`, when it is set.
 
         Finally, it logs the model parameters.
 
@@ -244,4 +580,10 @@ class CreditFraudPipelineContext(PipelineSession):
             if model_param_prefix in key:
                 key_clean = key.split(model_param_prefix)[-1].lower()
                 self.model_params[key_clean] = value
+        max_rounds = self.cfg["Training"]["MaxBoostingRounds"]
+        for key in ("num_round", "num_boost_round"):
+            if max_rounds and key in self.model_params:
+                self.model_params[key] = str(
+                    min(int(self.model_params[key]), max_rounds)
+                )
         self.logger.info(f"Model parameters: {self.model_params}")
@@ -1,7 +1,9 @@
 """Evaluation job responsible for automatically evaluating the model metrics."""
 
+import hashlib
 import json
 import logging
+import os
 import pathlib
 import pickle
 import tarfile
@@ -18,6 +20,21 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+# Container folder of the processing inputs and outputs, remapped by local runs
+local_dir = os.environ.get("SM_PROCESSING_DIR", "/opt/ml/processing")
+
+# Spark job group metrics of the preprocessing logged to MLflow, by their MLflow name
+MLFLOW_STAGE_METRICS = {
+    "duration_seconds": "Duration-Seconds",
+    "executor_run_time_ms": "Executor-Run-Time-Ms",
+    "input_bytes": "Input-Bytes",
+    "shuffle_read_bytes": "Shuffle-Read-Bytes",
+    "shuffle_write_bytes": "Shuffle-Write-Bytes",
+    "memory_spilled_bytes": "Memory-Spilled-Bytes",
+    "disk_spilled_bytes": "Disk-Spilled-Bytes",
+    "task_skew": "Task-Skew",
+}
+
 
 def install_dependencies(model_algorithm):
     logger.info("Attempting to install dependencies")
@@ -35,6 +52,36 @@ def install_dependencies(model_algorithm):
     import mlflow
 
 
+def extract_model(model_path, model_file="model.pkl", manifest_file="manifest.json"):
+    """Extract only the model file and check it against the artifact manifest."""
+    with tarfile.open(model_path) as tar:
+        tar.extract(model_file, path=".")
+        if manifest_file not in tar.getnames():
+            return model_file
+        manifest = json.load(tar.extractfile(manifest_file))
+    with open(model_file, "rb") as file:
+        checksum = hashlib.sha256(file.read()).hexdigest()
+    if checksum != manifest["files"][model_file]["sha256"]:
+        raise ValueError(f"Checksum mismatch for {model_file} in {model_path}")
+    return model_file
+
+
+def log_stage_metrics(metrics_path):
+    """Log the Spark stage metrics of the preprocessing, when it saved them."""
+    if not os.path.exists(metrics_path):
+        return
+    with open(metrics_path) as file:
+        metrics = json.load(file)
+    mlflow.log_metrics(
+        {
+            f"Preprocess/{group}/{name}": group_metrics[key]
+            for group, group_metrics in metrics["groups"].items()
+            for key, name in MLFLOW_STAGE_METRICS.items()
+        }
+    )
+    mlflow.log_artifact(metrics_path, artifact_path="preprocess")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model-algorithm", type=str, default="xgboost")
@@ -49,13 +96,11 @@ if __name__ == "__main__":
     mlflow.start_run(run_id=args.mlflow_run_id)
 
     logger.info("Loading model pickle file.")
-    model_path = "/opt/ml/processing/model/model.tar.gz"
-    with tarfile.open(model_path) as tar:
-        tar.extractall(path=".")
-    model = pickle.load(open("model.pkl", "rb"))
+    model_path = f"{local_dir}/model/output.tar.gz"
+    model = pickle.load(open(extract_model(model_path), "rb"))
 
     logger.info("Reading test data.")
-    df_test = pd.read_parquet("/opt/ml/processing/test.parquet")
+    df_test = pd.read_parquet(f"{local_dir}/test.parquet")
     y_test = df_test["Class"]
     X_test = df_test.drop("Class", axis=1)
     if args.model_algorithm == "xgboost":
@@ -82,7 +127,7 @@ if __name__ == "__main__":
     }
 
     # Save model evaluation metrics
-    output_dir = "/opt/ml/processing/evaluation"
+    output_dir = f"{local_dir}/evaluation"
     pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     logger.info("Writing evaluation report with ROC-AUC: %f", roc_auc_test)
@@ -97,4 +142,5 @@ if __name__ == "__main__":
     mlflow.log_metric("Test/False-Positive", f_p)
     mlflow.log_metric("Test/False-Negative", f_n)
     mlflow.log_metric("Test/True-Positive", t_p)
+    log_stage_metrics(f"{local_dir}/metrics/spark-metrics.json")
     mlflow.end_run()
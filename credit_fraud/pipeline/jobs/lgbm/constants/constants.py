@@ -50,3 +50,17 @@ CLASSIFICATION_PROBLEM_TYPE_METRIC_MAPPING = {
 }
 
 INPUT_MODEL_UNTARRED_PATH = "_input_model_extracted/"
+
+# Embedded predictions used by the serving container to verify hot-swapped models
+SAMPLE_PREDICTIONS_FILE = "sample_predictions.json"
+NUM_SAMPLE_PREDICTIONS = 100
+
+# Inference code layout, as copied into the model directory
+INFERENCE_CODE_DIR = "code"
+INFERENCE_REQUIREMENTS_FILE = "requirements.txt"
+INFERENCE_SITE_PACKAGES_DIR = "site-packages"
+INFERENCE_WHEELS_DIR = "lib"
+INFERENCE_CODE_CONTAINER_PATH = "/opt/ml/model/code"
+# Platform of the serving image, vendored wheels must be binary wheels for it
+INFERENCE_PLATFORM = "manylinux_2_28_x86_64"
+INFERENCE_IMPORT_CHECKS = ["lightgbm"]
@@ -0,0 +1,60 @@
+"""Serving process bootstrap, imported by inference.py before any other dependency.
+
+Puts the site directory vendored next to the inference code at training time in
+front of sys.path, so the container imports lightgbm without installing anything
+at boot, and times how long the container takes from start to its first
+prediction.
+"""
+
+import logging
+import os
+import sys
+import time
+from typing import Optional
+
+
+IMPORTED_AT = time.monotonic()
+
+SITE_PACKAGES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "site-packages"
+)
+if os.path.isdir(SITE_PACKAGES_DIR) and SITE_PACKAGES_DIR not in sys.path:
+    sys.path.insert(0, SITE_PACKAGES_DIR)
+
+_first_prediction_logged = False
+
+
+def container_uptime() -> Optional[float]:
+    """Seconds elapsed since the container init process (PID 1) started.
+
+    Returns:
+        Optional[float]: the uptime, or None when /proc is not available.
+    """
+    try:
+        with open("/proc/stat") as file:
+            boot_time = next(
+                int(line.split()[1]) for line in file if line.startswith("btime")
+            )
+        with open("/proc/1/stat") as file:
+            # Fields after the command name, which may contain spaces
+            fields = file.read().rsplit(")", 1)[1].split()
+        started_at = boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.time() - started_at
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None
+
+
+def log_first_prediction():
+    """Log the boot timings once, when the first prediction is served."""
+    global _first_prediction_logged
+    if _first_prediction_logged:
+        return
+    _first_prediction_logged = True
+    since_import = time.monotonic() - IMPORTED_AT
+    uptime = container_uptime()
+    logging.info(
+        "Time to first prediction request: "
+        + (f"{uptime:.2f}s since container start, " if uptime is not None else "")
+        + f"{since_import:.2f}s since inference code import "
+        + f"(vendored site-packages: {SITE_PACKAGES_DIR in sys.path})"
+    )
@@ -7,3 +7,19 @@ PROBABILITIES = "probabilities"
 PROBABILITIES_1D = "probabilities-1d"
 VERBOSE_EXTENSION = ";verbose"
 PREDICTED_LABEL = "predicted_label"
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+DEFAULT_SCORING_CHUNK_SIZE = 10000
+
+SHADOW_MODEL_SUBDIR = "challenger"
+DEFAULT_SHADOW_OUTPUT_DIR = "/tmp/shadow"
+DEFAULT_SHADOW_MAX_QUEUED_ROWS = 50000
+DEFAULT_SHADOW_NUM_THREADS = 1
+DEFAULT_SHADOW_FLUSH_SIZE = 100
+DEFAULT_SHADOW_FLUSH_INTERVAL_SECONDS = 60
+DEFAULT_SHADOW_SHUTDOWN_TIMEOUT_SECONDS = 5
+
+SAMPLE_PREDICTIONS_FILE = "sample_predictions.json"
+DEFAULT_MODEL_POINTER_POLL_SECONDS = 30
+DEFAULT_SAMPLE_PREDICTIONS_TOLERANCE = 1e-6
+MANIFEST_FILE = "manifest.json"
@@ -1,32 +1,236 @@
+import functools
 import io
 import logging
 import os
+import time
 from typing import Any
+from typing import Iterator
+from typing import Optional
 from typing import Union
 
+import boot  # noqa: F401 Must run before lightgbm is imported
 import joblib
 import numpy as np
 import pandas as pd
 from constants import constants
 from lightgbm import Booster
 from lightgbm import LGBMClassifier
+from model_watcher import ModelWatcher
 from sagemaker_inference import encoder
+from shadow import ShadowScorer
+
+
+SCORING_CHUNK_SIZE = int(
+    os.environ.get("SCORING_CHUNK_SIZE", constants.DEFAULT_SCORING_CHUNK_SIZE)
+)
+
+# Challenger scorer, only set when a shadow model ships next to the champion
+shadow_scorer = None
+# Pointer watcher, only set when the endpoint is configured for hot model swaps
+model_watcher = None
 
 
 def model_fn(model_dir: str) -> Union[Booster, LGBMClassifier]:
     """Read model saved in model_dir and return a object of lightgbm model.
 
+    When a challenger model is found under `SHADOW_MODEL_DIR` (defaults to the
+    `challenger` folder of model_dir), it is loaded as well and mirrored in the
+    background by a `ShadowScorer`, on `SHADOW_NUM_THREADS` threads (1 by default)
+    so that it does not compete with the champion for the instance cores. The
+    champion is always the returned model.
+
+    When `MODEL_POINTER_URI` is set, a `ModelWatcher` follows the deployment
+    pointer and hot-swaps the served model without replacing the instance.
+
     Args:
         model_dir (str): directory that saves the model artifact.
 
     Returns:
         obj: lightgbm model.
     """
+    global shadow_scorer, model_watcher
+    started_at = time.monotonic()
     try:
-        return joblib.load(os.path.join(model_dir, "model.pkl"))
+        model = joblib.load(os.path.join(model_dir, "model.pkl"))
     except Exception:
         logging.exception("Failed to load model from checkpoint")
         raise
+    logging.info(f"Model loaded in {time.monotonic() - started_at:.2f}s")
+
+    shadow_model_dir = os.environ.get(
+        "SHADOW_MODEL_DIR", os.path.join(model_dir, constants.SHADOW_MODEL_SUBDIR)
+    )
+    shadow_model_path = os.path.join(shadow_model_dir, "model.pkl")
+    if os.path.exists(shadow_model_path):
+        try:
+            shadow_scorer = ShadowScorer(
+                challenger=joblib.load(shadow_model_path),
+                predict_fn=functools.partial(
+                    _predict_proba,
+                    num_threads=int(
+                        os.environ.get(
+                            "SHADOW_NUM_THREADS", constants.DEFAULT_SHADOW_NUM_THREADS
+                        )
+                    ),
+                ),
+                output_dir=os.environ.get(
+                    "SHADOW_OUTPUT_DIR", constants.DEFAULT_SHADOW_OUTPUT_DIR
+                ),
+                max_queued_rows=int(
+                    os.environ.get(
+                        "SHADOW_MAX_QUEUED_ROWS",
+                        constants.DEFAULT_SHADOW_MAX_QUEUED_ROWS,
+                    )
+                ),
+                flush_size=int(
+                    os.environ.get(
+                        "SHADOW_FLUSH_SIZE", constants.DEFAULT_SHADOW_FLUSH_SIZE
+                    )
+                ),
+                flush_interval=float(
+                    os.environ.get(
+                        "SHADOW_FLUSH_INTERVAL_SECONDS",
+                        constants.DEFAULT_SHADOW_FLUSH_INTERVAL_SECONDS,
+                    )
+                ),
+                shutdown_timeout=float(
+                    os.environ.get(
+                        "SHADOW_SHUTDOWN_TIMEOUT_SECONDS",
+                        constants.DEFAULT_SHADOW_SHUTDOWN_TIMEOUT_SECONDS,
+                    )
+                ),
+            )
+            logging.info(f"Shadow scoring enabled with {shadow_model_path}")
+        except Exception:
+            # The champion keeps serving even if the challenger is unusable
+            logging.exception("Failed to load shadow model, shadow scoring disabled")
+
+    if os.environ.get("MODEL_POINTER_URI"):
+        model_watcher = ModelWatcher(
+            model=model,
+            pointer_uri=os.environ["MODEL_POINTER_URI"],
+            predict_fn=_predict_proba,
+            poll_seconds=float(
+                os.environ.get(
+                    "MODEL_POINTER_POLL_SECONDS",
+                    constants.DEFAULT_MODEL_POINTER_POLL_SECONDS,
+                )
+            ),
+            tolerance=float(
+                os.environ.get(
+                    "SAMPLE_PREDICTIONS_TOLERANCE",
+                    constants.DEFAULT_SAMPLE_PREDICTIONS_TOLERANCE,
+                )
+            ),
+            model_data=os.environ.get("MODEL_DATA_URL"),
+        )
+    return model
+
+
+def _predict_proba(
+    task: Union[Booster, LGBMClassifier],
+    data: pd.DataFrame,
+    num_threads: Optional[int] = None,
+) -> np.ndarray:
+    """Score a decoded feature matrix and return a two-column probability matrix.
+
+    Args:
+        task (lightgbm.Booster or lightgbm.LGBMClassifier): model loaded by model_fn.
+        data (pd.DataFrame): decoded features, positional or named columns.
+        num_threads (int, optional): prediction threads, the model setting if None.
+
+    Returns:
+        np.ndarray: probabilities of shape (n_rows, n_classes).
+    """
+    if isinstance(task, Booster):
+        best_iteration = task.best_iteration
+        feature_names = task.feature_name()
+    elif isinstance(task, LGBMClassifier):
+        best_iteration = task.best_iteration_
+        feature_names = task.feature_name_
+    if pd.api.types.is_integer_dtype(data.columns):
+        data.columns = feature_names
+    else:  # Named columns (e.g. NDJSON objects) are reordered to the model schema
+        data = data[feature_names]
+
+    predict_params = {} if num_threads is None else {"num_threads": num_threads}
+    if isinstance(task, Booster):
+        model_output = task.predict(
+            data, num_iteration=best_iteration, **predict_params
+        )
+    else:
+        model_output = task.predict_proba(
+            data, num_iteration=best_iteration, **predict_params
+        )
+    if (
+        model_output.ndim == 1
+    ):  # Binary classification prediction from lightgbm.Booster object
+        # Converting it into a 2-dimensional array to keep it consistent with
+        # catboost and sklearn
+        model_output = np.vstack((1.0 - model_output, model_output)).transpose()
+    return model_output
+
+
+def _iter_input_chunks(
+    input_data: Any, content_type: str, chunk_size: int
+) -> Iterator[pd.DataFrame]:
+    """Decode the request body lazily, yielding at most `chunk_size` rows at a time.
+
+    Args:
+        input_data (obj): the request data.
+        content_type (str): the request content type, CSV or NDJSON.
+        chunk_size (int): maximum number of rows per decoded chunk.
+
+    Yields:
+        pd.DataFrame: the next slice of decoded rows.
+    """
+    if isinstance(input_data, (bytes, bytearray)):
+        buffer = io.BytesIO(input_data)
+    else:
+        buffer = io.StringIO(input_data)
+    if content_type == constants.NDJSON_CONTENT_TYPE:
+        yield from pd.read_json(buffer, lines=True, chunksize=chunk_size)
+    else:
+        yield from pd.read_csv(buffer, sep=",", header=None, chunksize=chunk_size)
+
+
+def _score_chunks(
+    task: Union[Booster, LGBMClassifier],
+    chunks: Iterator[pd.DataFrame],
+    verbose: bool,
+) -> Iterator[bytes]:
+    """Score decoded chunks one at a time and encode them as NDJSON records.
+
+    Only one chunk of decoded frame, probabilities and encoded records is alive at
+    any moment, as each chunk is encoded once the previous one was consumed.
+
+    Args:
+        task (lightgbm.Booster or lightgbm.LGBMClassifier): model loaded by model_fn.
+        chunks (Iterator[pd.DataFrame]): decoded request chunks.
+        verbose (bool): whether to add the predicted label to each record.
+
+    Yields:
+        bytes: newline-delimited JSON records of the next scored chunk.
+    """
+    for data in chunks:
+        model_output = _predict_proba(task, data)
+        if shadow_scorer is not None:
+            shadow_scorer.submit(data, model_output)
+        if verbose:
+            labels = np.argmax(model_output, axis=1).tolist()
+            lines = [
+                f'{{"{constants.PROBABILITIES}": {probs}, '
+                f'"{constants.PROBABILITIES_1D}": {probs[1:]}, '
+                f'"{constants.PREDICTED_LABEL}": {label}}}'
+                for probs, label in zip(model_output.tolist(), labels)
+            ]
+        else:
+            lines = [
+                f'{{"{constants.PROBABILITIES}": {probs}, '
+                f'"{constants.PROBABILITIES_1D}": {probs[1:]}}}'
+                for probs in model_output.tolist()
+            ]
+        yield ("\n".join(lines) + "\n").encode()
 
 
 def transform_fn(
@@ -37,7 +241,9 @@ def transform_fn(
 ) -> np.array:
     """Make predictions against the model and return a serialized response.
 
-    The function signature conforms to the SM contract.
+    The function signature conforms to the SM contract. NDJSON requests, or CSV
+    requests accepting NDJSON, are scored in chunks of at most
+    `SCORING_CHUNK_SIZE` rows and answered with one NDJSON body.
 
     Args:
         task (lightgbm.Booster or lightgbm.LGBMClassifier): model loaded by model_fn.
@@ -49,28 +255,33 @@ def transform_fn(
         obj: the serialized prediction result or a tuple of the form
             (response_data, content_type)
     """
+    boot.log_first_prediction()
+    if model_watcher is not None:
+        task = model_watcher.model
+    if content_type == constants.NDJSON_CONTENT_TYPE or (
+        content_type == constants.REQUEST_CONTENT_TYPE
+        and accept.startswith(constants.NDJSON_CONTENT_TYPE)
+    ):
+        chunks = _iter_input_chunks(input_data, content_type, SCORING_CHUNK_SIZE)
+        verbose = accept.endswith(constants.VERBOSE_EXTENSION)
+        try:
+            # The model server only returns complete bodies, so the encoded
+            # chunks are appended to the response as they are scored
+            response = io.BytesIO()
+            for encoded_chunk in _score_chunks(task, chunks, verbose):
+                response.write(encoded_chunk)
+            return response.getvalue(), constants.NDJSON_CONTENT_TYPE
+        except Exception:
+            logging.exception("Failed to do transform")
+            raise
     if content_type == constants.REQUEST_CONTENT_TYPE:
         data = pd.read_csv(io.StringIO(input_data), sep=",", header=None)
         try:
-            if isinstance(task, Booster):
-                best_iteration = task.best_iteration
-                data.columns = task.feature_name()
-                model_output = task.predict(data, num_iteration=best_iteration)
-            elif isinstance(task, LGBMClassifier):
-                best_iteration = task.best_iteration_
-                data.columns = task.feature_name_
-                model_output = task.predict_proba(data, num_iteration=best_iteration)
+            model_output = _predict_proba(task, data)
+            if shadow_scorer is not None:
+                shadow_scorer.submit(data, model_output)
             output = {}
-            if (
-                model_output.ndim == 1
-            ):  # Binary classification prediction from lightgbm.Booster object
-                output[constants.PROBABILITIES_1D] = model_output.reshape((-1, 1))
-                # Converting it into a 2-dimensional array to keep it consistent with catboost and sklearn
-                model_output = np.vstack((1.0 - model_output, model_output)).transpose()
-            if (
-                model_output.ndim == 2
-            ):  # Binary classification prediction from lightgbm.LGBMClassifier object
-                output[constants.PROBABILITIES_1D] = model_output[:, 1:]
+            output[constants.PROBABILITIES_1D] = model_output[:, 1:]
             output[constants.PROBABILITIES] = model_output
             if accept.endswith(constants.VERBOSE_EXTENSION):
                 predicted_label = np.argmax(model_output, axis=1)
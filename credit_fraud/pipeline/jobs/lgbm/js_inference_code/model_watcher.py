@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+from typing import Any
+from typing import Callable
+from urllib.parse import urlparse
+
+import boto3
+from botocore.exceptions import ClientError
+import joblib
+import numpy as np
+import pandas as pd
+from constants import constants
+
+
+class ModelWatcher:
+    """Hot-swap the served model when the deployment pointer changes.
+
+    The pointer is a small JSON object on S3 written by the deploy Lambda, of the
+    form `{"version": ..., "model_data": "s3://.../model.tar.gz"}`. A daemon thread
+    polls it, downloads and loads the new booster off the request path, replays
+    the sample predictions embedded in the artifact and only then replaces the
+    served model. The first check runs before the model is served, so instances
+    started after a swap never answer with the model of their endpoint config.
+    A pointer to the artifact already served is only recorded, so instances
+    started after a full deployment do not download their own model again.
+    The swap is a single reference assignment, so requests always see either the
+    old or the new model, never a partially loaded one.
+
+    Args:
+        model (obj): the model currently served, loaded by model_fn.
+        pointer_uri (str): S3 URI of the model pointer JSON object.
+        predict_fn (Callable): returns the probability matrix for a model and data.
+        poll_seconds (float): interval between two pointer checks.
+        tolerance (float): maximum absolute difference allowed on sample predictions.
+        model_data (str, optional): S3 URI of the artifact of the served model.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        pointer_uri: str,
+        predict_fn: Callable[[Any, pd.DataFrame], np.ndarray],
+        poll_seconds: float,
+        tolerance: float,
+        model_data: str = None,
+    ):
+        self.model = model
+        self.version = None
+        self.model_data = model_data
+        self.predict_fn = predict_fn
+        self.poll_seconds = poll_seconds
+        self.tolerance = tolerance
+
+        pointer = urlparse(pointer_uri)
+        self._pointer_bucket = pointer.netloc
+        self._pointer_key = pointer.path.lstrip("/")
+        self._pointer_etag = None
+        self._s3_client = boto3.client("s3")
+        try:
+            self.check()
+        except Exception:
+            logging.exception("Failed to check model pointer")
+        self._stop = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="model-watcher", daemon=True
+        )
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Failed to check model pointer")
+
+    def check(self) -> bool:
+        """Poll the pointer once and swap the model if it references a new version.
+
+        Returns:
+            bool: whether the served model was replaced.
+        """
+        try:
+            response = self._s3_client.get_object(
+                Bucket=self._pointer_bucket,
+                Key=self._pointer_key,
+                **({"IfNoneMatch": self._pointer_etag} if self._pointer_etag else {}),
+            )
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] in ("304", "NotModified", "NoSuchKey"):
+                return False
+            raise
+        pointer = json.loads(response["Body"].read())
+        if pointer["version"] == self.version or (
+            pointer["model_data"] == self.model_data
+        ):
+            self._pointer_etag = response["ETag"]
+            self.version = pointer["version"]
+            return False
+
+        logging.info(f"Loading model version {pointer['version']} in background")
+        with tempfile.TemporaryDirectory() as model_dir:
+            try:
+                model = self._load(pointer["model_data"], model_dir)
+                self._verify(model, model_dir)
+            except ValueError:
+                # Rejected versions are not retried until the pointer changes again
+                self._pointer_etag = response["ETag"]
+                raise
+        self._pointer_etag = response["ETag"]
+        self.model = model
+        self.version = pointer["version"]
+        self.model_data = pointer["model_data"]
+        logging.info(f"Model version {self.version} is now being served")
+        return True
+
+    def _load(self, model_data: str, model_dir: str) -> Any:
+        """Download the artifact, extract the model files and check their checksums.
+
+        Raises:
+            ValueError: If a model file is missing or does not match the artifact
+                manifest.
+        """
+        artifact = urlparse(model_data)
+        archive_path = os.path.join(model_dir, "model.tar.gz")
+        self._s3_client.download_file(
+            artifact.netloc, artifact.path.lstrip("/"), archive_path
+        )
+        members = ["model.pkl", constants.SAMPLE_PREDICTIONS_FILE]
+        with tarfile.open(archive_path) as tar:
+            names = set(tar.getnames())
+            missing = [name for name in members if name not in names]
+            if missing:
+                raise ValueError(f"{model_data} does not contain {missing}")
+            manifest = None
+            if constants.MANIFEST_FILE in names:
+                manifest = json.load(tar.extractfile(constants.MANIFEST_FILE))
+            tar.extractall(
+                path=model_dir, members=[tar.getmember(name) for name in members]
+            )
+        if manifest is not None:
+            for name in members:
+                digest = hashlib.sha256()
+                with open(os.path.join(model_dir, name), "rb") as file:
+                    for block in iter(lambda: file.read(1 << 20), b""):
+                        digest.update(block)
+                if digest.hexdigest() != manifest["files"][name]["sha256"]:
+                    raise ValueError(f"Checksum mismatch for {name} in {model_data}")
+        return joblib.load(os.path.join(model_dir, "model.pkl"))
+
+    def _verify(self, model: Any, model_dir: str):
+        """Reject models with another schema or that miss their sample predictions.
+
+        Raises:
+            ValueError: If the new model cannot be safely swapped in place.
+        """
+        with open(os.path.join(model_dir, constants.SAMPLE_PREDICTIONS_FILE)) as file:
+            samples = json.load(file)
+        current_names = list(self._feature_names(self.model))
+        if samples["feature_names"] != current_names:
+            raise ValueError(
+                "Model schema changed, a full endpoint deployment is required. "
+                f"Serving: {current_names}. New: {samples['feature_names']}"
+            )
+        data = pd.DataFrame(samples["features"], columns=samples["feature_names"])
+        probabilities = self.predict_fn(model, data)[:, -1]
+        max_diff = np.max(np.abs(probabilities - np.array(samples["probabilities"])))
+        if max_diff > self.tolerance:
+            raise ValueError(
+                f"Sample predictions differ by {max_diff}, above {self.tolerance}"
+            )
+
+    @staticmethod
+    def _feature_names(model: Any):
+        if hasattr(model, "feature_name_"):
+            return model.feature_name_
+        return model.feature_name()
@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+
+class ShadowScorer:
+    """Score a challenger model out of band, mirroring the champion traffic.
+
+    Requests are handed over through a queue bounded by the number of rows it
+    holds, so the response path never waits on the challenger and the memory of
+    pending requests does not depend on their size: when the worker falls behind,
+    new requests are dropped from the comparison instead of delaying responses.
+    Each scored request becomes one compact comparison record, buffered in memory
+    and appended to a local JSON lines file in batches.
+
+    Args:
+        challenger (obj): challenger model, scored with `predict_fn`.
+        predict_fn (Callable): returns the probability matrix for a model and data.
+        output_dir (str): local directory receiving the comparison records.
+        max_queued_rows (int): maximum number of rows waiting to be scored.
+        flush_size (int): number of buffered records that triggers a flush.
+        flush_interval (float): maximum seconds between two flushes.
+        shutdown_timeout (float): maximum seconds `close` waits for the queue to
+            drain, the requests still queued are then left unscored.
+    """
+
+    def __init__(
+        self,
+        challenger: Any,
+        predict_fn: Callable[[Any, pd.DataFrame], np.ndarray],
+        output_dir: str,
+        max_queued_rows: int,
+        flush_size: int,
+        flush_interval: float,
+        shutdown_timeout: float,
+    ):
+        self.challenger = challenger
+        self.predict_fn = predict_fn
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.max_queued_rows = max_queued_rows
+        self.dropped = 0
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_path = os.path.join(output_dir, f"shadow-{os.getpid()}.jsonl")
+
+        self._queue = queue.Queue()
+        self._queued_rows = 0
+        self._queued_rows_lock = threading.Lock()
+        # Guards the buffer and the output file, flushed by both the worker and
+        # close(), which runs on the main thread at exit
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._worker = threading.Thread(
+            target=self._run, name="shadow-scorer", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+    def submit(self, data: pd.DataFrame, champion_output: np.ndarray) -> bool:
+        """Queue a scored request for challenger comparison without blocking.
+
+        Args:
+            data (pd.DataFrame): the decoded features already scored by the champion.
+            champion_output (np.ndarray): the champion probability matrix.
+
+        Returns:
+            bool: whether the request was accepted for shadow scoring.
+        """
+        rows = len(data)
+        with self._queued_rows_lock:
+            if self._queued_rows + rows > self.max_queued_rows:
+                self.dropped += 1
+                return False
+            self._queued_rows += rows
+        self._queue.put_nowait((data, champion_output))
+        return True
+
+    def close(self):
+        """Stop the worker after draining the queue and flush remaining records.
+
+        The queue is drained for at most `shutdown_timeout` seconds, so that a slow
+        challenger does not hold the shutdown of the model server.
+        """
+        if self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join(timeout=self.shutdown_timeout)
+        if self._worker.is_alive():
+            with self._queued_rows_lock:
+                queued_rows = self._queued_rows
+            logging.warning(
+                f"Shadow scorer stopped, {queued_rows} queued rows were not scored"
+            )
+        self._flush()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+            if item is None:
+                return
+            if item is not False:
+                try:
+                    record = self._compare(*item)
+                    with self._buffer_lock:
+                        self._buffer.append(record)
+                except Exception:
+                    logging.exception("Failed to score shadow model")
+                finally:
+                    with self._queued_rows_lock:
+                        self._queued_rows -= len(item[0])
+            if len(self._buffer) >= self.flush_size or (
+                time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self._flush()
+
+    def _compare(self, data: pd.DataFrame, champion_output: np.ndarray) -> dict:
+        started_at = time.perf_counter()
+        challenger_output = self.predict_fn(self.challenger, data)
+        latency_ms = (time.perf_counter() - started_at) * 1000
+
+        champion_proba = champion_output[:, -1]
+        challenger_proba = challenger_output[:, -1]
+        abs_diff = np.abs(champion_proba - challenger_proba)
+        return {
+            "timestamp": time.time(),
+            "rows": int(len(champion_proba)),
+            "champion_mean": float(champion_proba.mean()),
+            "challenger_mean": float(challenger_proba.mean()),
+            "mean_abs_diff": float(abs_diff.mean()),
+            "max_abs_diff": float(abs_diff.max()),
+            "label_agreement": float(
+                np.mean(
+                    np.argmax(champion_output, axis=1)
+                    == np.argmax(challenger_output, axis=1)
+                )
+            ),
+            "challenger_latency_ms": latency_ms,
+            "dropped": self.dropped,
+        }
+
+    def _flush(self):
+        with self._buffer_lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer:
+                return
+            records, self._buffer = self._buffer, []
+            with open(self.output_path, "a") as file:
+                file.writelines(json.dumps(record) + "\n" for record in records)
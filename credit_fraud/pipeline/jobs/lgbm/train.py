@@ -10,6 +10,7 @@ import subprocess
 import lightgbm as lgb
 from constants import constants
 from distributed import Client
+from model_manifest import save_manifest, save_model_only_artifact
 from sagemaker_jumpstart_prepack_script_utilities.prepack_inference import (
     copy_inference_code,
 )
@@ -19,6 +20,9 @@ from sagemaker_jumpstart_tabular_script_utilities import model_info
 from sagemaker_jumpstart_tabular_script_utilities import utils
 from utils import configure_parameters
 from utils import infer_problem_type
+from utils import save_sample_predictions
+from utils import split_sample_weights
+from utils import vendor_inference_dependencies
 
 
 logger = logging.getLogger()
@@ -46,6 +50,9 @@ def _parse_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--model-dir", type=str, default=os.environ.get("SM_MODEL_DIR"))
+    parser.add_argument(
+        "--output-data-dir", type=str, default=os.environ.get("SM_OUTPUT_DATA_DIR")
+    )
     parser.add_argument(
         "--train", type=str, default=os.environ.get("SM_CHANNEL_TRAINING")
     )
@@ -153,8 +160,10 @@ def run_with_args(args):
             content_type=utils.get_content_type(input_data_config=input_data_config),
         )
 
+        X_train, weights = split_sample_weights(X_train, X_val)
+
         # create dataset for lightgbm
-        lgb_train = lgb.Dataset(X_train, y_train)
+        lgb_train = lgb.Dataset(X_train, y_train, weight=weights)
         lgb_eval = lgb.Dataset(X_val, y_val, reference=lgb_train)
 
         # get problem type (binary classification or multi-class classification) from y_train
@@ -192,6 +201,7 @@ def run_with_args(args):
         )
 
         utils.save_model(model=gbm, model_dir=args.model_dir)
+        save_sample_predictions(model=gbm, X=X_val, model_dir=args.model_dir)
         model_info.save_model_info(
             input_model_untarred_path=constants.INPUT_MODEL_UNTARRED_PATH,
             model_dir=args.model_dir,
@@ -226,6 +236,7 @@ def run_with_args(args):
                             input_data_config=input_data_config
                         ),
                     )
+                    X_train, weights = split_sample_weights(X_train, X_val)
 
                     # get problem type (binary classification or multi-class classification) from y_train
                     problem_type, num_classes_y = infer_problem_type(y_train)
@@ -273,6 +284,7 @@ def run_with_args(args):
                     dask_model.fit(
                         X=X_train,
                         y=y_train,
+                        sample_weight=weights,
                         eval_set=[(X_val, y_val), (X_train, y_train)],
                         eval_names=["val", "train"],
                         callbacks=callbacks,
@@ -290,6 +302,9 @@ def run_with_args(args):
                     utils.save_model(
                         model=dask_model.booster_, model_dir=args.model_dir
                     )
+                    save_sample_predictions(
+                        model=dask_model.booster_, X=X_val, model_dir=args.model_dir
+                    )
                     model_info.save_model_info(
                         input_model_untarred_path=constants.INPUT_MODEL_UNTARRED_PATH,
                         model_dir=args.model_dir,
@@ -317,4 +332,11 @@ if __name__ == "__main__":
     args, unknown = _parse_args()
     install_extra_dependencies()
     run_with_args(args)
+    save_model_only_artifact(
+        model_dir=args.model_dir, output_dir=args.output_data_dir, framework="lightgbm"
+    )
     copy_inference_code(dst_path=args.model_dir)
+    vendor_inference_dependencies(
+        code_dir=os.path.join(args.model_dir, constants.INFERENCE_CODE_DIR)
+    )
+    save_manifest(model_dir=args.model_dir, framework="lightgbm")
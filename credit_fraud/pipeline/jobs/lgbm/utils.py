@@ -1,10 +1,17 @@
 import argparse
+import importlib.machinery
+import json
 import logging
+import os
+import shutil
+import subprocess
+import sys
 from typing import Dict
 from typing import Tuple
 from typing import Union
 
 import dask.dataframe as dd
+import lightgbm as lgb
 import pandas as pd
 from constants import constants
 
@@ -38,6 +45,27 @@ def infer_problem_type(
     return problem_type, num_classes_y
 
 
+def split_sample_weights(X_train, X_val):
+    """Separate the sample weights from the training features.
+
+    Preprocessing appends a weight column to the training split only, when it
+    downsamples the negatives, so the training features then have one more
+    column than the validation ones.
+
+    Args:
+        X_train: the training features, a pandas or dask DataFrame.
+        X_val: the validation features.
+
+    Returns:
+        The training features and their sample weights, None when unweighted.
+    """
+
+    if X_train.shape[1] == X_val.shape[1]:
+        return X_train, None
+    logging.info("Training with the sample weights of the last column")
+    return X_train.iloc[:, :-1], X_train.iloc[:, -1]
+
+
 def configure_parameters(
     args: argparse.Namespace, problem_type: str, is_for_dask_train: bool
 ) -> Dict[str, str]:
@@ -84,3 +112,89 @@ def configure_parameters(
             n_estimators=args.num_boost_round,
         )
     return params
+
+
+def save_sample_predictions(
+    model: lgb.Booster,
+    X: Union[dd.core.DataFrame, pd.core.frame.DataFrame],
+    model_dir: str,
+    num_samples: int = constants.NUM_SAMPLE_PREDICTIONS,
+) -> None:
+    """Embed a few scored rows next to the model artifact.
+
+    The serving container replays these rows when hot-swapping a model and only
+    accepts the new booster if it reproduces the stored probabilities.
+
+    Args:
+        model (lgb.Booster): the trained booster.
+        X (Union[dd.core.DataFrame, pd.core.frame.DataFrame]): features to sample
+            from, usually the validation set.
+        model_dir (str): directory where the model artifact is saved.
+        num_samples (int): number of rows to embed.
+    """
+    sample = X.head(num_samples)
+    probabilities = model.predict(sample, num_iteration=model.best_iteration)
+    if probabilities.ndim == 2:
+        probabilities = probabilities[:, -1]
+    with open(os.path.join(model_dir, constants.SAMPLE_PREDICTIONS_FILE), "w") as file:
+        json.dump(
+            {
+                "feature_names": model.feature_name(),
+                "features": pd.DataFrame(sample).values.tolist(),
+                "probabilities": probabilities.tolist(),
+            },
+            file,
+        )
+
+
+def vendor_inference_dependencies(code_dir: str) -> None:
+    """Unpack the inference requirements into an import-ready site directory.
+
+    Runs in the training container, after the inference code is copied into the
+    model directory. The wheels listed in the inference requirements are
+    installed with `pip --target` into `code_dir/site-packages`, which the
+    serving code puts on sys.path at import. Only binary wheels for the serving
+    platform are accepted, and each checked module must resolve from the site
+    directory without being imported, since the training and serving images
+    differ. The requirements file and wheels are then removed from the model
+    directory, so endpoint instances no longer run pip when they boot.
+
+    Args:
+        code_dir (str): inference code directory inside the model directory.
+
+    Raises:
+        subprocess.CalledProcessError: If a wheel cannot be installed.
+        ImportError: If a checked module is not found in the site directory.
+    """
+    requirements_path = os.path.join(code_dir, constants.INFERENCE_REQUIREMENTS_FILE)
+    site_dir = os.path.join(code_dir, constants.INFERENCE_SITE_PACKAGES_DIR)
+    with open(requirements_path) as file:
+        wheels = [
+            line.strip().replace(constants.INFERENCE_CODE_CONTAINER_PATH, code_dir, 1)
+            for line in file
+            if line.strip() and not line.startswith("#")
+        ]
+
+    logging.info(f"Vendoring inference dependencies {wheels} into {site_dir}")
+    subprocess.check_call(
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            "--no-deps",
+            "--no-index",
+            "--only-binary=:all:",
+            "--platform",
+            constants.INFERENCE_PLATFORM,
+            "--target",
+            site_dir,
+            *wheels,
+        ]
+    )
+    for module in constants.INFERENCE_IMPORT_CHECKS:
+        if importlib.machinery.PathFinder.find_spec(module, [site_dir]) is None:
+            raise ImportError(f"{module} is not importable from {site_dir}")
+
+    os.remove(requirements_path)
+    shutil.rmtree(os.path.join(code_dir, constants.INFERENCE_WHEELS_DIR))
@@ -0,0 +1,61 @@
+"""Model artifact manifest, shipped with the source of every training job."""
+
+import hashlib
+import json
+import os
+import shutil
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def save_manifest(model_dir: str, framework: str) -> None:
+    """Describe every file of the model artifact with its size and checksum.
+
+    Consumers that only need the model files, such as the evaluation job and the
+    endpoint model watcher, extract them alone and check them against the
+    manifest instead of unpacking the whole archive.
+
+    Args:
+        model_dir (str): directory where the model artifact is saved.
+        framework (str): training framework of the model.
+    """
+    files = {}
+    for root, dirs, names in os.walk(model_dir):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            relative_path = os.path.relpath(path, model_dir)
+            if relative_path == MANIFEST_FILE:
+                continue
+            digest = hashlib.sha256()
+            with open(path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+            files[relative_path] = {
+                "sha256": digest.hexdigest(),
+                "size": os.path.getsize(path),
+            }
+    with open(os.path.join(model_dir, MANIFEST_FILE), "w") as file:
+        json.dump({"framework": framework, "files": files}, file, indent=2)
+
+
+def save_model_only_artifact(model_dir: str, output_dir: str, framework: str) -> None:
+    """Copy the model files and their manifest to the training output data.
+
+    SageMaker publishes the output data as `output.tar.gz` next to `model.tar.gz`,
+    so evaluation and registration download the model files alone, without the
+    inference code and dependencies the serving container loads.
+
+    Args:
+        model_dir (str): directory where the model files are saved, before any
+            inference code is added to it.
+        output_dir (str): output data directory of the training job.
+        framework (str): training framework of the model.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path) and name != MANIFEST_FILE:
+            shutil.copy(path, os.path.join(output_dir, name))
+    save_manifest(model_dir=output_dir, framework=framework)
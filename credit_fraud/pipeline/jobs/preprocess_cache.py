@@ -0,0 +1,20 @@
+"""Raw data cache keys, shared by the preprocessing jobs.
+
+Raw CSV sources are converted once to parquet under a key derived from the
+versions of their files, so later runs read the typed columnar copy instead.
+"""
+
+import hashlib
+from typing import Dict
+
+from preprocess_io import normalize_path
+
+
+def source_fingerprint(source_files: Dict[str, str]) -> str:
+    """Key of a raw source, changes whenever one of its files is added or rewritten."""
+    digest = hashlib.sha256()
+    for path, version in sorted(
+        (normalize_path(path), version) for path, version in source_files.items()
+    ):
+        digest.update(f"{path}\0{version}\n".encode())
+    return digest.hexdigest()[:16]
@@ -0,0 +1,337 @@
+"""Preprocessing job for DuckDB framework.
+
+DuckDB parses, sorts, splits, scales and writes the raw data with every core of
+a single processing instance. The splits hold the same rows in the same order
+as the Scikit-Learn job, scaled with the same MinMaxScaler and RobustScaler
+statistics, which are saved like the PySpark ones. Train negatives are
+downsampled on the same hashes too, and the raw data goes through the same data
+quality gate.
+"""
+
+import logging
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+# Container folder of the processing inputs and outputs, remapped by local runs
+local_dir = os.environ.get("SM_PROCESSING_DIR", "/opt/ml/processing")
+
+# Shared helpers, shipped as a processing input
+sys.path.insert(0, f"{local_dir}/input/common")
+import preprocess_io  # noqa: E402
+import preprocess_quality  # noqa: E402
+import preprocess_sampling  # noqa: E402
+import preprocess_schema  # noqa: E402
+
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler())
+
+# Pinned release, its wheels are downloaded by the pipeline image build
+DUCKDB_VERSION = "1.1.3"
+SQL_TYPES = {"float32": "FLOAT", "float64": "DOUBLE"}
+BYTES_PER_VALUE = {"float32": 4, "float64": 8}
+
+
+def import_duckdb():
+    """Import duckdb, installing the pinned wheel of the inputs when it is missing.
+
+    The wheel is installed without reaching a package index, so every job runs
+    the same duckdb release.
+    """
+    global duckdb
+    try:
+        import duckdb
+    except ImportError:
+        logger.info(f"Installing duckdb {DUCKDB_VERSION}")
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--quiet",
+                "--no-index",
+                "--find-links",
+                f"{local_dir}/input/dependencies",
+                f"duckdb=={DUCKDB_VERSION}",
+            ]
+        )
+        import duckdb
+
+
+def fit_scalers(con, num_train: int) -> dict:
+    """Statistics of the scalers on the first `num_train` rows of the sorted data.
+
+    Minimums and maximums are aggregated by DuckDB. The robust columns are
+    fetched and reduced with the numpy functions of the Scikit-Learn job, so the
+    quartiles interpolate exactly like RobustScaler.
+    """
+    row = con.execute(
+        "SELECT "
+        + ", ".join(
+            f"min({col}), max({col})" for col in preprocess_schema.MIN_MAX_COLUMNS
+        )
+        + f" FROM ordered WHERE rowid < {num_train}"
+    ).fetchone()
+    scalers = {
+        "min_max": {
+            col: {"min": row[2 * col_id], "max": row[2 * col_id + 1]}
+            for col_id, col in enumerate(preprocess_schema.MIN_MAX_COLUMNS)
+        },
+        "robust": {},
+    }
+    for col in preprocess_schema.ROBUST_COLUMNS:
+        values = con.execute(
+            f"SELECT {col} FROM ordered WHERE rowid < {num_train} AND {col} IS NOT NULL"
+        ).fetchnumpy()[col]
+        q1, q3 = np.nanpercentile(values, [25, 75])
+        scalers["robust"][col] = {
+            "q1": float(q1),
+            "median": float(np.nanmedian(values)),
+            "q3": float(q3),
+        }
+    return scalers
+
+
+def scaled_columns(scalers: dict, feature_dtype: str) -> list:
+    """SQL expressions of the scaled features, with the Scikit-Learn job operations."""
+    sql_type = SQL_TYPES[feature_dtype]
+    expressions = []
+    for col, stats in scalers["min_max"].items():
+        data_range = stats["max"] - stats["min"]
+        scale = 1.0 / data_range if data_range != 0 else 1.0
+        offset = 0 - stats["min"] * scale
+        expressions.append(
+            f"CAST({col} * CAST('{scale!r}' AS DOUBLE)"
+            f" + CAST('{offset!r}' AS DOUBLE) AS {sql_type}) AS {col}"
+        )
+    for col, stats in scalers["robust"].items():
+        scale = (stats["q3"] - stats["q1"]) or 1.0
+        expressions.append(
+            f"CAST(({col} - CAST('{stats['median']!r}' AS DOUBLE))"
+            f" / CAST('{scale!r}' AS DOUBLE) AS {sql_type}) AS {col}"
+        )
+    return expressions
+
+
+def sampling_hash(salt: int = 0) -> str:
+    """SQL expression of `preprocess_sampling.sampling_hash` on the raw columns."""
+    time = duckdb.FunctionExpression("floor", duckdb.ColumnExpression("Time"))
+    feature = duckdb.CoalesceOperator(
+        duckdb.ColumnExpression(preprocess_sampling.SAMPLING_FEATURE),
+        duckdb.ConstantExpression(0.0),
+    )
+    return str(
+        preprocess_sampling.sampling_hash(
+            time.cast(duckdb.typing.BIGINT),
+            duckdb.FunctionExpression(
+                "round", feature * preprocess_sampling.SAMPLING_SCALE
+            ).cast(duckdb.typing.BIGINT),
+            salt,
+        )
+    )
+
+
+def sample_negatives(con, num_train: int, ratio: float) -> int:
+    """Stage the kept train rows in the `sampled` table, in the order of `ordered`.
+
+    Returns:
+        int: the number of kept rows, every positive and a `ratio` of the negatives.
+    """
+    con.execute(
+        f"CREATE TABLE sampled AS SELECT * FROM ordered WHERE rowid < {num_train}"
+        " AND (Class != 0 OR sampling_hash"
+        f" < {preprocess_sampling.sampling_threshold(ratio)}) ORDER BY rowid"
+    )
+    num_kept = con.execute("SELECT count(*) FROM sampled").fetchone()[0]
+    logger.info(f"Negative sampling kept {num_kept} of {num_train} train rows")
+    return num_kept
+
+
+def quality_statistics(con) -> dict:
+    """Data quality statistics of the `raw` table, computed in a single aggregation.
+
+    See `preprocess_quality.merge_quality_statistics`.
+    """
+    columns = [
+        column[0] for column in con.execute("SELECT * FROM raw LIMIT 0").description
+    ]
+    aggregates = {
+        "rows": "count(*)",
+        "frauds": "count_if(Class = 1)",
+        "invalid_class": "count_if(Class NOT IN (0, 1))",
+        "fractional_time": "count_if(Time != floor(Time))",
+    }
+    for function in ("min", "max"):
+        for col in ("Time", "Amount"):
+            aggregates[f"{function}_{col}"] = (
+                f"{function}({col}) FILTER (WHERE isfinite({col}))"
+            )
+    for col in preprocess_schema.RAW_COLUMNS:
+        aggregates[f"nulls_{col}"] = f"count(*) - count({col})"
+        aggregates[f"non_finite_{col}"] = (
+            f"count_if(NOT isfinite(CAST({col} AS DOUBLE)))"
+        )
+    row = dict(
+        zip(
+            aggregates,
+            con.execute(
+                "SELECT "
+                + ", ".join(f"{sql} AS {name}" for name, sql in aggregates.items())
+                + " FROM raw"
+            ).fetchone(),
+        )
+    )
+    return {
+        "columns": columns,
+        **{
+            key: row[key]
+            for key in ("rows", "frauds", "invalid_class", "fractional_time")
+        },
+        **{
+            key: {col: row[f"{key}_{col}"] for col in preprocess_schema.RAW_COLUMNS}
+            for key in ("nulls", "non_finite")
+        },
+        **{
+            key: {col: row[f"{key}_{col}"] for col in ("Time", "Amount")}
+            for key in ("min", "max")
+        },
+    }
+
+
+def save_scalers(scalers: dict, folder: str):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "scalers.json"), "w") as file:
+        json.dump(scalers, file, indent=2)
+
+
+def run(args):
+    feature_columns = (
+        preprocess_schema.MIN_MAX_COLUMNS + preprocess_schema.ROBUST_COLUMNS
+    )
+    source_files = sorted(preprocess_io.list_source_files(args.raw_data_key))
+    types = {col: "DOUBLE" for col in ["Time"] + feature_columns}
+    types["Class"] = "BIGINT"
+
+    with tempfile.TemporaryDirectory(dir=local_dir) as work_dir:
+        con = duckdb.connect()
+        # Spill to the processing volume instead of the container root
+        con.execute(f"SET temp_directory = '{work_dir}'")
+        con.execute("SET preserve_insertion_order = true")
+        if args.threads:
+            con.execute(f"SET threads = {args.threads}")
+
+        logger.info(f"Reading raw data from: {source_files}")
+        con.execute(
+            "CREATE TABLE raw AS SELECT * FROM "
+            "read_csv($files, header = true, types = $types)",
+            {"files": source_files, "types": types},
+        )
+        if args.data_quality_gate:
+            preprocess_quality.data_quality_gate(quality_statistics(con), args)
+        # rowid follows the insertion order, a stable sort keeps ties in file order
+        sampling = args.negative_sampling_ratio < 1
+        # Every fraud and a fraction of the other rows, after the data quality gate
+        sample_filter = (
+            " WHERE Class = 1 OR "
+            f"{sampling_hash(preprocess_sampling.ROW_SAMPLING_SALT)}"
+            f" < {preprocess_sampling.sampling_threshold(args.sample_fraction)}"
+            if args.sample_fraction < 1
+            else ""
+        )
+        con.execute(
+            "CREATE TABLE ordered AS SELECT Class, "
+            + ", ".join(feature_columns)
+            + (f", {sampling_hash()} AS sampling_hash" if sampling else "")
+            + f" FROM raw{sample_filter} ORDER BY Time, rowid"
+        )
+        con.execute("DROP TABLE raw")
+
+        num_rows = con.execute("SELECT count(*) FROM ordered").fetchone()[0]
+        sizes = preprocess_schema.split_sizes(num_rows, args)
+        logger.info(f"Rows per split: {sizes}")
+
+        logger.info("Fitting scalers on train split")
+        scalers = fit_scalers(con, sizes["train"])
+        save_scalers(scalers, args.scalers_folder)
+
+        logger.info(f"Saving output to S3. Location: {local_dir}")
+        columns = ", ".join(["Class"] + scaled_columns(scalers, args.feature_dtype))
+        # Files and row groups sized like the Scikit-Learn job, on uncompressed rows
+        row_bytes = BYTES_PER_VALUE["float64"] + BYTES_PER_VALUE[
+            args.feature_dtype
+        ] * len(feature_columns)
+        rows_per_file = max(1, args.output_file_size_mb * 1024**2 // row_bytes)
+        rows_per_group = max(1, args.output_row_group_size_mb * 1024**2 // row_bytes)
+        bounds = np.cumsum([0, sizes["train"], sizes["validation"], sizes["test"]])
+        for split, start, end in zip(sizes, bounds[:-1], bounds[1:]):
+            folder = f"{local_dir}/{split}.parquet"
+            os.makedirs(folder, exist_ok=True)
+            table, split_columns = "ordered", columns
+            if split == "train" and sampling:
+                end = sample_negatives(con, end, args.negative_sampling_ratio)
+                weight = 1.0 / args.negative_sampling_ratio
+                table = "sampled"
+                split_columns += (
+                    f", CASE WHEN Class = 0 THEN CAST('{weight!r}' AS DOUBLE)"
+                    f" ELSE 1.0 END AS {preprocess_schema.WEIGHT_COLUMN}"
+                )
+            file_sizes = []
+            for file_start in range(start, end, rows_per_file):
+                path = f"{folder}/part-{len(file_sizes):05d}.parquet"
+                con.execute(
+                    f"COPY (SELECT {split_columns} FROM {table}"
+                    f" WHERE rowid >= {file_start}"
+                    f" AND rowid < {min(end, file_start + rows_per_file)})"
+                    f" TO '{path}' (FORMAT parquet,"
+                    f" COMPRESSION '{args.output_compression}',"
+                    f" ROW_GROUP_SIZE {rows_per_group})"
+                )
+                file_sizes.append(os.path.getsize(path))
+            logger.info(
+                f"Split {split}: {len(file_sizes)} parquet files, "
+                + f"{sum(file_sizes)} bytes"
+                + (
+                    f" (smallest {min(file_sizes)}, largest {max(file_sizes)})"
+                    if file_sizes
+                    else ""
+                )
+            )
+        con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--raw-data-key", type=str)
+    # Not read by the job, it changes the step cache key when the raw files change
+    parser.add_argument("--raw-data-version", type=str)
+    parser.add_argument("--train-ratio", type=float, default=0.7)
+    parser.add_argument("--validation-ratio", type=float, default=0.1)
+    parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--output-compression", type=str, default="zstd")
+    parser.add_argument("--output-file-size-mb", type=int, default=128)
+    parser.add_argument("--output-row-group-size-mb", type=int, default=32)
+    parser.add_argument("--feature-dtype", type=str, default="float32")
+    parser.add_argument("--negative-sampling-ratio", type=float, default=1.0)
+    parser.add_argument("--sample-fraction", type=float, default=1.0)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--incremental-state-uri", type=str)
+    parser.add_argument(
+        "--scalers-folder", type=str, default=f"{local_dir}/scalers"
+    )
+    preprocess_quality.add_data_quality_arguments(parser)
+    args, _ = parser.parse_known_args()
+
+    assert args.train_ratio + args.validation_ratio + args.test_ratio == 1.0
+    # The job keeps no incremental state, every run processes the whole raw data
+    assert not args.incremental_state_uri
+
+    import_duckdb()
+    run(args)
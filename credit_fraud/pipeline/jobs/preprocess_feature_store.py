@@ -0,0 +1,41 @@
+"""Versions of the feature store written by the PySpark preprocessing.
+
+The feature store keeps the scaled rows of every run under
+`scaler_version={version}/time_bucket={bucket}` partitions, so readers prune the
+partitions of a time window. A version hashes the scaler statistics and the
+bucket width, its folder describes them in `_version.json` and the
+`latest.json` file of the store names the version of the last preprocessing.
+"""
+
+import hashlib
+import json
+
+from preprocess_io import write_bytes
+
+
+def feature_store_version(scalers: dict, bucket_seconds: int) -> str:
+    """Version of the feature store rows scaled with `scalers`.
+
+    Returns:
+        str: The first 16 hexadecimal digits of the SHA-256 digest.
+    """
+    return hashlib.sha256(
+        json.dumps([scalers, bucket_seconds], sort_keys=True).encode()
+    ).hexdigest()[:16]
+
+
+def save_feature_store_version(
+    uri: str, version: str, scalers: dict, bucket_seconds: int
+):
+    """Describe a written feature store version and make it the latest one."""
+    description = {
+        "scaler_version": version,
+        "time_bucket_seconds": bucket_seconds,
+        "scalers": scalers,
+    }
+    write_bytes(
+        f"{uri}/scaler_version={version}/_version.json",
+        json.dumps(description, indent=2).encode(),
+    )
+    latest = {"scaler_version": version, "time_bucket_seconds": bucket_seconds}
+    write_bytes(f"{uri}/latest.json", json.dumps(latest).encode())
@@ -0,0 +1,159 @@
+"""Incremental preprocessing state, shared by the Scikit-Learn and PySpark jobs.
+
+The state file records, for every raw partition already processed, its version
+(S3 ETag or file modification time) and the sufficient statistics of its train
+rows: row counts, per-column minimum and maximum and a mergeable quantile sketch
+for the robust scaled columns. Merging the statistics of all partitions gives
+the scaler statistics of the whole history without reading it again.
+
+A run commits its state in two steps. `save_pending_state` writes the new state
+to `{uri}.pending` with the processed files it depends on, before they are all
+durable. The next `load_state` promotes it once every listed file exists, and
+otherwise deletes the listed files that made it and keeps the committed state,
+so a failed upload never moves the watermark past rows that were not written.
+"""
+
+import json
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from preprocess_io import (
+    delete_file,
+    exists,
+    normalize_path,
+    read_bytes,
+    write_bytes,
+)
+from preprocess_sketch import DDSketch
+
+
+logger = logging.getLogger()
+
+STATE_VERSION = 1
+
+
+def new_state() -> dict:
+    return {"version": STATE_VERSION, "partitions": {}, "scalers": None}
+
+
+def load_state(uri: str) -> dict:
+    """Read the state from S3 or a local path, a new state when it does not exist.
+
+    A pending state left by the previous run is resolved first, see the module
+    docstring.
+    """
+    pending_uri = f"{uri}.pending"
+    if exists(pending_uri):
+        pending = json.loads(read_bytes(pending_uri))
+        missing = [path for path in pending["files"] if not exists(path)]
+        if missing:
+            logger.info(
+                f"Discarding pending incremental state, {len(missing)} of "
+                + f"{len(pending['files'])} processed files are missing"
+            )
+            for path in pending["files"]:
+                if path not in missing:
+                    delete_file(path)
+        else:
+            logger.info("Committing pending incremental state")
+            commit_state(uri, pending["state"])
+        delete_file(pending_uri)
+
+    if not exists(uri):
+        return new_state()
+    state = json.loads(read_bytes(uri))
+    if state.get("version") != STATE_VERSION:
+        logger.info(f"Ignoring incremental state with version {state.get('version')}")
+        return new_state()
+    return state
+
+
+def save_state(uri: str, state: dict):
+    write_bytes(uri, json.dumps(state).encode())
+
+
+def commit_state(uri: str, state: dict):
+    """Save the state once the files of its pending state are all durable."""
+    save_state(uri, state)
+    delete_file(f"{uri}.pending")
+
+
+def save_pending_state(uri: str, state: dict, files: List[str]):
+    """Save a state that only takes effect once every one of `files` exists."""
+    write_bytes(f"{uri}.pending", json.dumps({"state": state, "files": files}).encode())
+
+
+def pending_files(state: dict, source_files: Dict[str, str]) -> Tuple[List[str], bool]:
+    """Select the raw files newer than the state watermark.
+
+    Returns:
+        Tuple[List[str], bool]: the files to process and whether every file must be
+            reprocessed, when a processed file was rewritten or removed.
+    """
+    known = state["partitions"]
+    current = {normalize_path(path): version for path, version in source_files.items()}
+    changed = [
+        path
+        for path, partition in known.items()
+        if not path.startswith("rds:") and current.get(path) != partition["version"]
+    ]
+    if changed:
+        logger.info(f"Raw files changed or removed since last run: {changed}")
+        return sorted(source_files), True
+    return sorted(p for p in source_files if normalize_path(p) not in known), False
+
+
+def merge_statistics(partitions: Iterable[dict]) -> dict:
+    """Merge the partition statistics into scaler statistics.
+
+    Returns:
+        dict: min-max and robust statistics, in the format of `scalers.json`.
+    """
+    minimums, maximums, sketches = {}, {}, {}
+    for partition in partitions:
+        for col, value in partition["min"].items():
+            if value is not None:
+                minimums[col] = min(value, minimums.get(col, value))
+        for col, value in partition["max"].items():
+            if value is not None:
+                maximums[col] = max(value, maximums.get(col, value))
+        for col, data in partition["sketches"].items():
+            sketches.setdefault(col, DDSketch(data["relative_accuracy"]))
+            sketches[col].merge(DDSketch.from_dict(data))
+    return {
+        "min_max": {
+            col: {"min": minimums[col], "max": maximums[col]} for col in minimums
+        },
+        "robust": {
+            col: {
+                "q1": sketch.quantile(0.25),
+                "median": sketch.quantile(0.5),
+                "q3": sketch.quantile(0.75),
+            }
+            for col, sketch in sketches.items()
+        },
+    }
+
+
+def scalers_drifted(frozen: dict, merged: dict, threshold: float) -> bool:
+    """Whether the merged statistics moved too far from the frozen scalers.
+
+    Ranges and interquartile ranges are compared relatively, the median shift
+    relatively to the frozen interquartile range.
+    """
+    for col, stats in frozen["min_max"].items():
+        old_range = stats["max"] - stats["min"]
+        new_range = merged["min_max"][col]["max"] - merged["min_max"][col]["min"]
+        if abs(new_range - old_range) > threshold * abs(old_range):
+            logger.info(f"Range of {col} drifted from {old_range} to {new_range}")
+            return True
+    for col, stats in frozen["robust"].items():
+        old_iqr = stats["q3"] - stats["q1"]
+        new_iqr = merged["robust"][col]["q3"] - merged["robust"][col]["q1"]
+        median_shift = abs(merged["robust"][col]["median"] - stats["median"])
+        if abs(new_iqr - old_iqr) > threshold * old_iqr or (
+            median_shift > threshold * old_iqr
+        ):
+            logger.info(f"Quantiles of {col} drifted: IQR {old_iqr} -> {new_iqr}")
+            return True
+    return False
@@ -0,0 +1,141 @@
+"""Access to the raw files and the job state on S3 or local paths, shared by the
+preprocessing jobs.
+
+boto3 is imported only when a S3 URI is accessed, so local runs and local paths
+do not need it.
+"""
+
+import os
+import shutil
+from typing import BinaryIO, Dict
+from urllib.parse import unquote, urlparse
+
+
+def normalize_path(path: str) -> str:
+    """Scheme independent identifier of a raw file, e.g. `bucket/raw/day.csv`."""
+    location = urlparse(path)
+    return unquote(f"{location.netloc}{location.path}")
+
+
+def list_source_files(uri: str) -> Dict[str, str]:
+    """List the raw CSV files under a S3 prefix or local path with their versions.
+
+    Returns:
+        Dict[str, str]: the file URIs mapped to their ETag or modification time.
+    """
+    files = {}
+    if uri.startswith("s3://"):
+        import boto3
+
+        location = urlparse(uri)
+        paginator = boto3.client("s3").get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=location.netloc, Prefix=location.path.lstrip("/")
+        ):
+            for item in page.get("Contents", []):
+                if item["Key"].endswith(".csv"):
+                    files[f"s3://{location.netloc}/{item['Key']}"] = item["ETag"]
+    elif os.path.isdir(uri):
+        for name in sorted(os.listdir(uri)):
+            if name.endswith(".csv"):
+                path = os.path.join(uri, name)
+                files[path] = str(os.stat(path).st_mtime_ns)
+    else:
+        files[uri] = str(os.stat(uri).st_mtime_ns)
+    return files
+
+
+def exists(uri: str) -> bool:
+    """Whether an object exists on S3 or a file on a local path."""
+    if uri.startswith("s3://"):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        location = urlparse(uri)
+        try:
+            boto3.client("s3").head_object(
+                Bucket=location.netloc, Key=location.path.lstrip("/")
+            )
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+    return os.path.exists(uri)
+
+
+def open_bytes(uri: str) -> BinaryIO:
+    """Open a file from S3 or a local path as a binary stream."""
+    if uri.startswith("s3://"):
+        import boto3
+
+        location = urlparse(uri)
+        response = boto3.client("s3").get_object(
+            Bucket=location.netloc, Key=location.path.lstrip("/")
+        )
+        return response["Body"]
+    return open(uri, "rb")
+
+
+def read_bytes(uri: str) -> bytes:
+    """Read a file from S3 or a local path."""
+    with open_bytes(uri) as stream:
+        return stream.read()
+
+
+def copy_file(source: str, destination: str):
+    """Copy a file between S3 and local paths, without loading it in memory."""
+    if source.startswith("s3://") or destination.startswith("s3://"):
+        import boto3
+
+        s3_client = boto3.client("s3")
+        if source.startswith("s3://"):
+            location = urlparse(source)
+            s3_client.download_file(
+                location.netloc, location.path.lstrip("/"), destination
+            )
+        else:
+            location = urlparse(destination)
+            s3_client.upload_file(source, location.netloc, location.path.lstrip("/"))
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    shutil.copyfile(source, destination)
+
+
+def write_bytes(uri: str, body: bytes):
+    """Write a file to S3 or a local path, S3 objects appear atomically."""
+    if uri.startswith("s3://"):
+        import boto3
+
+        location = urlparse(uri)
+        boto3.client("s3").put_object(
+            Bucket=location.netloc, Key=location.path.lstrip("/"), Body=body
+        )
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(uri)), exist_ok=True)
+        with open(uri, "wb") as file:
+            file.write(body)
+
+
+def delete_file(uri: str):
+    """Delete an object on S3 or a file on a local path, if it exists."""
+    if uri.startswith("s3://"):
+        import boto3
+
+        location = urlparse(uri)
+        boto3.client("s3").delete_object(
+            Bucket=location.netloc, Key=location.path.lstrip("/")
+        )
+    elif os.path.exists(uri):
+        os.remove(uri)
+
+
+def delete_prefix(uri: str):
+    """Delete every object of a processed S3 dataset before it is rebuilt."""
+    if not (uri or "").startswith("s3://"):
+        return
+    import boto3
+
+    location = urlparse(uri)
+    bucket = boto3.resource("s3").Bucket(location.netloc)
+    bucket.objects.filter(Prefix=location.path.lstrip("/").rstrip("/") + "/").delete()
@@ -2,11 +2,16 @@
 
 import logging
 import argparse
+import json
+import math
 import os
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-from pyspark.sql import SparkSession, DataFrame
+from pyspark import StorageLevel, inheritable_thread_target
+from pyspark.sql import SparkSession
 import pyspark.sql.functions as f
-from pyspark.sql.window import Window
 from pyspark.sql.types import (
     StructField,
     StructType,
@@ -14,53 +19,971 @@ from pyspark.sql.types import (
     IntegerType,
     FloatType,
 )
-from pyspark.ml.feature import MinMaxScaler, RobustScaler
-from pyspark.ml.functions import vector_to_array
-from pyspark.ml import Pipeline
-from pyspark.ml.feature import VectorAssembler
+
+import preprocess_cache
+import preprocess_feature_store
+import preprocess_incremental
+import preprocess_io
+import preprocess_quality
+import preprocess_sampling
+import preprocess_schema
+import preprocess_sketch
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+# Container folder of the processing inputs and outputs, remapped by local runs
+local_dir = os.environ.get("SM_PROCESSING_DIR", "/opt/ml/processing")
+# Relative error of the quantiles, matches the default of Spark's RobustScaler
+ROBUST_RELATIVE_ERROR = 0.001
+# Uncompressed size of a processed value, used to size the output files
+BYTES_PER_VALUE = 8
+# Stage metrics summed over the stages of a job group
+STAGE_METRICS_TOTALS = [
+    "executor_run_time_ms",
+    "input_bytes",
+    "shuffle_read_bytes",
+    "shuffle_write_bytes",
+    "memory_spilled_bytes",
+    "disk_spilled_bytes",
+]
+
+
+def fit_scalers(df, min_max_columns: list, robust_columns: list) -> dict:
+    """Compute the statistics of every scaler in a single aggregation.
+
+    Min-max columns keep their minimum and maximum. Robust columns keep their
+    quartiles and median, approximated with the relative error of Spark's
+    RobustScaler.
+    """
+    row = df.agg(
+        *[f.min(col).alias(f"{col}_min") for col in min_max_columns],
+        *[f.max(col).alias(f"{col}_max") for col in min_max_columns],
+        *[
+            f.percentile_approx(
+                col, [0.25, 0.5, 0.75], int(1 / ROBUST_RELATIVE_ERROR)
+            ).alias(f"{col}_quantiles")
+            for col in robust_columns
+        ],
+    ).first()
+    return {
+        "min_max": {
+            col: {"min": row[f"{col}_min"], "max": row[f"{col}_max"]}
+            for col in min_max_columns
+        },
+        "robust": {
+            col: dict(zip(("q1", "median", "q3"), row[f"{col}_quantiles"]))
+            for col in robust_columns
+        },
+    }
+
+
+def transform_dataframe(df, scalers: dict):
+    """Scale the tagged dataset with plain column arithmetic.
+
+    Results match Spark's MinMaxScaler (constant columns become 0.5) and
+    RobustScaler without centering (a zero interquartile range gives 0). `Time`
+    is kept to order the output files and dropped when they are written, like
+    the weights outside of the train split.
+    """
+    min_max_features = []
+    for col, stats in scalers["min_max"].items():
+        value_range = stats["max"] - stats["min"]
+        if value_range != 0:
+            # Same operation order as Spark, for bit-identical outputs
+            scaled = (f.col(col).cast("double") - stats["min"]) * (1.0 / value_range)
+        else:
+            scaled = f.lit(0.5)
+        min_max_features.append(scaled.alias(col))
+
+    robust_features = []
+    for col, stats in scalers["robust"].items():
+        value_range = stats["q3"] - stats["q1"]
+        scale = 1.0 / value_range if value_range != 0 else 0.0
+        robust_features.append((f.col(col).cast("double") * scale).alias(col))
+
+    weights = [
+        col for col in [preprocess_schema.WEIGHT_COLUMN] if col in df.columns
+    ]
+    # `Class` need to come first.
+    return df.select(
+        "Class", *min_max_features, *robust_features, *weights, "Time", "split"
+    )
+
+
+def sampling_hash(salt: int = 0):
+    """Column of `preprocess_sampling.sampling_hash` on the raw columns."""
+    return preprocess_sampling.sampling_hash(
+        f.floor(f.col("Time")).cast("bigint"),
+        f.round(
+            f.coalesce(f.col(preprocess_sampling.SAMPLING_FEATURE), f.lit(0.0))
+            * preprocess_sampling.SAMPLING_SCALE
+        ).cast("bigint"),
+        salt,
+    )
+
+
+def sample_rows(df, fraction: float):
+    """Keep every fraud and a deterministic `fraction` of the other raw rows."""
+    if fraction >= 1:
+        return df
+    return df.filter(
+        (f.col("Class") == 1)
+        | (
+            sampling_hash(preprocess_sampling.ROW_SAMPLING_SALT)
+            < preprocess_sampling.sampling_threshold(fraction)
+        )
+    )
+
+
+def sample_negatives(df, ratio: float):
+    """Keep a `ratio` of the negative train rows, weighted by `1 / ratio`.
+
+    Rows are selected with `preprocess_sampling.sampling_hash`, like the other
+    preprocessing jobs. Positive train rows get a weight of 1 and validation and
+    test rows are all kept.
+    """
+    if ratio >= 1:
+        return df
+    is_train_negative = (f.col("split") == "train") & (f.col("Class") == 0)
+    return df.filter(
+        ~is_train_negative
+        | (sampling_hash() < preprocess_sampling.sampling_threshold(ratio))
+    ).withColumn(
+        preprocess_schema.WEIGHT_COLUMN,
+        f.when(is_train_negative, 1.0 / ratio).otherwise(1.0),
+    )
+
+
+def source_columns(args, df, paths: list = None) -> list:
+    """Header of the raw CSV files, read from their first line, or the RDS columns.
+
+    CSV files are parsed with a fixed schema, which ignores the header names.
+    """
+    if args.source_method.lower() == "s3":
+        return spark.read.csv(paths or args.raw_data_key, header=True).columns
+    return df.columns
+
+
+def quality_statistics(df, columns: list) -> dict:
+    """Data quality statistics of the raw rows, computed in a single aggregation.
+
+    See `preprocess_quality.merge_quality_statistics`. Values that do not parse
+    with the schema, like a Time in scientific notation, are read as nulls.
+    """
+
+    def is_finite(col):
+        value = f.col(col).cast("double")
+        return ~f.isnan(value) & (f.abs(value) != math.inf)
+
+    def count_if(condition):
+        return f.coalesce(f.sum(condition.cast("int")), f.lit(0))
+
+    row = df.agg(
+        f.count(f.lit(1)).alias("rows"),
+        count_if(f.col("Class") == 1).alias("frauds"),
+        count_if(~f.col("Class").isin(0, 1)).alias("invalid_class"),
+        count_if(f.col("Time") != f.floor("Time")).alias("fractional_time"),
+        *[
+            function(f.when(is_finite(col), f.col(col))).alias(
+                f"{function.__name__}_{col}"
+            )
+            for function in (f.min, f.max)
+            for col in ("Time", "Amount")
+        ],
+        *[
+            count_if(f.col(col).isNull()).alias(f"nulls_{col}")
+            for col in preprocess_schema.RAW_COLUMNS
+        ],
+        *[
+            count_if(~is_finite(col)).alias(f"non_finite_{col}")
+            for col in preprocess_schema.RAW_COLUMNS
+        ],
+    ).first()
+    return {
+        "columns": columns,
+        **{
+            key: row[key]
+            for key in ("rows", "frauds", "invalid_class", "fractional_time")
+        },
+        **{
+            key: {col: row[f"{key}_{col}"] for col in preprocess_schema.RAW_COLUMNS}
+            for key in ("nulls", "non_finite")
+        },
+        **{
+            key: {col: row[f"{key}_{col}"] for col in ("Time", "Amount")}
+            for key in ("min", "max")
+        },
+    }
+
+
+def count_source(df, args, columns: list) -> int:
+    """Count the persisted source rows, within the data quality aggregation when
+    the gate is enabled, so checking the data costs no extra pass."""
+    if not args.data_quality_gate:
+        return df.count()
+    quality = quality_statistics(df, columns)
+    preprocess_quality.data_quality_gate(quality, args)
+    return quality["rows"]
+
+
+def read_source(args, schema, paths: list = None, time_after: int = None):
+    """Read the raw CSV files, or the RDS table rows after a Time watermark."""
+    if args.source_method.lower() == "s3":
+        return spark.read.csv(paths or args.raw_data_key, header=True, schema=schema)
+    return read_jdbc(args, time_after)
+
+
+def read_raw(args, schema):
+    """Read the raw source, through its parquet copy when a cache is configured.
+
+    The copy of S3 sources is keyed by the ETags of the raw files, so the CSV
+    files are parsed only when they change. Later runs read typed columns only.
+    """
+    if args.source_method.lower() != "s3" or not args.raw_cache_folder:
+        return read_source(args, schema)
+
+    source_files = preprocess_io.list_source_files(args.raw_data_key)
+    cache_uri = (
+        f"{args.raw_cache_folder}/{preprocess_cache.source_fingerprint(source_files)}"
+    )
+    if preprocess_io.exists(f"{cache_uri}/_SUCCESS"):
+        logger.info(f"Reading raw data from cache: {cache_uri}")
+        return spark.read.schema(schema).parquet(cache_uri)
+
+    logger.info(f"Converting raw data from {args.raw_data_key} to {cache_uri}")
+    spark.sparkContext.setJobGroup("convert-raw", "Convert raw data to parquet")
+    (
+        read_source(args, schema, paths=sorted(source_files))
+        .write.mode("overwrite")
+        .option("compression", args.output_compression)
+        .parquet(cache_uri)
+    )
+    return spark.read.schema(schema).parquet(cache_uri)
+
+
+def jdbc_url(args) -> str:
+    """URL of the source database, RDS MySQL unless `--jdbc-url` is set."""
+    if args.jdbc_url is not None:
+        return args.jdbc_url
+    host = os.environ.get("RDS_HOST_URL")
+    # Connector/J ignores the fetch size and buffers whole results without it
+    return f"jdbc:mysql://{host}{'&' if '?' in host else '?'}useCursorFetch=true"
+
+
+def jdbc_reader(args):
+    """JDBC reader of the source database, without table or query."""
+    reader = (
+        spark.read.format("jdbc")
+        .option("url", jdbc_url(args))
+        .option("driver", args.jdbc_driver)
+        .option("fetchsize", args.jdbc_fetch_size)
+    )
+    for option, variable in (
+        ("user", "RDS_SECRET_USERNAME"),
+        ("password", "RDS_SECRET_PASSWORD"),
+    ):
+        if os.environ.get(variable) is not None:
+            reader = reader.option(option, os.environ[variable])
+    return reader
+
+
+def read_jdbc(args, time_after: int = None):
+    """Read the table with parallel range queries on Time.
+
+    The Time bounds of the rows to read come first from a single aggregate query
+    run by the database. The range is then split in `numPartitions` strides,
+    each read by its own connection. The watermark predicate is pushed down to
+    every query, so only rows after it leave the database.
+    """
+    time_column = spark.sparkContext._jvm.org.apache.spark.sql.jdbc.JdbcDialects.get(
+        jdbc_url(args)
+    ).quoteIdentifier("Time")
+    bounds_query = (
+        f"SELECT MIN({time_column}) AS lower_bound, MAX({time_column}) AS upper_bound "
+        + f"FROM {args.jdbc_table}"
+    )
+    watermark = None
+    if time_after is not None:
+        bounds_query += f" WHERE {time_column} > {time_after}"
+        watermark = f.col("Time") > time_after
+    lower_bound, upper_bound = (
+        jdbc_reader(args).option("query", bounds_query).load().first()
+    )
+    if lower_bound is None:
+        logger.info(f"No rows in {args.jdbc_table} after Time {time_after}")
+        num_partitions = 1
+    else:
+        num_partitions = (
+            args.jdbc_num_partitions or spark.sparkContext.defaultParallelism
+        )
+        # Partition bounds are integral even when Time is stored as a double
+        lower_bound, upper_bound = math.floor(lower_bound), math.floor(upper_bound)
+        num_partitions = max(1, min(num_partitions, upper_bound - lower_bound + 1))
+        logger.info(
+            f"Reading {args.jdbc_table} in {num_partitions} partitions "
+            + f"on Time [{lower_bound}, {upper_bound}]"
+        )
+
+    reader = jdbc_reader(args).option("dbtable", args.jdbc_table)
+    if num_partitions > 1:
+        reader = (
+            reader.option("partitionColumn", "Time")
+            .option("lowerBound", lower_bound)
+            .option("upperBound", upper_bound + 1)
+            .option("numPartitions", num_partitions)
+        )
+    df = reader.load()
+    return df.filter(watermark) if watermark is not None else df
+
 
-def move_column_to_first(df: DataFrame, col: str):
-    df_columns = df.columns
-    df_columns.remove(col)
-    return df.select(col, *df_columns)
+def write_split(df, split: str, path: str, args, mode: str, num_files: int):
+    """Write a split as `num_files` Time-ordered parquet files.
 
+    Files hold contiguous Time ranges and rows are sorted within them, so the
+    row groups cover narrow Time ranges and the files keep the dataset order.
+    """
+    spark.sparkContext.setJobGroup(f"write-{split}", f"Write {split} split")
+    (
+        df.filter(f.col("split") == split)
+        .drop("split", *([] if split == "train" else [preprocess_schema.WEIGHT_COLUMN]))
+        .repartitionByRange(num_files, "Time")
+        .sortWithinPartitions("Time")
+        .drop("Time")
+        .write.mode(mode)
+        .option("compression", args.output_compression)
+        .option("parquet.block.size", args.output_row_group_size_mb * 1024**2)
+        .parquet(path)
+    )
+    log_output_files(split, path)
 
-def transform_dataframe(df):
-    # Apply Scaling to training dataset
-    df_scaled = scalerModel.transform(df)
-    for i in range(1, 29):
-        df_scaled = df_scaled.withColumn(
-            f"V{i}", vector_to_array("min_max_features_scaled").getItem(i)
+
+def write_splits(df_scaled, split_folders: dict, args, mode: str = "overwrite"):
+    """Write the three splits of the same scaled DataFrame as concurrent jobs.
+
+    The number of files of each split is derived from its row count and the
+    target file size, estimated on uncompressed values.
+    """
+    spark.sparkContext.setJobGroup("output-layout", "Count rows per split")
+    split_rows = {
+        row["split"]: row["count"]
+        for row in df_scaled.groupBy("split").count().collect()
+    }
+    row_bytes = BYTES_PER_VALUE * (len(df_scaled.columns) - 2)
+    num_files = {
+        split: max(
+            1,
+            math.ceil(
+                split_rows.get(split, 0)
+                * row_bytes
+                / (args.output_file_size_mb * 1024**2)
+            ),
         )
-    df_scaled = df_scaled.withColumn(
-        "Amount", vector_to_array("Amount_scaled").getItem(0)
-    ).drop("min_max_features", "min_max_features_scaled", "Amount_vec", "Amount_scaled")
-    # Reorder columns. `Class` need to come first.
-    df_reordered = move_column_to_first(df_scaled, "Class")
-    return df_reordered
+        for split in split_folders
+    }
+    with ThreadPoolExecutor(max_workers=len(split_folders)) as executor:
+        futures = [
+            executor.submit(
+                inheritable_thread_target(write_split),
+                df_scaled,
+                split,
+                path,
+                args,
+                mode,
+                num_files[split],
+            )
+            for split, path in split_folders.items()
+        ]
+        for future in futures:
+            future.result()
+
+
+def write_feature_store(
+    df_scaled, scalers: dict, args, mode: str = "overwrite", folder: str = None
+) -> str:
+    """Write the scaled rows to the feature store, partitioned by time bucket.
+
+    Rows keep their `Time` and drop the split and weight columns, which depend
+    on the pipeline parameters. Every time bucket is written as one Time-ordered
+    file, and overwrites only replace the buckets of the written rows. Rows
+    written to a staging `folder` instead are moved into the version folder and
+    described by the caller.
+
+    Returns:
+        str: The feature store version of the rows.
+    """
+    version = preprocess_feature_store.feature_store_version(
+        scalers, args.feature_store_bucket_seconds
+    )
+    spark.sparkContext.setJobGroup("write-feature-store", "Write feature store")
+    (
+        df_scaled.drop("split", preprocess_schema.WEIGHT_COLUMN)
+        .withColumn(
+            "time_bucket",
+            f.floor(f.col("Time") / args.feature_store_bucket_seconds),
+        )
+        .repartition("time_bucket")
+        .sortWithinPartitions("Time")
+        .write.mode(mode)
+        .option("partitionOverwriteMode", "dynamic")
+        .option("compression", args.output_compression)
+        .partitionBy("time_bucket")
+        .parquet(folder or f"{args.feature_store_uri}/scaler_version={version}")
+    )
+    if folder is None:
+        preprocess_feature_store.save_feature_store_version(
+            args.feature_store_uri, version, scalers, args.feature_store_bucket_seconds
+        )
+    logger.info(f"Wrote feature store version {version} ({mode})")
+    return version
+
+
+def file_system_path(path: str):
+    """Hadoop path of a S3 URI or local path, with its file system."""
+    location = spark.sparkContext._jvm.org.apache.hadoop.fs.Path(path)
+    return location, location.getFileSystem(
+        spark.sparkContext._jsc.hadoopConfiguration()
+    )
+
+
+def log_output_files(split: str, path: str):
+    """Log the number and sizes of the parquet files of a processed split."""
+    location, file_system = file_system_path(path)
+    sizes = [
+        status.getLen()
+        for status in file_system.listStatus(location)
+        if status.getPath().getName().endswith(".parquet")
+    ]
+    logger.info(
+        f"Split {split}: {len(sizes)} parquet files, {sum(sizes)} bytes"
+        + (f" (smallest {min(sizes)}, largest {max(sizes)})" if sizes else "")
+    )
+
+
+def commit_staged_outputs(staging: str, folders: dict, state: dict, args):
+    """Move the files of an append from the staging folder, then commit the state.
+
+    The pending state lists the moved files before the first move, so a job that
+    fails midway leaves no partial append behind, see `preprocess_incremental`.
+    """
+    location, file_system = file_system_path(staging)
+    prefix = file_system.makeQualified(location).toString().rstrip("/") + "/"
+    moves = []
+    files = file_system.listFiles(location, True)
+    while files.hasNext():
+        source = files.next().getPath()
+        if source.getName().startswith(("_", ".")):
+            continue
+        folder, relative_path = source.toString()[len(prefix) :].split("/", 1)
+        moves.append((source, f"{folders[folder].rstrip('/')}/{relative_path}"))
+    preprocess_incremental.save_pending_state(
+        args.incremental_state_uri, state, [target for _, target in moves]
+    )
+    for source, target in moves:
+        target_location, _ = file_system_path(target)
+        file_system.mkdirs(target_location.getParent())
+        if not file_system.rename(source, target_location):
+            raise IOError(f"Could not move {source.toString()} to {target}")
+    logger.info(f"Moved {len(moves)} appended files from {staging}")
+    preprocess_incremental.commit_state(args.incremental_state_uri, state)
+    file_system.delete(location, True)
+
+
+def save_scalers(scalers: dict, folder: str):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "scalers.json"), "w") as file:
+        json.dump(scalers, file, indent=2)
+
+
+def fetch_spark_api(path: str):
+    """Read an endpoint of the Spark REST API of the driver UI."""
+    sc = spark.sparkContext
+    with urllib.request.urlopen(
+        f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/{path}", timeout=10
+    ) as response:
+        return json.load(response)
+
+
+def parse_spark_time(value: str) -> float:
+    """Epoch seconds of a Spark REST API date, e.g. `2024-01-01T12:00:00.000GMT`."""
+    return (
+        datetime.strptime(value.removesuffix("GMT"), "%Y-%m-%dT%H:%M:%S.%f")
+        .replace(tzinfo=timezone.utc)
+        .timestamp()
+    )
+
+
+def collect_stage_metrics(job_groups: list) -> dict:
+    """Collect the metrics of the stages of each job group.
+
+    Stage ids come from the status tracker, metrics from the Spark REST API of
+    the driver UI. Task skew is the longest task run time of a stage over the
+    median one. Input bytes count both data source and persisted block reads:
+    only the `read-source` group scans the source, later groups read the cache.
+    The duration of a group spans from its first stage submission to its last
+    stage completion, stages of concurrent groups overlap.
+    """
+    tracker = spark.sparkContext.statusTracker()
+    stages = {}
+    try:
+        for stage in fetch_spark_api("stages"):
+            if stage["status"] != "COMPLETE":
+                continue
+            task_summary = fetch_spark_api(
+                f"stages/{stage['stageId']}/{stage['attemptId']}"
+                + "/taskSummary?quantiles=0.5,1.0"
+            )
+            median_run_time, max_run_time = task_summary["executorRunTime"]
+            stages[stage["stageId"]] = {
+                "stage_id": stage["stageId"],
+                "attempt_id": stage["attemptId"],
+                "name": stage["name"],
+                "num_tasks": stage["numTasks"],
+                "submission_time": parse_spark_time(stage["submissionTime"]),
+                "completion_time": parse_spark_time(stage["completionTime"]),
+                "executor_run_time_ms": stage["executorRunTime"],
+                "input_bytes": stage["inputBytes"],
+                "shuffle_read_bytes": stage["shuffleReadBytes"],
+                "shuffle_write_bytes": stage["shuffleWriteBytes"],
+                "memory_spilled_bytes": stage["memoryBytesSpilled"],
+                "disk_spilled_bytes": stage["diskBytesSpilled"],
+                "task_skew": max_run_time / median_run_time if median_run_time else 1.0,
+            }
+    except Exception as ex:
+        logger.warning(f"Spark REST API unavailable, stage metrics not collected: {ex}")
+
+    metrics = {"groups": {}, "stages": []}
+    for group in job_groups:
+        job_ids = tracker.getJobIdsForGroup(group)
+        stage_ids = set()
+        for job_id in job_ids:
+            job_info = tracker.getJobInfo(job_id)
+            if job_info is not None:
+                stage_ids.update(job_info.stageIds)
+        group_stages = [stages[stage] for stage in sorted(stage_ids) if stage in stages]
+        metrics["stages"] += [{"group": group, **stage} for stage in group_stages]
+        metrics["groups"][group] = {
+            "jobs": len(job_ids),
+            "stages": len(stage_ids),
+            "duration_seconds": (
+                max(stage["completion_time"] for stage in group_stages)
+                - min(stage["submission_time"] for stage in group_stages)
+                if group_stages
+                else 0.0
+            ),
+            "task_skew": max(
+                (stage["task_skew"] for stage in group_stages), default=1.0
+            ),
+            **{
+                key: sum(stage[key] for stage in group_stages)
+                for key in STAGE_METRICS_TOTALS
+            },
+        }
+        group_metrics = metrics["groups"][group]
+        logger.info(
+            f"Spark job group {group}: {len(job_ids)} jobs, {len(stage_ids)} stages, "
+            + f"{group_metrics['duration_seconds']:.1f}s, "
+            + f"{group_metrics['input_bytes']} input bytes, "
+            + f"{group_metrics['shuffle_write_bytes']} shuffle bytes, "
+            + f"{group_metrics['memory_spilled_bytes']} spilled bytes, "
+            + f"task skew {group_metrics['task_skew']:.1f}"
+        )
+    return metrics
+
+
+def report_stage_metrics(job_groups: list, args):
+    """Save the stage metrics of the job groups next to the processed splits.
+
+    The evaluation job logs them to the MLflow run of the pipeline execution.
+    """
+    metrics = collect_stage_metrics(job_groups)
+    os.makedirs(args.metrics_folder, exist_ok=True)
+    with open(os.path.join(args.metrics_folder, "spark-metrics.json"), "w") as file:
+        json.dump(metrics, file, indent=2)
+
+
+def run_full(args, schema, storage_level, split_folders: dict):
+    """Preprocess the whole raw dataset and overwrite the processed splits."""
+    # Load dataset from s3
+    df = read_raw(args, schema)
+    spark.sparkContext.setJobGroup("read-source", "Read and persist source data")
+
+    # Persist the parsed source so every following action reads it only once
+    df = df.persist(storage_level)
+    num_rows = count_source(df, args, source_columns(args, df))
+    logger.info(f"Persisted {num_rows} source rows with {args.storage_level}")
+    # Sampled after the data quality gate, which checks the whole source
+    df_source, df = df, sample_rows(df, args.sample_fraction)
+
+    # Derive the time boundaries of each split from approximate quantiles, so the
+    # rows are tagged in one distributed pass instead of a single-partition window
+    spark.sparkContext.setJobGroup("split-boundaries", "Compute split boundaries")
+    train_upper_bound, validation_upper_bound = df.approxQuantile(
+        "Time",
+        [args.train_ratio, args.train_ratio + args.validation_ratio],
+        args.split_relative_error,
+    )
+    logger.info(
+        f"Split boundaries on Time: train <= {train_upper_bound}, "
+        + f"validation <= {validation_upper_bound}"
+    )
+    df_tagged = df.withColumn(
+        "split",
+        f.when(f.col("Time") <= train_upper_bound, "train")
+        .when(f.col("Time") <= validation_upper_bound, "validation")
+        .otherwise("test"),
+    )
+
+    # Fit the scalers on the train split and save their statistics
+    spark.sparkContext.setJobGroup("fit-scalers", "Fit scalers on train split")
+    scalers = fit_scalers(
+        df_tagged.filter(f.col("split") == "train"),
+        min_max_columns=preprocess_schema.MIN_MAX_COLUMNS,
+        robust_columns=preprocess_schema.ROBUST_COLUMNS,
+    )
+    save_scalers(scalers, args.scalers_folder)
+
+    write_splits(
+        transform_dataframe(
+            sample_negatives(df_tagged, args.negative_sampling_ratio), scalers
+        ),
+        split_folders,
+        args,
+    )
+    # A sample would replace the full time buckets of the store
+    if args.feature_store_uri and args.sample_fraction == 1.0:
+        write_feature_store(transform_dataframe(df_tagged, scalers), scalers, args)
+    report_stage_metrics(
+        ["convert-raw", "read-source", "split-boundaries", "fit-scalers"]
+        + ["output-layout"]
+        + [f"write-{split}" for split in split_folders]
+        + ["write-feature-store"],
+        args,
+    )
+    df_source.unpersist()
+
+
+def partition_statistics(df, args) -> dict:
+    """Compute the split boundaries and train statistics of each raw partition.
+
+    Every partition is split on its own Time quantiles, so its statistics never
+    change when later partitions arrive and can be merged with the stored ones.
+
+    Returns:
+        dict: the statistics of each partition, keyed by the `partition` column.
+    """
+    bounds = (
+        df.groupBy("partition")
+        .agg(
+            f.percentile_approx(
+                "Time",
+                [args.train_ratio, args.train_ratio + args.validation_ratio],
+                int(1 / args.split_relative_error),
+            ).alias("bounds")
+        )
+        .collect()
+    )
+    statistics = {
+        row["partition"]: {
+            "bounds": row["bounds"],
+            "rows": {},
+            "min": {},
+            "max": {},
+            "sketches": {
+                col: preprocess_sketch.DDSketch()
+                for col in preprocess_schema.ROBUST_COLUMNS
+            },
+        }
+        for row in bounds
+    }
+
+    df_tagged = tag_splits(df, statistics)
+    for row in df_tagged.groupBy("partition", "split").count().collect():
+        statistics[row["partition"]]["rows"][row["split"]] = row["count"]
+
+    df_train = df_tagged.filter(f.col("split") == "train")
+    for row in (
+        df_train.groupBy("partition")
+        .agg(
+            *[
+                function(col).alias(f"{col}_{function.__name__}")
+                for function in (f.min, f.max)
+                for col in preprocess_schema.MIN_MAX_COLUMNS
+            ],
+        )
+        .collect()
+    ):
+        for col in preprocess_schema.MIN_MAX_COLUMNS:
+            statistics[row["partition"]]["min"][col] = row[f"{col}_min"]
+            statistics[row["partition"]]["max"][col] = row[f"{col}_max"]
+
+    # Sketch buckets are computed by Spark, only their counts reach the driver
+    log_gamma = math.log(preprocess_sketch.DDSketch().gamma)
+    for col in preprocess_schema.ROBUST_COLUMNS:
+        value = f.col(col).cast("double")
+        buckets = (
+            df_train.filter(value.isNotNull())
+            .select(
+                "partition",
+                f.when(value > 0, "positive")
+                .when(value < 0, "negative")
+                .otherwise("zero")
+                .alias("store"),
+                f.when(value != 0, f.ceil(f.log(f.abs(value)) / log_gamma)).alias(
+                    "key"
+                ),
+            )
+            .groupBy("partition", "store", "key")
+            .count()
+            .collect()
+        )
+        for row in buckets:
+            statistics[row["partition"]]["sketches"][col].add(
+                row["store"], row["key"], row["count"]
+            )
+
+    for partition in statistics.values():
+        partition["sketches"] = {
+            col: sketch.to_dict() for col, sketch in partition["sketches"].items()
+        }
+    return statistics
+
+
+def tag_splits(df, partitions: dict):
+    """Tag each row with its split from the Time boundaries of its partition."""
+    bounds = spark.createDataFrame(
+        [
+            (partition, float(stats["bounds"][0]), float(stats["bounds"][1]))
+            for partition, stats in partitions.items()
+        ],
+        "partition string, train_bound double, validation_bound double",
+    )
+    return (
+        df.join(f.broadcast(bounds), "partition")
+        .withColumn(
+            "split",
+            f.when(f.col("Time") <= f.col("train_bound"), "train")
+            .when(f.col("Time") <= f.col("validation_bound"), "validation")
+            .otherwise("test"),
+        )
+        .drop("train_bound", "validation_bound")
+    )
+
+
+def run_incremental(args, schema, storage_level, split_folders: dict):
+    """Preprocess only the raw data newer than the state watermark.
+
+    New rows are scaled with the frozen scalers of the state and appended to the
+    processed splits, while their statistics are merged into the state. The
+    splits are rebuilt from the whole history with the merged statistics on the
+    first run, when processed raw files change, or when the merged statistics
+    drift beyond the threshold from the frozen ones.
+    """
+    state = preprocess_incremental.load_state(args.incremental_state_uri)
+    # Appended rows must keep the weights of the processed datasets
+    if state["scalers"] is not None and (
+        state.get("negative_sampling_ratio", 1.0) != args.negative_sampling_ratio
+    ):
+        logger.info(
+            f"Negative sampling ratio changed to {args.negative_sampling_ratio}"
+        )
+        state = preprocess_incremental.new_state()
+    spark.sparkContext.setJobGroup("read-source", "Read and persist new source data")
+    if args.source_method.lower() == "s3":
+        source_files = preprocess_io.list_source_files(args.raw_data_key)
+        paths, rebuild = preprocess_incremental.pending_files(state, source_files)
+        if rebuild:
+            state = preprocess_incremental.new_state()
+        if not paths:
+            logger.info("No raw files newer than the incremental watermark")
+            return
+        logger.info(f"Processing {len(paths)} of {len(source_files)} raw files")
+        source_paths = {
+            preprocess_io.normalize_path(path): path for path in source_files
+        }
+        # The file name is only known while scanning, so it is tagged before caching
+        df_source = read_source(args, schema, paths=paths).withColumn(
+            "partition", f.input_file_name()
+        )
+        df = df_source = df_source.persist(storage_level)
+        num_rows = count_source(df_source, args, source_columns(args, df, paths))
+        logger.info(f"Persisted {num_rows} new source rows")
+    else:
+        rebuild = False
+        time_after = state.get("rds_watermark")
+        df_source = read_source(args, schema, time_after=time_after).persist(
+            storage_level
+        )
+        max_time = df_source.agg(f.max("Time")).first()[0]
+        if max_time is None:
+            logger.info("No RDS rows newer than the incremental watermark")
+            df_source.unpersist()
+            return
+        if args.data_quality_gate:
+            count_source(df_source, args, df_source.columns)
+        df = df_source.withColumn("partition", f.lit(f"rds:{time_after}:{max_time}"))
+
+    state["negative_sampling_ratio"] = args.negative_sampling_ratio
+    spark.sparkContext.setJobGroup("partition-statistics", "Compute statistics")
+    new_partitions = partition_statistics(df, args)
+    for partition, stats in new_partitions.items():
+        stats["source"] = partition
+        if args.source_method.lower() == "s3":
+            path = preprocess_io.normalize_path(partition)
+            stats["path"] = source_paths[path]
+            stats["version"] = source_files[stats["path"]]
+        else:
+            path = partition
+            stats["version"] = None
+            stats["time_range"] = [time_after, max_time]
+            state["rds_watermark"] = max_time
+        state["partitions"][path] = stats
+    logger.info(
+        "New rows per split: "
+        + str(
+            {
+                split: sum(p["rows"].get(split, 0) for p in new_partitions.values())
+                for split in preprocess_schema.SPLITS
+            }
+        )
+    )
+
+    merged = preprocess_incremental.merge_statistics(state["partitions"].values())
+    mode = "append"
+    if state["scalers"] is None or rebuild:
+        logger.info("Building processed splits from the whole history")
+        state["scalers"] = merged
+        mode = "overwrite"
+    elif preprocess_incremental.scalers_drifted(
+        state["scalers"], merged, args.incremental_drift_threshold
+    ):
+        logger.info("Scalers drifted, rebuilding processed splits")
+        state["scalers"] = merged
+        mode = "overwrite"
+        df_source.unpersist()
+        df = read_full_history(args, schema, state)
+
+    # Appends are staged next to the state, so a failed write leaves the outputs
+    # untouched, and moved into them once every split is written
+    staging = f"{os.path.dirname(args.incremental_state_uri)}/staging"
+    if mode == "overwrite":
+        # A rebuild that fails midway leaves no usable state, the next run restarts
+        preprocess_incremental.save_state(
+            args.incremental_state_uri, preprocess_incremental.new_state()
+        )
+        output_folders = split_folders
+    else:
+        location, file_system = file_system_path(staging)
+        file_system.delete(location, True)
+        output_folders = {split: f"{staging}/{split}" for split in split_folders}
+    partitions = {stats["source"]: stats for stats in state["partitions"].values()}
+    df_tagged = tag_splits(df, partitions)
+    df_scaled = transform_dataframe(
+        sample_negatives(df_tagged, args.negative_sampling_ratio),
+        state["scalers"],
+    )
+    write_splits(df_scaled, output_folders, args, mode)
+    if args.feature_store_uri:
+        # Frozen scalers keep the version, so new rows are appended to its buckets
+        version = write_feature_store(
+            transform_dataframe(df_tagged, state["scalers"]),
+            state["scalers"],
+            args,
+            mode,
+            folder=None if mode == "overwrite" else f"{staging}/feature-store",
+        )
+    save_scalers(state["scalers"], args.scalers_folder)
+    # The watermark only moves once the new rows are written
+    if mode == "overwrite":
+        preprocess_incremental.save_state(args.incremental_state_uri, state)
+    elif args.feature_store_uri:
+        commit_staged_outputs(
+            staging,
+            {
+                **split_folders,
+                "feature-store": f"{args.feature_store_uri}/scaler_version={version}",
+            },
+            state,
+            args,
+        )
+        preprocess_feature_store.save_feature_store_version(
+            args.feature_store_uri,
+            version,
+            state["scalers"],
+            args.feature_store_bucket_seconds,
+        )
+    else:
+        commit_staged_outputs(staging, split_folders, state, args)
+    report_stage_metrics(
+        ["read-source", "partition-statistics"]
+        + ["output-layout"]
+        + [f"write-{split}" for split in split_folders]
+        + ["write-feature-store"],
+        args,
+    )
+    df_source.unpersist()
+
+
+def read_full_history(args, schema, state: dict):
+    """Read every raw partition of the state with its `partition` column."""
+    if args.source_method.lower() == "s3":
+        paths = sorted(stats["path"] for stats in state["partitions"].values())
+        return read_source(args, schema, paths=paths).withColumn(
+            "partition", f.input_file_name()
+        )
+    ranges = sorted(
+        (stats["time_range"][1], stats["source"])
+        for stats in state["partitions"].values()
+    )
+    partition = f.when(f.col("Time") <= ranges[0][0], ranges[0][1])
+    for upper_bound, source in ranges[1:]:
+        partition = partition.when(f.col("Time") <= upper_bound, source)
+    return read_source(args, schema).withColumn("partition", partition)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--source-method", type=str, default="s3")
     parser.add_argument("--raw-data-key", type=str)
+    # Not read by the job, it changes the step cache key when the raw files change
+    parser.add_argument("--raw-data-version", type=str)
     parser.add_argument("--train-data-folder", type=str)
     parser.add_argument("--validation-data-folder", type=str)
     parser.add_argument("--test-data-folder", type=str)
+    parser.add_argument(
+        "--scalers-folder", type=str, default=f"{local_dir}/scalers"
+    )
+    parser.add_argument(
+        "--metrics-folder", type=str, default=f"{local_dir}/metrics"
+    )
     parser.add_argument("--train-ratio", type=float, default=0.7)
     parser.add_argument("--validation-ratio", type=float, default=0.1)
     parser.add_argument("--test-ratio", type=float, default=0.2)
+    parser.add_argument("--split-relative-error", type=float, default=0.0001)
+    parser.add_argument("--storage-level", type=str, default="MEMORY_AND_DISK")
+    parser.add_argument("--output-compression", type=str, default="zstd")
+    parser.add_argument("--output-file-size-mb", type=int, default=128)
+    parser.add_argument("--output-row-group-size-mb", type=int, default=32)
+    parser.add_argument("--raw-cache-folder", type=str)
+    parser.add_argument("--jdbc-url", type=str)
+    parser.add_argument("--jdbc-driver", type=str, default="com.mysql.cj.jdbc.Driver")
+    parser.add_argument("--jdbc-table", type=str, default="credit_fraud.transactions")
+    parser.add_argument("--jdbc-num-partitions", type=int, default=0)
+    parser.add_argument("--jdbc-fetch-size", type=int, default=10000)
+    parser.add_argument("--negative-sampling-ratio", type=float, default=1.0)
+    parser.add_argument("--sample-fraction", type=float, default=1.0)
+    parser.add_argument("--incremental-state-uri", type=str)
+    parser.add_argument("--incremental-drift-threshold", type=float, default=0.05)
+    parser.add_argument("--feature-store-uri", type=str)
+    parser.add_argument("--feature-store-bucket-seconds", type=int, default=3600)
+    preprocess_quality.add_data_quality_arguments(parser)
     args, _ = parser.parse_known_args()
 
     assert args.train_ratio + args.validation_ratio + args.test_ratio == 1.0
-
-    local_dir = "/opt/ml/processing"
+    # Sampled rows would be mixed into the persistent processed splits
+    assert args.sample_fraction == 1.0 or not args.incremental_state_uri
 
     spark = (
         SparkSession.builder.appName("PreprocessingJob")
@@ -68,6 +991,26 @@ if __name__ == "__main__":
         .getOrCreate()
     )
     spark.sparkContext.setLogLevel("ERROR")
+    # Settings generated by the pipeline from the input size and instance resources
+    logger.info(
+        "Spark configuration: "
+        + json.dumps(
+            {
+                key: value
+                for key, value in sorted(spark.sparkContext.getConf().getAll())
+                if key.startswith(
+                    (
+                        "spark.executor.instances",
+                        "spark.executor.cores",
+                        "spark.executor.memory",
+                        "spark.driver.memory",
+                        "spark.default.parallelism",
+                        "spark.sql.",
+                    )
+                )
+            }
+        )
+    )
 
     # Define raw data schema
     schema = StructType(
@@ -106,52 +1049,13 @@ if __name__ == "__main__":
         ]
     )
 
-    # Load dataset from s3
-    if args.source_method.lower() == "s3":
-        df = spark.read.csv(args.raw_data_key, header=True, schema=schema)
-    elif args.source_method.lower() == "rds":
-        df = spark.read.jdbc(
-            url=f"jdbc:mysql://{os.environ.get('RDS_HOST_URL')}",
-            table="credit_fraud.transactions",
-            properties={
-                "user": os.environ.get("RDS_SECRET_USERNAME"),
-                "password": os.environ.get("RDS_SECRET_PASSWORD"),
-                "driver": "com.mysql.cj.jdbc.Driver",
-            },
-        )
-
-    # insert id column
-    df = df.withColumn("id", f.row_number().over(Window.orderBy("Time")))
-
-    # Split Train, Validation and Test Sets
-    df_row_count = df.count()
-    train_row_count = int(df_row_count * args.train_ratio)
-    validation_row_count = int(df_row_count * args.validation_ratio)
-    df_train = df.filter(f"id <= {train_row_count}").drop("id", "Time")
-    df_validation = df.filter(
-        f"id > {train_row_count} AND id <= {train_row_count + validation_row_count}"
-    ).drop("id", "Time")
-    df_test = df.filter(f"id > {train_row_count + validation_row_count}").drop(
-        "id", "Time"
-    )
-
-    # Define Assemblers and Scalers
-    columns_to_scale = [f"V{col_id}" for col_id in range(1, 29)]
-    assemblers = [
-        VectorAssembler(inputCols=columns_to_scale, outputCol="min_max_features"),
-        VectorAssembler(inputCols=["Amount"], outputCol="Amount_vec"),
-    ]
-    scalers = [
-        MinMaxScaler(inputCol="min_max_features", outputCol="min_max_features_scaled"),
-        RobustScaler(inputCol="Amount_vec", outputCol="Amount_scaled"),
-    ]
-    pipeline = Pipeline(stages=assemblers + scalers)
-    scalerModel = pipeline.fit(df_train)
-
-    df_train = transform_dataframe(df_train)
-    df_validation = transform_dataframe(df_validation)
-    df_test = transform_dataframe(df_test)
-
-    df_train.write.mode("overwrite").parquet(args.train_data_folder)
-    df_validation.write.mode("overwrite").parquet(args.validation_data_folder)
-    df_test.write.mode("overwrite").parquet(args.test_data_folder)
+    split_folders = {
+        "train": args.train_data_folder,
+        "validation": args.validation_data_folder,
+        "test": args.test_data_folder,
+    }
+    storage_level = getattr(StorageLevel, args.storage_level.upper())
+    if args.incremental_state_uri:
+        run_incremental(args, schema, storage_level, split_folders)
+    else:
+        run_full(args, schema, storage_level, split_folders)
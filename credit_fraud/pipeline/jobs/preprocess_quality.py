@@ -0,0 +1,136 @@
+"""Data quality gate of the raw data, shared by the preprocessing jobs.
+
+The gate checks statistics that every job aggregates in the pass that reads the
+raw data, and fails the job before any split is written.
+"""
+
+import json
+import logging
+from typing import List, Optional
+
+from preprocess_io import exists, read_bytes, write_bytes
+from preprocess_schema import RAW_COLUMNS
+
+
+logger = logging.getLogger()
+
+
+def merge_quality_statistics(left: Optional[dict], right: dict) -> dict:
+    """Merge the data quality statistics of two parts of the raw data.
+
+    Statistics hold the raw `columns`, the number of `rows`, of `frauds`, of
+    `invalid_class` labels and of `fractional_time` values, and per column
+    `nulls` and `non_finite` counts, and `min` and `max` of Time and Amount
+    (None when the part has no valid value).
+    """
+    if left is None:
+        return right
+
+    def select(function, key, col):
+        values = [v for v in (left[key][col], right[key][col]) if v is not None]
+        return function(values) if values else None
+
+    return {
+        "columns": left["columns"],
+        **{
+            key: left[key] + right[key]
+            for key in ("rows", "frauds", "invalid_class", "fractional_time")
+        },
+        **{
+            key: {col: left[key][col] + right[key][col] for col in left[key]}
+            for key in ("nulls", "non_finite")
+        },
+        "min": {col: select(min, "min", col) for col in left["min"]},
+        "max": {col: select(max, "max", col) for col in left["max"]},
+    }
+
+
+def quality_failures(stats: dict, args, profile: Optional[dict] = None) -> List[str]:
+    """Check the raw data statistics, against the profile of the last run if any.
+
+    Returns:
+        List[str]: the failed checks, empty when the raw data can be processed.
+    """
+    failures = []
+    missing = [col for col in RAW_COLUMNS if col not in stats["columns"]]
+    extra = [col for col in stats["columns"] if col not in RAW_COLUMNS]
+    if missing or extra:
+        failures.append(f"Unexpected raw columns, missing {missing}, extra {extra}")
+    if profile is not None and profile["columns"] != stats["columns"]:
+        failures.append(
+            f"Raw columns drifted from {profile['columns']} to {stats['columns']}"
+        )
+    rows = stats["rows"]
+    if rows == 0:
+        return failures + ["No raw rows"]
+
+    for col, count in stats["nulls"].items():
+        if count > args.data_quality_max_null_fraction * rows:
+            failures.append(f"{count} null or malformed values in {col}")
+    for col, count in stats["non_finite"].items():
+        if count:
+            failures.append(f"{count} infinite or NaN values in {col}")
+    if stats["min"]["Time"] is not None and stats["min"]["Time"] < 0:
+        failures.append(f"Negative Time {stats['min']['Time']}")
+    if stats["fractional_time"]:
+        failures.append(f"{stats['fractional_time']} Time values are not whole seconds")
+    amount_min, amount_max = args.data_quality_amount_range
+    if stats["min"]["Amount"] is not None and not (
+        amount_min <= stats["min"]["Amount"] and stats["max"]["Amount"] <= amount_max
+    ):
+        failures.append(
+            f"Amount range [{stats['min']['Amount']}, {stats['max']['Amount']}] "
+            + f"outside [{amount_min}, {amount_max}]"
+        )
+    if stats["invalid_class"]:
+        failures.append(f"{stats['invalid_class']} Class labels are neither 0 nor 1")
+    fraud_rate = stats["frauds"] / rows
+    rate_min, rate_max = args.data_quality_fraud_rate_range
+    if not rate_min <= fraud_rate <= rate_max:
+        failures.append(f"Fraud rate {fraud_rate:.6f} outside [{rate_min}, {rate_max}]")
+    if profile is not None and profile["rows"]:
+        change = abs(rows - profile["rows"]) / profile["rows"]
+        if change > args.data_quality_max_row_change:
+            failures.append(
+                f"Row count changed by {change:.1%}, from {profile['rows']} to {rows}"
+            )
+    return failures
+
+
+def data_quality_gate(stats: dict, args):
+    """Fail the job when the raw data statistics do not pass the quality checks.
+
+    The profile of the last run is read from `--data-quality-profile-uri` and
+    replaced by the profile of the checked data once it passes.
+
+    Raises:
+        ValueError: If any check fails.
+    """
+    logger.info(f"Data quality statistics: {json.dumps(stats)}")
+    profile = None
+    if args.data_quality_profile_uri and exists(args.data_quality_profile_uri):
+        profile = json.loads(read_bytes(args.data_quality_profile_uri))
+    failures = quality_failures(stats, args, profile)
+    if failures:
+        raise ValueError("Data quality gate failed:\n- " + "\n- ".join(failures))
+    logger.info("Data quality gate passed")
+    if args.data_quality_profile_uri:
+        write_bytes(
+            args.data_quality_profile_uri,
+            json.dumps(
+                {key: stats[key] for key in ("columns", "rows", "frauds")}
+            ).encode(),
+        )
+
+
+def add_data_quality_arguments(parser):
+    parser.add_argument("--data-quality-gate", action="store_true")
+    parser.add_argument("--data-quality-profile-uri", type=str)
+    parser.add_argument("--data-quality-max-null-fraction", type=float, default=0.0)
+    parser.add_argument("--data-quality-max-row-change", type=float, default=0.5)
+    parser.add_argument(
+        "--data-quality-amount-range", type=float, nargs=2, default=[0.0, 1e6]
+    )
+    parser.add_argument(
+        "--data-quality-fraud-rate-range", type=float, nargs=2, default=[1e-4, 0.05]
+    )
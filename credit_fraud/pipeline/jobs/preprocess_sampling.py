@@ -0,0 +1,38 @@
+"""Deterministic row sampling, shared by the preprocessing jobs.
+
+Every engine computes the same hash of a row, so the Scikit-Learn, PySpark and
+DuckDB jobs keep the same rows for the same ratio.
+"""
+
+
+# Rows are sampled on their Time and this feature, rounded to 1 / SAMPLING_SCALE
+SAMPLING_FEATURE = "V1"
+SAMPLING_SCALE = 10000
+# Prime modulus and multipliers of the sampling hash, products stay below 2**62
+SAMPLING_MODULUS = 2**31 - 1
+SAMPLING_MULTIPLIERS = (48271, 69621)
+# Salt of the row sampling hash, so it keeps rows independently of negative sampling
+ROW_SAMPLING_SALT = 2**30
+
+
+def sampling_hash(time_seconds, feature_units, salt: int = 0):
+    """Deterministic hash of a row, uniform in `[0, SAMPLING_MODULUS)`.
+
+    Rows are keyed by their integer Time and their `SAMPLING_FEATURE` in units
+    of `1 / SAMPLING_SCALE`, both parsed as float64. Only `+`, `*` and `%` are
+    applied to integers, so numpy int64 arrays, Spark columns and DuckDB
+    expressions give identical hashes. Every round is an affine map followed by
+    a squaring modulo a prime. Different salts give independent hashes.
+    """
+    key = (time_seconds * 1000003 + feature_units + salt) % SAMPLING_MODULUS
+    # Spark and DuckDB keep the sign of the dividend
+    key = (key + SAMPLING_MODULUS) % SAMPLING_MODULUS
+    for multiplier in SAMPLING_MULTIPLIERS:
+        key = (key * multiplier + 1) % SAMPLING_MODULUS
+        key = key * key % SAMPLING_MODULUS
+    return key
+
+
+def sampling_threshold(ratio: float) -> int:
+    """Rows whose `sampling_hash` is below the threshold are kept."""
+    return int(ratio * SAMPLING_MODULUS)
@@ -0,0 +1,23 @@
+"""Columns and splits of the raw and processed data, shared by the preprocessing
+jobs."""
+
+import math
+
+
+MIN_MAX_COLUMNS = [f"V{col_id}" for col_id in range(1, 29)]
+ROBUST_COLUMNS = ["Amount"]
+SPLITS = ("train", "validation", "test")
+RAW_COLUMNS = ["Time"] + MIN_MAX_COLUMNS + ROBUST_COLUMNS + ["Class"]
+# Sample weights of the train split, written when its negatives are downsampled
+WEIGHT_COLUMN = "Weight"
+
+
+def split_sizes(num_rows: int, args) -> dict:
+    """Rows of each split, as the sequential `train_test_split` calls give them."""
+    num_test = math.ceil(args.test_ratio * num_rows)
+    num_validation = math.ceil(args.validation_ratio * (num_rows - num_test))
+    return {
+        "train": num_rows - num_test - num_validation,
+        "validation": num_validation,
+        "test": num_test,
+    }
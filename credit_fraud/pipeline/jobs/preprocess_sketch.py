@@ -0,0 +1,94 @@
+"""Mergeable quantile sketch of the robust scaled columns, shared by the
+preprocessing jobs."""
+
+import math
+from typing import Dict, Optional
+
+
+# Relative accuracy of the quantile sketches, matches the robust scaler error
+SKETCH_RELATIVE_ACCURACY = 0.001
+
+
+class DDSketch:
+    """Quantile sketch with relative accuracy guarantees and exact merges.
+
+    Values are counted in logarithmic buckets of ratio `gamma`, so any quantile
+    is estimated within `relative_accuracy` of the true value and two sketches
+    merge by adding their bucket counts. Buckets can be computed by any engine
+    (pandas, Spark) with `bucket_key` and loaded with `add`.
+
+    Args:
+        relative_accuracy (float): relative accuracy of the quantile estimates.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+
+    @property
+    def count(self) -> int:
+        return (
+            sum(self.positive.values()) + sum(self.negative.values()) + self.zero_count
+        )
+
+    def bucket_key(self, value: float) -> int:
+        """Bucket of the absolute value, the sign selects the store."""
+        return math.ceil(math.log(abs(value)) / math.log(self.gamma))
+
+    def add(self, store: str, key: Optional[int], count: int):
+        """Add `count` values to a bucket of the positive, negative or zero store."""
+        if store == "zero":
+            self.zero_count += count
+            return
+        buckets = self.positive if store == "positive" else self.negative
+        buckets[key] = buckets.get(key, 0) + count
+
+    def merge(self, other: "DDSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        for key, count in other.positive.items():
+            self.add("positive", key, count)
+        for key, count in other.negative.items():
+            self.add("negative", key, count)
+        self.zero_count += other.zero_count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the q-quantile, None when the sketch is empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.positive))
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "positive": {str(key): count for key, count in self.positive.items()},
+            "negative": {str(key): count for key, count in self.negative.items()},
+            "zero_count": self.zero_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DDSketch":
+        sketch = cls(data["relative_accuracy"])
+        sketch.positive = {int(key): count for key, count in data["positive"].items()}
+        sketch.negative = {int(key): count for key, count in data["negative"].items()}
+        sketch.zero_count = data["zero_count"]
+        return sketch
+
+    def _bucket_value(self, key: int) -> float:
+        return 2 * self.gamma**key / (self.gamma + 1)
@@ -12,11 +12,16 @@ import pickle
 import numpy as np
 from sklearn.metrics import balanced_accuracy_score, roc_auc_score, confusion_matrix
 
+from model_manifest import save_manifest, save_model_only_artifact
+
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+# Sample weights written by preprocessing when it downsamples the train negatives
+WEIGHT_COLUMN = "Weight"
+
 
 def install_extra_dependencies():
     logger.info("Attempting to extra dependencies")
@@ -55,6 +60,9 @@ if __name__ == "__main__":
         default=os.environ.get("SM_CHANNEL_VALIDATION_DATA_PATH"),
     )
     parser.add_argument("--model_dir", type=str, default=os.environ.get("SM_MODEL_DIR"))
+    parser.add_argument(
+        "--output_data_dir", type=str, default=os.environ.get("SM_OUTPUT_DATA_DIR")
+    )
     parser.add_argument("--mlflow-arn", type=str, default=os.environ.get("MLFLOW_ARN"))
     parser.add_argument(
         "--mlflow-run-id", type=str, default=os.environ.get("MLFLOW_RUN_ID")
@@ -70,12 +78,13 @@ if __name__ == "__main__":
     # Load data for training
     logger.info("Loading data.")
     df_train = pd.read_parquet(args.train_data_path)
+    weights = df_train.pop(WEIGHT_COLUMN) if WEIGHT_COLUMN in df_train else None
     X_train = df_train.drop("Class", axis=1)
     y_train = pd.DataFrame(df_train["Class"])
-    dm_train = xgb.DMatrix(X_train, label=y_train)
+    dm_train = xgb.DMatrix(X_train, label=y_train, weight=weights)
 
     df_validation = pd.read_parquet(args.validation_data_path)
-    X_validation = df_validation.drop("Class", axis=1)
+    X_validation = df_validation.drop(columns=["Class", WEIGHT_COLUMN], errors="ignore")
     y_validation = pd.DataFrame(df_validation["Class"])
     dm_validation = xgb.DMatrix(X_validation, label=y_validation)
 
@@ -121,6 +130,8 @@ if __name__ == "__main__":
     logger.info("Saving model")
     with open(model_location, "wb") as f:
         pickle.dump(classifier, f)
+    save_manifest(args.model_dir, framework="xgboost")
+    save_model_only_artifact(args.model_dir, args.output_data_dir, framework="xgboost")
 
     # Log the evaluation metrics
     mlflow.log_metric("Validation/Balanced-Accuracy", bacc_validation)
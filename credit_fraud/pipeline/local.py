@@ -0,0 +1,457 @@
+"""Local execution of the pipeline definition against in-process AWS stand-ins"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import tarfile
+import operator
+import subprocess
+import importlib.util
+import importlib.metadata
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from unittest import mock
+
+import boto3
+from sagemaker.workflow.pipeline import Pipeline
+
+from credit_fraud.pipeline.context import CreditFraudPipelineContext
+
+
+CONDITION_OPERATORS = {
+    "Equals": operator.eq,
+    "GreaterThan": operator.gt,
+    "GreaterThanOrEqualTo": operator.ge,
+    "LessThan": operator.lt,
+    "LessThanOrEqualTo": operator.le,
+}
+
+
+class LocalPipelineRunner:
+    """
+    Runs a pipeline definition on this machine, like a SageMaker pipeline
+    execution with the default parameters.
+
+    Processing and training jobs run as subprocesses of the current Python
+    interpreter, in a job folder that stands for the container root: the
+    `/opt/ml` paths of their requests are remapped to it, processing jobs get
+    its processing folder as `SM_PROCESSING_DIR` and training jobs get the
+    `SM_*` variables of the SageMaker training toolkit. Their inputs are
+    downloaded from the S3 stand-in and their outputs uploaded to it, as are
+    the S3 URIs passed as job arguments, which the jobs see as local paths.
+    Models are created on the SageMaker stand-in and Lambda functions run
+    in-process.
+
+    LocalPipelineSession runs the same jobs in the SageMaker Docker images,
+    which local runs do not require. The generated Spark cluster configuration
+    is not applied either, Spark runs in local mode.
+
+    Args:
+        context (CreditFraudPipelineContext): The pipeline context of a local run.
+        pipeline (Pipeline): The pipeline to run.
+
+    Attributes:
+        durations (dict): The wall-clock seconds of every executed step.
+    """
+
+    def __init__(self, context: CreditFraudPipelineContext, pipeline: Pipeline):
+        self.context = context
+        self.definition = json.loads(pipeline.definition())
+        self.execution_folder = os.path.join(
+            context.local_working_directory, "executions", context.execution_name
+        )
+        self.s3_client = boto3.client("s3", region_name=context.region)
+        self.parameters = {
+            parameter["Name"]: parameter.get("DefaultValue")
+            for parameter in self.definition["Parameters"]
+        }
+        self.execution_variables = {
+            "PipelineName": pipeline.name,
+            "PipelineExecutionId": context.execution_name,
+            "PipelineExecutionArn": context.execution_name,
+            "StartDateTime": datetime.now(timezone.utc).isoformat(),
+        }
+        self.properties = {}
+        self.durations = {}
+
+    def run(self) -> dict:
+        """
+        Runs the steps of the pipeline in order.
+
+        Returns:
+            dict: The wall-clock seconds of every executed step.
+
+        Raises:
+            subprocess.CalledProcessError: If a job fails, the following steps
+                are not run.
+        """
+        started = time.perf_counter()
+        for step in self.definition["Steps"]:
+            self.run_step(step)
+        self.durations["Pipeline"] = time.perf_counter() - started
+        self.context.logger.info(
+            f"Local pipeline durations (s): {json.dumps(self.durations, indent=2)}"
+        )
+        return self.durations
+
+    def run_step(self, step: dict):
+        """Runs a step with its arguments resolved, and records its duration."""
+        if step["Type"] == "Condition":
+            self.run_condition(step)
+            return
+        runners = {
+            "Processing": self.run_processing,
+            "Training": self.run_training,
+            "Model": self.run_create_model,
+            "Lambda": self.run_lambda,
+        }
+        if step["Type"] not in runners:
+            raise NotImplementedError(f"Local runs do not support {step['Type']} steps")
+        self.context.logger.info(f"Running step {step['Name']}")
+        started = time.perf_counter()
+        self.properties[step["Name"]] = runners[step["Type"]](step)
+        self.durations[step["Name"]] = time.perf_counter() - started
+        self.context.logger.info(
+            f"Step {step['Name']}: Succeeded in {self.durations[step['Name']]:.1f}s"
+        )
+
+    def run_condition(self, step: dict):
+        """Runs the if or else steps of a condition step."""
+        outcome = all(
+            CONDITION_OPERATORS[condition["Type"]](
+                condition["LeftValue"], condition["RightValue"]
+            )
+            for condition in self.resolve(step["Arguments"]["Conditions"])
+        )
+        self.context.logger.info(f"Step {step['Name']}: condition is {outcome}")
+        self.properties[step["Name"]] = {"Outcome": outcome}
+        for branch_step in step["Arguments"]["IfSteps" if outcome else "ElseSteps"]:
+            self.run_step(branch_step)
+
+    def run_processing(self, step: dict) -> dict:
+        """Runs a processing job and uploads its outputs."""
+        arguments = self.resolve(step["Arguments"])
+        job_folder = os.path.join(self.execution_folder, step["Name"])
+        for processing_input in arguments.get("ProcessingInputs", []):
+            s3_input = processing_input["S3Input"]
+            self.download(
+                s3_input["S3Uri"],
+                self.container_path(job_folder, s3_input["LocalPath"]),
+            )
+
+        entrypoint = arguments["AppSpecification"]["ContainerEntrypoint"]
+        environment = dict(arguments.get("Environment", {}))
+        environment["SM_PROCESSING_DIR"] = self.container_path(
+            job_folder, "/opt/ml/processing"
+        )
+        if entrypoint[0] == "smspark-submit":
+            # Dependencies given to spark-submit, the job script comes last
+            options = dict(zip(entrypoint[1:-1:2], entrypoint[2:-1:2]))
+            py_files = self.container_path(
+                job_folder, "/opt/ml/processing/input/py-files"
+            )
+            for py_file in options["--py-files"].split(","):
+                self.download(py_file, py_files)
+            # The job adds its jars from the working directory
+            self.download(options["--jars"], job_folder)
+            environment["PYTHONPATH"] = os.pathsep.join(
+                [py_files, os.environ.get("PYTHONPATH", "")]
+            )
+            environment["PYSPARK_PYTHON"] = sys.executable
+            entrypoint = entrypoint[-1:]
+        else:
+            entrypoint = entrypoint[1:]
+
+        job_arguments, synced = self.map_job_arguments(
+            job_folder, arguments["AppSpecification"].get("ContainerArguments", [])
+        )
+        command = [
+            self.container_path(job_folder, path) for path in entrypoint
+        ] + job_arguments
+        started = time.time()
+        self.run_job(command, job_folder, environment)
+        for local_path, s3_uri in synced:
+            self.upload(local_path, s3_uri, newer_than=started)
+
+        outputs = {}
+        for output in arguments.get("ProcessingOutputConfig", {}).get("Outputs", []):
+            s3_output = output["S3Output"]
+            local_path = self.container_path(job_folder, s3_output["LocalPath"])
+            self.upload(local_path, s3_output["S3Uri"])
+            outputs[output["OutputName"]] = dict(output, LocalPath=local_path)
+        property_files = {}
+        for property_file in step.get("PropertyFiles", []):
+            path = os.path.join(
+                outputs[property_file["OutputName"]]["LocalPath"],
+                property_file["FilePath"],
+            )
+            with open(path) as file:
+                property_files[property_file["PropertyFileName"]] = json.load(file)
+        return {
+            "ProcessingOutputConfig": {"Outputs": outputs},
+            "PropertyFiles": property_files,
+        }
+
+    def run_training(self, step: dict) -> dict:
+        """Runs a script mode training job and uploads its model artifact."""
+        arguments = self.resolve(step["Arguments"])
+        job_folder = os.path.join(self.execution_folder, step["Name"])
+        job_name = f"{step['Name']}-{self.context.execution_name}"
+        hyperparameters = {
+            key: json.loads(value)
+            for key, value in arguments.get("HyperParameters", {}).items()
+        }
+
+        code_folder = self.container_path(job_folder, "/opt/ml/code")
+        self.download(hyperparameters["sagemaker_submit_directory"], code_folder)
+        for archive_name in os.listdir(code_folder):
+            with tarfile.open(os.path.join(code_folder, archive_name)) as archive:
+                archive.extractall(code_folder)
+
+        model_dir = self.container_path(job_folder, "/opt/ml/model")
+        os.makedirs(model_dir, exist_ok=True)
+        environment = dict(arguments.get("Environment", {}))
+        channels = {}
+        for channel in arguments.get("InputDataConfig", []):
+            channel_folder = self.container_path(
+                job_folder, f"/opt/ml/input/data/{channel['ChannelName']}"
+            )
+            self.download(
+                channel["DataSource"]["S3DataSource"]["S3Uri"], channel_folder
+            )
+            environment[f"SM_CHANNEL_{channel['ChannelName'].upper()}"] = channel_folder
+            channels[channel["ChannelName"]] = {
+                "ContentType": channel.get("ContentType"),
+                "TrainingInputMode": "File",
+            }
+        user_hyperparameters = {
+            key: value
+            for key, value in hyperparameters.items()
+            if not key.startswith("sagemaker_")
+        }
+        environment.update(
+            {
+                "SM_MODEL_DIR": model_dir,
+                "SM_OUTPUT_DATA_DIR": self.container_path(
+                    job_folder, "/opt/ml/output/data"
+                ),
+                "SM_CHANNELS": json.dumps(sorted(channels)),
+                "SM_INPUT_DATA_CONFIG": json.dumps(channels),
+                "SM_HPS": json.dumps(user_hyperparameters),
+                "SM_HOSTS": json.dumps(["algo-1"]),
+                "SM_CURRENT_HOST": "algo-1",
+                "SM_NUM_CPUS": str(os.cpu_count()),
+            }
+        )
+        command = [os.path.join(code_folder, hyperparameters["sagemaker_program"])]
+        for key, value in user_hyperparameters.items():
+            command += [f"--{key}", str(value)]
+        self.run_job(command, code_folder, environment)
+
+        output_path = arguments["OutputDataConfig"]["S3OutputPath"]
+        output_uri = f"{output_path}/{job_name}/output"
+        for archive_name, folder in (
+            ("model.tar.gz", model_dir),
+            ("output.tar.gz", environment["SM_OUTPUT_DATA_DIR"]),
+        ):
+            archive_path = self.container_path(
+                job_folder, f"/opt/ml/output/{archive_name}"
+            )
+            os.makedirs(folder, exist_ok=True)
+            with tarfile.open(archive_path, "w:gz") as archive:
+                for file_name in sorted(os.listdir(folder)):
+                    archive.add(os.path.join(folder, file_name), file_name)
+            self.upload(archive_path, f"{output_uri}/{archive_name}")
+        return {
+            "TrainingJobName": job_name,
+            "ModelArtifacts": {"S3ModelArtifacts": f"{output_uri}/model.tar.gz"},
+        }
+
+    def run_create_model(self, step: dict) -> dict:
+        """Creates the model on the SageMaker stand-in."""
+        model_name = f"{step['Name']}-{self.context.execution_name}"
+        self.context.sagemaker_client.create_model(
+            ModelName=model_name, **self.resolve(step["Arguments"])
+        )
+        return {"ModelName": model_name}
+
+    def run_lambda(self, step: dict) -> dict:
+        """
+        Invokes the handler of a Lambda function in-process, with the
+        environment of the function on the Lambda stand-in.
+        """
+        function_name = step["FunctionArn"].split(":")[-1]
+        configuration = self.context.lambda_functions.client.get_function(
+            FunctionName=function_name
+        )["Configuration"]
+        handler_path = self.context.lambda_functions.local_handlers[function_name]
+        variables = configuration.get("Environment", {}).get("Variables", {})
+        root_logger = logging.getLogger()
+        # Handlers add their log handlers to the root logger when imported
+        with mock.patch.dict(os.environ, variables), mock.patch.object(
+            root_logger, "handlers", list(root_logger.handlers)
+        ):
+            spec = importlib.util.spec_from_file_location(
+                configuration["Handler"].split(".")[0], handler_path
+            )
+            handler = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(handler)
+            try:
+                response = handler.lambda_handler(
+                    self.resolve(step["Arguments"]), None
+                )
+            except NotImplementedError as ex:
+                # The stand-ins do not implement every API, like endpoint updates
+                self.context.logger.warning(
+                    f"Step {step['Name']} stopped on an API the stand-ins lack: {ex}"
+                )
+                response = None
+        self.context.logger.info(f"Step {step['Name']} response: {response}")
+        return {"OutputParameters": response or {}}
+
+    def run_job(self, command: list, job_folder: str, environment: dict):
+        """
+        Runs a job script with the current interpreter from the job folder.
+
+        Jobs install their requirements into the current environment, pinned to
+        the installed distributions so that they only add missing ones.
+        """
+        os.makedirs(job_folder, exist_ok=True)
+        constraints_path = os.path.join(self.execution_folder, "constraints.txt")
+        if not os.path.exists(constraints_path):
+            with open(constraints_path, "w") as file:
+                file.writelines(
+                    f"{distribution.metadata['Name']}=={distribution.version}\n"
+                    for distribution in importlib.metadata.distributions()
+                )
+        self.context.logger.info(f"Running job: {' '.join(command)}")
+        subprocess.run(
+            [sys.executable] + command,
+            cwd=job_folder,
+            env={**os.environ, **environment, "PIP_CONSTRAINT": constraints_path},
+            check=True,
+        )
+
+    def map_job_arguments(self, job_folder: str, job_arguments: list):
+        """
+        Remaps the container paths of the job arguments, and replaces their S3
+        URIs with local copies.
+
+        Returns:
+            Tuple[list, list]: The job arguments and the local paths and S3 URIs
+                to upload once the job has run.
+        """
+        mapped, synced = [], []
+        for argument in job_arguments:
+            argument = str(argument)
+            if argument.startswith("s3://"):
+                location = urlparse(argument)
+                local_path = os.path.join(
+                    self.context.local_working_directory,
+                    "s3",
+                    location.netloc,
+                    location.path.lstrip("/"),
+                )
+                self.download(argument, local_path, prefix_as_file=True)
+                synced.append((local_path, argument))
+                argument = local_path
+            mapped.append(self.container_path(job_folder, argument))
+        return mapped, synced
+
+    @staticmethod
+    def container_path(job_folder: str, path: str) -> str:
+        """Maps a container path under `/opt/ml` into the job folder."""
+        if path.startswith("/opt/ml"):
+            return os.path.join(job_folder, path.lstrip("/"))
+        return path
+
+    def download(self, s3_uri: str, local_path: str, prefix_as_file: bool = False):
+        """
+        Downloads an object, or every object under a prefix, from the S3
+        stand-in. Like the `S3Prefix` inputs of SageMaker jobs, an object is
+        downloaded into the local folder, unless `prefix_as_file` is set.
+        """
+        location = urlparse(s3_uri)
+        key = location.path.lstrip("/")
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=location.netloc, Prefix=key):
+            for item in page.get("Contents", []):
+                if item["Key"] == key:
+                    relative_path = None if prefix_as_file else os.path.basename(key)
+                elif item["Key"].startswith(key.rstrip("/") + "/"):
+                    relative_path = item["Key"][len(key.rstrip("/")) + 1 :]
+                else:
+                    continue
+                path = (
+                    os.path.join(local_path, relative_path)
+                    if relative_path
+                    else local_path
+                )
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.s3_client.download_file(location.netloc, item["Key"], path)
+
+    def upload(self, local_path: str, s3_uri: str, newer_than: float = None):
+        """
+        Uploads a file, or every file under a folder, to the S3 stand-in, only
+        those modified after `newer_than` when it is set.
+        """
+        if not os.path.exists(local_path):
+            return
+        location = urlparse(s3_uri)
+        key = location.path.lstrip("/")
+        paths = (
+            [
+                os.path.join(root, file_name)
+                for root, _, file_names in os.walk(local_path)
+                for file_name in file_names
+            ]
+            if os.path.isdir(local_path)
+            else [local_path]
+        )
+        for path in paths:
+            if newer_than is not None and os.path.getmtime(path) < newer_than:
+                continue
+            path_key = (
+                f"{key.rstrip('/')}/{os.path.relpath(path, local_path)}"
+                if path != local_path
+                else key
+            )
+            self.s3_client.upload_file(path, location.netloc, path_key)
+
+    def resolve(self, value):
+        """Resolves the parameters, properties and functions of a definition."""
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if set(value) == {"Get"}:
+            return self.get(value["Get"])
+        if set(value) == {"Std:Join"}:
+            return value["Std:Join"]["On"].join(
+                str(self.resolve(item)) for item in value["Std:Join"]["Values"]
+            )
+        if set(value) == {"Std:JsonGet"}:
+            document = self.resolve(value["Std:JsonGet"]["PropertyFile"])
+            return self.walk(document, value["Std:JsonGet"]["Path"])
+        return {key: self.resolve(item) for key, item in value.items()}
+
+    def get(self, path: str):
+        """Returns a parameter, execution variable or step property."""
+        namespace, name = path.split(".", 1)
+        if namespace == "Parameters":
+            return self.parameters[name]
+        if namespace == "Execution":
+            return self.execution_variables[name]
+        step_name, property_path = name.split(".", 1)
+        return self.walk(self.properties[step_name], property_path)
+
+    @staticmethod
+    def walk(document, path: str):
+        """Walks a property path like `Outputs['train.parquet'].S3Output.S3Uri`."""
+        tokens = re.findall(r"([^.\[\]]+)|\['([^']+)'\]|\[(\d+)\]", path)
+        for name, key, index in tokens:
+            document = document[int(index)] if index else document[name or key]
+        return document
@@ -14,11 +14,13 @@ class CreateModelStepJob(Step):
     Args:
         context (CreditFraudPipelineContext): The context object for the pipeline.
         image_uri (str): The URI of the Docker image for the model.
+        env (dict): Environment variables of the serving container.
     """
 
-    def __init__(self, context: CreditFraudPipelineContext, image_uri):
+    def __init__(self, context: CreditFraudPipelineContext, image_uri, env=None):
         self.context = context
         self.image_uri = image_uri
+        self.env = dict(env or {})
 
     def build(self, model_artifact_s3_uri: str) -> CreateModelStep:
         """
@@ -30,11 +32,18 @@ class CreateModelStepJob(Step):
         Returns:
             CreateModelStep: The CreateModelStep object.
         """
+        env = dict(self.env)
+        if self.context.cfg["Deployment"]["HotSwapEnabled"]:
+            # Served models follow this pointer, see the deploy Lambda hot swap
+            env["MODEL_POINTER_URI"] = self.context.model_pointer_uri
+            # Instances skip a pointer to the artifact they already serve
+            env["MODEL_DATA_URL"] = model_artifact_s3_uri
         model = Model(
             image_uri=self.image_uri,
             model_data=model_artifact_s3_uri,
             sagemaker_session=self.context,
             role=self.context.sagemaker_role,
+            env=env or None,
         )
         inputs = CreateModelInput(
             instance_type=self.context.cfg["Deployment"]["DeployInstanceType"]
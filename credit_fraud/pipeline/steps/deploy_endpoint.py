@@ -25,7 +25,8 @@ class DeployEndpointStepJob(Step):
     def build(self, model_name: str) -> LambdaStep:
         """
         Builds a LambdaStep object for deploying the endpoint.
-        This Lambda function also enables auto-scalling.
+        This Lambda function also enables auto-scalling. When hot swap is enabled,
+        running endpoints serving the same image are refreshed in place instead.
 
         Args:
             model_name (str): The name of the model to be deployed.
@@ -40,6 +41,7 @@ class DeployEndpointStepJob(Step):
                 "model_name": model_name,
                 "endpoint_name": self.context.cfg["Deployment"]["EndpointName"],
                 "instance_type": self.context.cfg["Deployment"]["DeployInstanceType"],
+                "hot_swap": bool(self.context.cfg["Deployment"]["HotSwapEnabled"]),
             },
         )
         return deploy_step
@@ -4,6 +4,7 @@ from sagemaker.workflow.properties import PropertyFile
 
 from .step import Step
 from credit_fraud.pipeline.context import CreditFraudPipelineContext
+from credit_fraud.utils import ArtifactCache
 
 
 class EvaluateStepJob(Step):
@@ -45,18 +46,44 @@ class EvaluateStepJob(Step):
             path="evaluation.json",
         )
 
-    def build(self, model_artifact_s3_uri: str, test_data_uri: str) -> ProcessingStep:
+    def build(
+        self,
+        model_artifact_s3_uri: str,
+        test_data_uri: str,
+        metrics_uri: str = None,
+        model_fingerprint: str = None,
+    ) -> ProcessingStep:
         """
         Builds the evaluation step of the pipeline.
 
         Args:
             model_artifact_s3_uri (str): The S3 URI of the model artifact.
             test_data_uri (str): The URI of the test data.
+            metrics_uri (str, optional): The URI of the Spark stage metrics of
+                the preprocessing, logged to the MLflow run with the model metrics.
+            model_fingerprint (str, optional): The fingerprint of the model. When
+                set, the report is written to a folder keyed by the model and the
+                evaluation script instead of the execution name, so that the step
+                cache key is the same across executions.
 
         Returns:
             ProcessingStep: The evaluation step of the pipeline.
 
         """
+        evaluation_folder = (
+            f"{self.context.bucket_folder}/runs/{self.context.execution_name}/evaluation"
+        )
+        if model_fingerprint is not None:
+            evaluation_folder, _ = self.context.get_artifact_folder(
+                "evaluation",
+                ArtifactCache.fingerprint(
+                    model_fingerprint,
+                    paths=[
+                        f"{self.context.cfg['Global']['JobsScriptsFolder']}/evaluate.py"
+                    ],
+                ),
+                "evaluation",
+            )
         evaluation_step = ProcessingStep(
             name="ModelEvaluate",
             processor=self.eval_processor,
@@ -69,10 +96,20 @@ class EvaluateStepJob(Step):
                     source=test_data_uri,
                     destination="/opt/ml/processing/test.parquet",
                 ),
-            ],
+            ]
+            + (
+                [
+                    ProcessingInput(
+                        source=metrics_uri,
+                        destination="/opt/ml/processing/metrics",
+                    )
+                ]
+                if metrics_uri is not None
+                else []
+            ),
             outputs=[
                 ProcessingOutput(
-                    destination=f"{self.context.bucket_folder}/runs/{self.context.execution_name}/evaluation",
+                    destination=evaluation_folder,
                     output_name="evaluation",
                     source="/opt/ml/processing/evaluation",
                 )
@@ -84,8 +121,14 @@ class EvaluateStepJob(Step):
                 self.context.training_algorithm,
                 "--mlflow-arn",
                 self.context.mlflow.server_arn,
-                "--mlflow-run-id",
-                self.context.mlflow.experiment_run_id,
-            ],
+            ]
+            # Cached evaluations start their own MLflow run, the run ID changes
+            # on every execution and would defeat the cache
+            + (
+                []
+                if self.context.evaluate_cache_config.enable_caching
+                else ["--mlflow-run-id", self.context.mlflow.experiment_run_id]
+            ),
+            cache_config=self.context.evaluate_cache_config,
         )
         return evaluation_step
@@ -1,5 +1,10 @@
+import json
+import math
+import os
 from abc import ABC, abstractmethod
+from urllib.parse import urlparse
 
+import boto3
 from sagemaker.sklearn.processing import SKLearnProcessor
 from sagemaker.spark.processing import PySparkProcessor
 from sagemaker.processing import ProcessingInput, ProcessingOutput
@@ -10,6 +15,59 @@ from credit_fraud.utils import SecretManager
 from credit_fraud.pipeline.context import CreditFraudPipelineContext
 from credit_fraud.pipeline.exceptions import InvalidProcessingFramework
 
+MYSQL_CONNECTOR_JAR = "mysql-connector-j-9.0.0.jar"
+# Wheels of the pinned duckdb release, downloaded by the image build
+DUCKDB_WHEELS_FOLDER = "duckdb-wheels"
+# Modules imported by the preprocessing jobs, uploaded together to a single folder
+PREPROCESS_COMMON_SCRIPTS = [
+    "preprocess_schema.py",
+    "preprocess_io.py",
+    "preprocess_cache.py",
+    "preprocess_sketch.py",
+    "preprocess_sampling.py",
+    "preprocess_quality.py",
+    "preprocess_incremental.py",
+    "preprocess_feature_store.py",
+]
+PREPROCESS_COMMON_FOLDER = "preprocess-common"
+# Share of the instance memory left to the OS, the YARN daemons and the driver
+SPARK_RESERVED_MEMORY_FRACTION = 0.25
+# Larger executors lose S3 client throughput and spend longer in garbage collection
+SPARK_MAX_EXECUTOR_CORES = 5
+# Parsed size of a raw row of 31 numeric columns, used to size RDS sources
+RAW_ROW_BYTES = 31 * 8
+# vCPUs and memory in MiB of processing instance types, other types are looked up
+# with the EC2 API
+PROCESSING_INSTANCE_RESOURCES = {
+    "ml.t3.medium": (2, 4096),
+    "ml.t3.large": (2, 8192),
+    "ml.t3.xlarge": (4, 16384),
+    "ml.t3.2xlarge": (8, 32768),
+    "ml.m4.xlarge": (4, 16384),
+    "ml.m4.2xlarge": (8, 32768),
+    "ml.m4.4xlarge": (16, 65536),
+    "ml.m4.10xlarge": (40, 163840),
+    "ml.m5.large": (2, 8192),
+    "ml.m5.xlarge": (4, 16384),
+    "ml.m5.2xlarge": (8, 32768),
+    "ml.m5.4xlarge": (16, 65536),
+    "ml.m5.12xlarge": (48, 196608),
+    "ml.m5.24xlarge": (96, 393216),
+    "ml.c5.xlarge": (4, 8192),
+    "ml.c5.2xlarge": (8, 16384),
+    "ml.c5.4xlarge": (16, 32768),
+    "ml.c5.9xlarge": (36, 73728),
+    "ml.c5.18xlarge": (72, 147456),
+    "ml.r5.large": (2, 16384),
+    "ml.r5.xlarge": (4, 32768),
+    "ml.r5.2xlarge": (8, 65536),
+    "ml.r5.4xlarge": (16, 131072),
+    "ml.r5.8xlarge": (32, 262144),
+    "ml.r5.12xlarge": (48, 393216),
+    "ml.r5.16xlarge": (64, 524288),
+    "ml.r5.24xlarge": (96, 786432),
+}
+
 
 class ProcessingFrameworkStrategy(ABC):
     """Abstract base class for processing framework strategies."""
@@ -23,6 +81,64 @@ class ProcessingFrameworkStrategy(ABC):
         """
         pass
 
+    def upload_common_scripts(self):
+        """Uploads the modules shared by the preprocessing jobs."""
+        self.context.s3_script_manager.upload_scripts(
+            source_directory=self.context.cfg["Global"]["JobsScriptsFolder"],
+            script_names=PREPROCESS_COMMON_SCRIPTS,
+            folder_name=PREPROCESS_COMMON_FOLDER,
+        )
+
+    def common_scripts_input(self) -> ProcessingInput:
+        """Input mounting the shared modules where the jobs import them from.
+
+        Returns:
+            ProcessingInput: The input of the shared modules folder.
+        """
+        return ProcessingInput(
+            source=self.context.s3_script_manager.get_folder_uri(
+                PREPROCESS_COMMON_FOLDER
+            ),
+            destination="/opt/ml/processing/input/common",
+        )
+
+    def raw_data_version_arguments(self) -> list:
+        """Job arguments that put the raw data version in the step cache key.
+
+        Returns:
+            list: The arguments, empty when preprocessing is not cached.
+        """
+        if self.context.raw_data_version is None:
+            return []
+        return ["--raw-data-version", self.context.raw_data_version]
+
+    def data_quality_arguments(self) -> list:
+        """Job arguments of the data quality gate run on the raw data.
+
+        Returns:
+            list: The arguments, empty when the gate is disabled.
+        """
+        cfg = self.context.cfg["Preprocess"]
+        if not cfg["DataQualityGate"]:
+            return []
+        arguments = [
+            "--data-quality-gate",
+            "--data-quality-max-null-fraction",
+            str(cfg["DataQualityMaxNullFraction"]),
+            "--data-quality-max-row-change",
+            str(cfg["DataQualityMaxRowChange"]),
+            "--data-quality-amount-range",
+            *[str(value) for value in cfg["DataQualityAmountRange"]],
+            "--data-quality-fraud-rate-range",
+            *[str(value) for value in cfg["DataQualityFraudRateRange"]],
+        ]
+        if self.context.data_quality_profile_uri:
+            arguments += [
+                "--data-quality-profile-uri",
+                self.context.data_quality_profile_uri,
+            ]
+        return arguments
+
 
 class ScikitLearnFrameworkStrategy(ProcessingFrameworkStrategy):
     """Processing framework strategy for Scikit-Learn.
@@ -38,16 +154,17 @@ class ScikitLearnFrameworkStrategy(ProcessingFrameworkStrategy):
             source_directory=context.cfg["Global"]["JobsScriptsFolder"],
             script_name="preprocess_sklearn.py",
         )
+        self.upload_common_scripts()
 
         self.context.logger.info("Configuring Scikit-Learn processor")
         self.sklearn_processor = SKLearnProcessor(
             role=self.context.sagemaker_role,
             framework_version="1.2-1",
             instance_count=1,
-            instance_type=self.context.pipeline_params[
-                "preprocess_sklearn_instance_type"
+            instance_type=self.context.cfg["Preprocess"][
+                "PreprocessSklearnInstanceType"
             ],
-            base_job_name=f"{self.context['Global']['BaseJobNamePrefix']}-preprocess-sklearn",
+            base_job_name=f"{self.context.cfg['Global']['BaseJobNamePrefix']}-preprocess-sklearn",
         )
 
     def build(self) -> ProcessingStep:
@@ -56,15 +173,66 @@ class ScikitLearnFrameworkStrategy(ProcessingFrameworkStrategy):
         Returns:
             ProcessingStep: The built processing step.
         """
-        preprocess_step = ProcessingStep(
-            name="ScikitLearnDataPreprocess",
-            processor=self.sklearn_processor,
-            inputs=[
+        inputs = [self.common_scripts_input()]
+        job_arguments = [
+            "--train-ratio",
+            self.context.pipeline_params["preprocess_train_ratio"],
+            "--validation-ratio",
+            self.context.pipeline_params["preprocess_validation_ratio"],
+            "--test-ratio",
+            self.context.pipeline_params["preprocess_test_ratio"],
+            "--output-compression",
+            self.context.cfg["Preprocess"]["OutputCompression"],
+            "--output-file-size-mb",
+            str(self.context.cfg["Preprocess"]["OutputFileSizeMB"]),
+            "--output-row-group-size-mb",
+            str(self.context.cfg["Preprocess"]["OutputRowGroupSizeMB"]),
+            "--chunk-size",
+            str(self.context.cfg["Preprocess"]["SklearnChunkSize"]),
+            "--feature-dtype",
+            self.context.cfg["Preprocess"]["SklearnFeatureDtype"],
+            "--negative-sampling-ratio",
+            str(self.context.cfg["Preprocess"]["NegativeSamplingRatio"]),
+            "--sample-fraction",
+            str(self.context.cfg["Preprocess"]["SampleFraction"]),
+        ] + self.raw_data_version_arguments() + self.data_quality_arguments()
+        if self.context.cfg["Preprocess"]["IncrementalMode"]:
+            # The job lists and reads the raw files itself, only the new ones
+            job_arguments += [
+                "--raw-data-key",
+                self.context.s3_raw_data_key,
+                "--train-data-folder",
+                self.context.processed_train_data_folder,
+                "--validation-data-folder",
+                self.context.processed_validation_data_folder,
+                "--test-data-folder",
+                self.context.processed_test_data_folder,
+                "--incremental-state-uri",
+                self.context.incremental_state_uri,
+                "--incremental-drift-threshold",
+                str(self.context.cfg["Preprocess"]["IncrementalDriftThreshold"]),
+            ]
+        elif self.context.cfg["Preprocess"]["RawCache"]:
+            # The job reads the cached parquet copy, the CSV only when it changed
+            job_arguments += [
+                "--raw-data-key",
+                self.context.s3_raw_data_key,
+                "--raw-cache-folder",
+                self.context.raw_cache_folder,
+            ]
+        else:
+            inputs.append(
                 ProcessingInput(
                     source=self.context.s3_raw_data_key,
                     destination="/opt/ml/processing/raw",
-                ),
-            ],
+                )
+            )
+            job_arguments += ["--raw-data-key", "/opt/ml/processing/raw"]
+
+        preprocess_step = ProcessingStep(
+            name="ScikitLearnDataPreprocess",
+            processor=self.sklearn_processor,
+            inputs=inputs,
             outputs=[
                 ProcessingOutput(
                     destination=self.context.processed_train_data_folder,
@@ -81,18 +249,15 @@ class ScikitLearnFrameworkStrategy(ProcessingFrameworkStrategy):
                     output_name="test.parquet",
                     source="/opt/ml/processing/test.parquet",
                 ),
+                ProcessingOutput(
+                    destination=self.context.processed_scalers_folder,
+                    output_name="scalers",
+                    source="/opt/ml/processing/scalers",
+                ),
             ],
-            job_arguments=[
-                "--raw-data-key",
-                "/opt/ml/processing/raw",
-                "--train-ratio",
-                self.context.pipeline_params["preprocess_train_ratio"],
-                "--validation-ratio",
-                self.context.pipeline_params["preprocess_validation_ratio"],
-                "--test-ratio",
-                self.context.pipeline_params["preprocess_test_ratio"],
-            ],
+            job_arguments=job_arguments,
             code=self.context.s3_script_manager.get_script_uri("preprocess_sklearn.py"),
+            cache_config=self.context.preprocess_cache_config,
         )
         return preprocess_step
 
@@ -111,11 +276,144 @@ class PysparkFrameworkStrategy(ProcessingFrameworkStrategy):
             source_directory=context.cfg["Global"]["JobsScriptsFolder"],
             script_name="preprocess_pyspark.py",
         )
+        self.upload_common_scripts()
+        # Uploaded like the scripts, the processor would stage it under a new job name
+        self.context.s3_script_manager.upload_script(
+            source_directory="dependencies", script_name=MYSQL_CONNECTOR_JAR
+        )
 
         self._setup_spark_processor()
 
+    def _get_input_bytes(self) -> int:
+        """
+        Size of the raw input: the S3 objects under the raw data key, or
+        `RdsRowEstimate` parsed rows for the RDS table.
+
+        Returns:
+            int: The input size in bytes.
+        """
+        if self.context.cfg["Preprocess"]["SourceMethod"].lower() == "rds":
+            return self.context.cfg["Preprocess"]["RdsRowEstimate"] * RAW_ROW_BYTES
+        location = urlparse(self.context.s3_raw_data_key)
+        paginator = boto3.client("s3", region_name=self.context.region).get_paginator(
+            "list_objects_v2"
+        )
+        return sum(
+            item["Size"]
+            for page in paginator.paginate(
+                Bucket=location.netloc, Prefix=location.path.lstrip("/")
+            )
+            for item in page.get("Contents", [])
+        )
+
+    def _get_instance_resources(self) -> tuple:
+        """
+        Looks the instance type up in `PROCESSING_INSTANCE_RESOURCES`, and falls
+        back to the EC2 API for the types it does not list.
+
+        Returns:
+            tuple: The vCPUs and memory in MiB of the processing instance type.
+        """
+        instance_type = self.context.cfg["Preprocess"]["PreprocessPysparkInstanceType"]
+        if instance_type in PROCESSING_INSTANCE_RESOURCES:
+            return PROCESSING_INSTANCE_RESOURCES[instance_type]
+        info = boto3.client(
+            "ec2", region_name=self.context.region
+        ).describe_instance_types(InstanceTypes=[instance_type.removeprefix("ml.")])[
+            "InstanceTypes"
+        ][0]
+        return info["VCpuInfo"]["DefaultVCpus"], info["MemoryInfo"]["SizeInMiB"]
+
+    def _get_spark_configuration(self) -> list:
+        """
+        Generates the Spark and YARN configuration of the processor from the raw
+        input size and the instance resources.
+
+        Executors get up to `SPARK_MAX_EXECUTOR_CORES` cores and share the memory
+        the OS, the YARN daemons and the driver leave on every instance. Scans are
+        split so that every core reads a slice of small inputs, shuffles start with
+        a partition per `SparkTargetPartitionMB` of input and at least two per
+        core, and adaptive query execution coalesces small partitions and splits
+        skewed ones at runtime.
+
+        Returns:
+            list: The configuration, in the EMR classification format.
+        """
+        cfg = self.context.cfg["Preprocess"]
+        input_bytes = self._get_input_bytes()
+        vcpus, memory_mb = self._get_instance_resources()
+        # The largest executors that use every core of the instance
+        executor_cores = max(
+            cores
+            for cores in range(1, min(vcpus, SPARK_MAX_EXECUTOR_CORES) + 1)
+            if vcpus % cores == 0
+        )
+        executors_per_instance = vcpus // executor_cores
+        executor_instances = (
+            cfg["PreprocessPysparkInstanceCount"] * executors_per_instance
+        )
+        total_cores = executor_instances * executor_cores
+        node_memory_mb = int(memory_mb * (1 - SPARK_RESERVED_MEMORY_FRACTION))
+        container_memory_mb = node_memory_mb // executors_per_instance
+        overhead_mb = max(384, container_memory_mb // 10)
+        executor_memory_mb = container_memory_mb - overhead_mb
+        driver_memory_mb = int(memory_mb * SPARK_RESERVED_MEMORY_FRACTION / 2)
+        target_bytes = cfg["SparkTargetPartitionMB"] * 1024**2
+        # Broadcast tables are collected by the driver and copied to every executor
+        broadcast_bytes = max(
+            10 * 1024**2,
+            min(
+                256 * 1024**2,
+                min(executor_memory_mb, driver_memory_mb) * 1024**2 // 20,
+            ),
+        )
+        self.context.logger.info(
+            f"Sizing Spark for {input_bytes} input bytes on "
+            + f"{cfg['PreprocessPysparkInstanceCount']} instances with {vcpus} vCPUs "
+            + f"and {memory_mb} MiB"
+        )
+        return [
+            {
+                "Classification": "spark-defaults",
+                "Properties": {
+                    "spark.executor.instances": str(executor_instances),
+                    "spark.executor.cores": str(executor_cores),
+                    "spark.executor.memory": f"{executor_memory_mb}m",
+                    "spark.executor.memoryOverhead": f"{overhead_mb}m",
+                    "spark.driver.memory": f"{driver_memory_mb}m",
+                    "spark.default.parallelism": str(2 * total_cores),
+                    "spark.sql.files.maxPartitionBytes": str(
+                        max(4 * 1024**2, min(target_bytes, input_bytes // total_cores))
+                    ),
+                    "spark.sql.shuffle.partitions": str(
+                        max(2 * total_cores, math.ceil(input_bytes / target_bytes))
+                    ),
+                    "spark.sql.adaptive.enabled": "true",
+                    "spark.sql.adaptive.coalescePartitions.enabled": "true",
+                    "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(
+                        target_bytes
+                    ),
+                    "spark.sql.adaptive.skewJoin.enabled": "true",
+                    "spark.sql.adaptive.skewJoin.skewedPartitionThresholdInBytes": str(
+                        4 * target_bytes
+                    ),
+                    "spark.sql.autoBroadcastJoinThreshold": str(broadcast_bytes),
+                },
+            },
+            {
+                "Classification": "yarn-site",
+                "Properties": {
+                    "yarn.nodemanager.resource.memory-mb": str(node_memory_mb),
+                    "yarn.nodemanager.resource.cpu-vcores": str(vcpus),
+                    "yarn.scheduler.maximum-allocation-mb": str(node_memory_mb),
+                },
+            },
+        ]
+
     def _setup_spark_processor(self):
         """Sets up the PySpark processor with necessary configurations."""
+        # The container derives the other settings from the hardware, the generated
+        # configuration overrides them
         env_vars = {"AWS_SPARK_CONFIG_MODE": "2"}
         if self.context.cfg["Preprocess"]["SourceMethod"] == "rds":
             rds_secret = SecretManager(
@@ -143,6 +441,10 @@ class PysparkFrameworkStrategy(ProcessingFrameworkStrategy):
             env=env_vars,
             sagemaker_session=self.context,
         )
+        self.spark_configuration = self._get_spark_configuration()
+        self.context.logger.info(
+            f"Spark configuration: {json.dumps(self.spark_configuration, indent=2)}"
+        )
 
     def build(self) -> ProcessingStep:
         """Builds the PySpark processing step.
@@ -150,29 +452,72 @@ class PysparkFrameworkStrategy(ProcessingFrameworkStrategy):
         Returns:
             ProcessingStep: The built processing step.
         """
+        arguments = [
+            "--source-method",
+            self.context.cfg["Preprocess"]["SourceMethod"],
+            "--raw-data-key",
+            self.context.s3_raw_data_key,
+            "--train-data-folder",
+            self.context.processed_train_data_folder,
+            "--validation-data-folder",
+            self.context.processed_validation_data_folder,
+            "--test-data-folder",
+            self.context.processed_test_data_folder,
+            "--train-ratio",
+            self.context.pipeline_params["preprocess_train_ratio"],
+            "--validation-ratio",
+            self.context.pipeline_params["preprocess_validation_ratio"],
+            "--test-ratio",
+            self.context.pipeline_params["preprocess_test_ratio"],
+            "--split-relative-error",
+            str(self.context.cfg["Preprocess"]["SplitRelativeError"]),
+            "--storage-level",
+            self.context.cfg["Preprocess"]["StorageLevel"],
+            "--jdbc-num-partitions",
+            str(self.context.cfg["Preprocess"]["JdbcNumPartitions"]),
+            "--jdbc-fetch-size",
+            str(self.context.cfg["Preprocess"]["JdbcFetchSize"]),
+            "--output-compression",
+            self.context.cfg["Preprocess"]["OutputCompression"],
+            "--output-file-size-mb",
+            str(self.context.cfg["Preprocess"]["OutputFileSizeMB"]),
+            "--output-row-group-size-mb",
+            str(self.context.cfg["Preprocess"]["OutputRowGroupSizeMB"]),
+            "--negative-sampling-ratio",
+            str(self.context.cfg["Preprocess"]["NegativeSamplingRatio"]),
+            "--sample-fraction",
+            str(self.context.cfg["Preprocess"]["SampleFraction"]),
+        ] + self.raw_data_version_arguments() + self.data_quality_arguments()
+        if self.context.cfg["Preprocess"]["RawCache"]:
+            arguments += ["--raw-cache-folder", self.context.raw_cache_folder]
+        if self.context.cfg["Preprocess"]["FeatureStore"]:
+            arguments += [
+                "--feature-store-uri",
+                self.context.feature_store_uri,
+                "--feature-store-bucket-seconds",
+                str(self.context.cfg["Preprocess"]["FeatureStoreTimeBucketSeconds"]),
+            ]
+        if self.context.cfg["Preprocess"]["IncrementalMode"]:
+            arguments += [
+                "--incremental-state-uri",
+                self.context.incremental_state_uri,
+                "--incremental-drift-threshold",
+                str(self.context.cfg["Preprocess"]["IncrementalDriftThreshold"]),
+            ]
+
         run_args = self.spark_processor.run(
             submit_app=self.context.s3_script_manager.get_script_uri(
                 "preprocess_pyspark.py"
             ),
-            submit_jars=["dependencies/mysql-connector-j-9.0.0.jar"],
-            arguments=[
-                "--source-method",
-                self.context.cfg["Preprocess"]["SourceMethod"],
-                "--raw-data-key",
-                self.context.s3_raw_data_key,
-                "--train-data-folder",
-                self.context.processed_train_data_folder,
-                "--validation-data-folder",
-                self.context.processed_validation_data_folder,
-                "--test-data-folder",
-                self.context.processed_test_data_folder,
-                "--train-ratio",
-                self.context.pipeline_params["preprocess_train_ratio"],
-                "--validation-ratio",
-                self.context.pipeline_params["preprocess_validation_ratio"],
-                "--test-ratio",
-                self.context.pipeline_params["preprocess_test_ratio"],
+            submit_py_files=[
+                self.context.s3_script_manager.get_script_uri(script_name)
+                for script_name in PREPROCESS_COMMON_SCRIPTS
+            ],
+            submit_jars=[
+                self.context.s3_script_manager.get_script_uri(MYSQL_CONNECTOR_JAR)
             ],
+            arguments=arguments,
+            configuration=self.spark_configuration,
             outputs=[
                 ProcessingOutput(
                     destination=self.context.processed_train_data_folder,
@@ -189,12 +534,161 @@ class PysparkFrameworkStrategy(ProcessingFrameworkStrategy):
                     output_name="test.parquet",
                     source="/opt/ml/processing/test.parquet",
                 ),
+                ProcessingOutput(
+                    destination=self.context.processed_scalers_folder,
+                    output_name="scalers",
+                    source="/opt/ml/processing/scalers",
+                ),
+                ProcessingOutput(
+                    destination=self.context.processed_metrics_folder,
+                    output_name="metrics",
+                    source="/opt/ml/processing/metrics",
+                ),
             ],
         )
 
         preprocess_step = ProcessingStep(
             name="PySparkDataPreprocess",
             step_args=run_args,
+            cache_config=self.context.preprocess_cache_config,
+        )
+        return preprocess_step
+
+
+class DuckDBFrameworkStrategy(ProcessingFrameworkStrategy):
+    """Processing framework strategy for DuckDB.
+
+    The job runs on a single multithreaded instance of the Scikit-Learn image,
+    installing duckdb offline from the pinned wheels that the pipeline image
+    ships in the dependencies folder.
+
+    Args:
+        context (CreditFraudPipelineContext): The pipeline context.
+
+    Raises:
+        InvalidProcessingFramework: If incremental mode is enabled, which the
+            DuckDB job does not support, or if the duckdb wheels are missing
+            outside of local runs.
+    """
+
+    def __init__(self, context: CreditFraudPipelineContext):
+        self.context = context
+        if self.context.cfg["Preprocess"]["IncrementalMode"]:
+            raise InvalidProcessingFramework(
+                "Incremental mode is not supported by the duckdb framework. "
+                + "Use scikit-learn or pyspark."
+            )
+
+        self.context.s3_script_manager.upload_script(
+            source_directory=context.cfg["Global"]["JobsScriptsFolder"],
+            script_name="preprocess_duckdb.py",
+        )
+        # Local runs use the duckdb installed next to the pipeline
+        self.duckdb_wheels = sorted(
+            file_name
+            for file_name in os.listdir("dependencies")
+            if file_name.startswith("duckdb-") and file_name.endswith(".whl")
+        )
+        if self.duckdb_wheels:
+            self.context.s3_script_manager.upload_scripts(
+                source_directory="dependencies",
+                script_names=self.duckdb_wheels,
+                folder_name=DUCKDB_WHEELS_FOLDER,
+            )
+        elif not self.context.local_run:
+            raise InvalidProcessingFramework(
+                "The duckdb wheels are missing from the dependencies folder. "
+                + "Run the pipeline from its Docker image."
+            )
+        self.upload_common_scripts()
+
+        self.context.logger.info("Configuring DuckDB processor")
+        self.duckdb_processor = SKLearnProcessor(
+            role=self.context.sagemaker_role,
+            framework_version="1.2-1",
+            instance_count=1,
+            instance_type=self.context.cfg["Preprocess"][
+                "PreprocessDuckDBInstanceType"
+            ],
+            base_job_name=f"{self.context.cfg['Global']['BaseJobNamePrefix']}-preprocess-duckdb",
+        )
+
+    def build(self) -> ProcessingStep:
+        """Builds the DuckDB processing step.
+
+        Returns:
+            ProcessingStep: The built processing step.
+        """
+        preprocess_step = ProcessingStep(
+            name="DuckDBDataPreprocess",
+            processor=self.duckdb_processor,
+            inputs=[
+                self.common_scripts_input(),
+                ProcessingInput(
+                    source=self.context.s3_raw_data_key,
+                    destination="/opt/ml/processing/raw",
+                ),
+            ]
+            + (
+                [
+                    ProcessingInput(
+                        source=self.context.s3_script_manager.get_folder_uri(
+                            DUCKDB_WHEELS_FOLDER
+                        ),
+                        destination="/opt/ml/processing/input/dependencies",
+                    )
+                ]
+                if self.duckdb_wheels
+                else []
+            ),
+            outputs=[
+                ProcessingOutput(
+                    destination=self.context.processed_train_data_folder,
+                    output_name="train.parquet",
+                    source="/opt/ml/processing/train.parquet",
+                ),
+                ProcessingOutput(
+                    destination=self.context.processed_validation_data_folder,
+                    output_name="validation.parquet",
+                    source="/opt/ml/processing/validation.parquet",
+                ),
+                ProcessingOutput(
+                    destination=self.context.processed_test_data_folder,
+                    output_name="test.parquet",
+                    source="/opt/ml/processing/test.parquet",
+                ),
+                ProcessingOutput(
+                    destination=self.context.processed_scalers_folder,
+                    output_name="scalers",
+                    source="/opt/ml/processing/scalers",
+                ),
+            ],
+            job_arguments=[
+                "--raw-data-key",
+                "/opt/ml/processing/raw",
+                "--train-ratio",
+                self.context.pipeline_params["preprocess_train_ratio"],
+                "--validation-ratio",
+                self.context.pipeline_params["preprocess_validation_ratio"],
+                "--test-ratio",
+                self.context.pipeline_params["preprocess_test_ratio"],
+                "--output-compression",
+                self.context.cfg["Preprocess"]["OutputCompression"],
+                "--output-file-size-mb",
+                str(self.context.cfg["Preprocess"]["OutputFileSizeMB"]),
+                "--output-row-group-size-mb",
+                str(self.context.cfg["Preprocess"]["OutputRowGroupSizeMB"]),
+                "--feature-dtype",
+                self.context.cfg["Preprocess"]["SklearnFeatureDtype"],
+                "--negative-sampling-ratio",
+                str(self.context.cfg["Preprocess"]["NegativeSamplingRatio"]),
+                "--sample-fraction",
+                str(self.context.cfg["Preprocess"]["SampleFraction"]),
+            ]
+            + self.raw_data_version_arguments()
+            + self.data_quality_arguments(),
+            code=self.context.s3_script_manager.get_script_uri("preprocess_duckdb.py"),
+            cache_config=self.context.preprocess_cache_config,
         )
         return preprocess_step
 
@@ -204,6 +698,10 @@ class PreprocessStepJob(Step):
 
     Args:
         context (CreditFraudPipelineContext): The pipeline context.
+
+    Raises:
+        InvalidProcessingFramework: If the feature store is enabled with a
+            framework other than pyspark, the only one that writes it.
     """
 
     def __init__(self, context: CreditFraudPipelineContext):
@@ -211,6 +709,13 @@ class PreprocessStepJob(Step):
         self._strategy_framework = self._instantiate_strategy_framework(
             strategy=self.context.cfg["Preprocess"]["PreprocessFramework"]
         )
+        if self.context.cfg["Preprocess"]["FeatureStore"] and not isinstance(
+            self._strategy_framework, PysparkFrameworkStrategy
+        ):
+            raise InvalidProcessingFramework(
+                "The feature store is only written by the pyspark framework. "
+                + "Use pyspark or disable FeatureStore."
+            )
 
     @property
     def strategy_framework(self):
@@ -227,7 +732,7 @@ class PreprocessStepJob(Step):
 
         Args:
             strategy (str): The processing framework strategy name.
-            Accepts "scikit-learn" or "pyspark". Ignores uppercase.
+            Accepts "scikit-learn", "pyspark" or "duckdb". Ignores uppercase.
 
         Returns:
             ProcessingFrameworkStrategy: The instantiated processing framework strategy.
@@ -240,10 +745,12 @@ class PreprocessStepJob(Step):
             return ScikitLearnFrameworkStrategy(self.context)
         elif strategy.lower() in ("pyspark", "spark"):
             return PysparkFrameworkStrategy(self.context)
+        elif strategy.lower() == "duckdb":
+            return DuckDBFrameworkStrategy(self.context)
         else:
             raise InvalidProcessingFramework(
                 "Invalid sagemaker processing framework. "
-                + "Available frameworks are: scikit-learn, pyspark."
+                + "Available frameworks are: scikit-learn, pyspark, duckdb."
             )
 
     def build(self) -> ProcessingStep:
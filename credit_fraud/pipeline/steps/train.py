@@ -4,6 +4,7 @@ from typing import Literal
 from sagemaker import model_uris
 from sagemaker.estimator import Estimator
 from sagemaker.xgboost.estimator import XGBoost
+from sagemaker.workflow.functions import Join
 from sagemaker.workflow.steps import TrainingStep
 from sagemaker.inputs import TrainingInput
 from sagemaker.image_uris import retrieve
@@ -11,6 +12,7 @@ from sagemaker.image_uris import retrieve
 from .step import Step
 from credit_fraud.pipeline.context import CreditFraudPipelineContext
 from credit_fraud.pipeline.exceptions import InvalidAlgorithmFramework
+from credit_fraud.utils import ArtifactCache
 
 
 class TrainingAlgorithmStrategy(ABC):
@@ -21,9 +23,22 @@ class TrainingAlgorithmStrategy(ABC):
         context (CreditFraudPipelineContext): The context object for the 
             credit fraud pipeline.
         model_environment (dict): The model environment containing MLflow ARN 
-            and run ID.
+            and run ID. Cached training jobs start their own MLflow run, since the
+            run ID changes on every execution and would defeat the cache.
+        model_fingerprint (str): Fingerprint of the model, which hashes the
+            processed data fingerprint, the model parameters and the training
+            code. None when the processed folders are per-run.
+        model_output_path (str): The S3 output path of the model artifacts. With
+            `ArtifactCache` or step caching, it is keyed by the model fingerprint
+            instead of the execution name.
+        cached_model_artifact_uri (str): The S3 URI of an existing model artifact
+            with the same key, None when the model must be trained.
     """
 
+    source_dir: str = None
+    # Shared job modules copied next to the entry point of every training job
+    dependencies: list = ["credit_fraud/pipeline/jobs/model_manifest.py"]
+
     def __init__(self, context: CreditFraudPipelineContext) -> None:
         """
         Initializes a new instance of the TrainingAlgorithmStrategy class.
@@ -33,10 +48,53 @@ class TrainingAlgorithmStrategy(ABC):
                 credit fraud pipeline.
         """
         self.context = context
-        self.model_environment = {
-            "MLFLOW_ARN": self.context.mlflow.server_arn,
-            "MLFLOW_RUN_ID": self.context.mlflow.experiment_run_id,
-        }
+        self.model_environment = {"MLFLOW_ARN": self.context.mlflow.server_arn}
+        if not self.context.training_cache_config.enable_caching:
+            self.model_environment["MLFLOW_RUN_ID"] = (
+                self.context.mlflow.experiment_run_id
+            )
+        self.__init_model_output_path()
+
+    def __init_model_output_path(self):
+        """
+        Sets the model output path and looks up an already trained model.
+
+        Models are content-addressed only when the processed data is, so that a
+        model is never reused for different training data. The output path is
+        part of the step cache key, so cached training writes there too.
+        """
+        self.model_output_path = (
+            f"{self.context.bucket_folder}/runs/{self.context.execution_name}/model"
+        )
+        self.model_fingerprint = None
+        self.cached_model_artifact_uri = None
+        if not self.context.processed_data_fingerprint:
+            return
+        self.model_fingerprint = ArtifactCache.fingerprint(
+            self.context.processed_data_fingerprint,
+            self.context.training_algorithm.lower(),
+            self.context.model_params,
+            self.context.cfg["Training"],
+            paths=[self.source_dir, *self.dependencies],
+        )
+        use_artifact_cache = self.context.cfg["Global"]["ArtifactCache"]
+        if not (
+            use_artifact_cache or self.context.training_cache_config.enable_caching
+        ):
+            return
+        self.model_output_path, default_output_path = (
+            self.context.get_artifact_folder("model", self.model_fingerprint, "jobs")
+        )
+        if not use_artifact_cache:
+            return
+        # Training jobs write to {output_path}/{job name}/output/model.tar.gz
+        self.cached_model_artifact_uri = self.context.artifact_cache.find_latest(
+            default_output_path, "model.tar.gz"
+        )
+        if self.cached_model_artifact_uri:
+            self.context.logger.info(
+                f"Reusing model artifact {self.cached_model_artifact_uri}"
+            )
 
     @abstractmethod
     def get_image_uri(self, scope: Literal["training", "inference"]) -> str:
@@ -52,6 +110,44 @@ class TrainingAlgorithmStrategy(ABC):
         """
         pass
 
+    def get_inference_environment(self) -> dict:
+        """
+        Returns the environment variables of the serving container that depend
+        on the inference code shipped inside the model artifact.
+
+        Returns:
+            dict: The inference environment variables.
+        """
+        return {}
+
+    def get_model_only_artifact_uri(self, training_step: TrainingStep = None):
+        """
+        Returns the S3 URI of the archive holding only the model files and their
+        manifest, published as the output data next to `model.tar.gz`. Unlike
+        `model.tar.gz`, it does not bundle the inference code and dependencies,
+        which only the serving container needs.
+
+        Args:
+            training_step (TrainingStep, optional): The training step of the
+                execution, None when the cached model artifact is reused.
+
+        Returns:
+            str: The S3 URI of the model only archive.
+        """
+        if training_step is None:
+            return (
+                self.cached_model_artifact_uri.rsplit("/", 1)[0] + "/output.tar.gz"
+            )
+        return Join(
+            on="/",
+            values=[
+                self.model_output_path,
+                training_step.properties.TrainingJobName,
+                "output",
+                "output.tar.gz",
+            ],
+        )
+
     @abstractmethod
     def build(self, processed_data_uri: str) -> TrainingStep:
         """
@@ -78,14 +174,17 @@ class XGBoostAlgorithmStrategy(TrainingAlgorithmStrategy):
         xgb_estimator (XGBoost): The XGBoost estimator for training the model.
     """
 
+    source_dir = "credit_fraud/pipeline/jobs/xgboost"
+
     def __init__(self, context: CreditFraudPipelineContext) -> None:
         super().__init__(context)
         self.context.logger.info("Configuring XGBoost Model")
         self.xgb_estimator = XGBoost(
             entry_point="train.py",
-            output_path=f"{self.context.bucket_folder}/runs/{self.context.execution_name}/model",
-            code_location=f"{self.context.bucket_folder}/runs/{self.context.execution_name}/scripts/",
-            source_dir="credit_fraud/pipeline/jobs/xgboost",
+            output_path=self.model_output_path,
+            code_location=f"{self.context.bucket_folder}/code/",
+            source_dir=self.source_dir,
+            dependencies=self.dependencies,
             hyperparameters=self.context.model_params,
             environment=self.model_environment,
             role=self.context.sagemaker_role,
@@ -137,6 +236,7 @@ class XGBoostAlgorithmStrategy(TrainingAlgorithmStrategy):
                 "train_data_path": training_dataset_s3_path,
                 "validation_data_path": validation_dataset_s3_path,
             },
+            cache_config=self.context.training_cache_config,
         )
         return train_step
 
@@ -157,10 +257,13 @@ class LGBMAlgorithmStrategy(TrainingAlgorithmStrategy):
 
     Methods:
         get_image_uri: Retrieves the image URI for the training scope.
+        get_inference_environment: Versions the inference code of the model.
         build: Builds the training step for the LightGBM algorithm.
 
     """
 
+    source_dir = "credit_fraud/pipeline/jobs/lgbm"
+
     def __init__(self, context: CreditFraudPipelineContext) -> None:
         super().__init__(context)
         self.context.logger.info("Configuring LGBM Model")
@@ -179,9 +282,10 @@ class LGBMAlgorithmStrategy(TrainingAlgorithmStrategy):
         self.lgbm_estimator = Estimator(
             role=self.context.sagemaker_role,
             image_uri=train_image_uri,
-            output_path=f"{self.context.bucket_folder}/runs/{self.context.execution_name}/model",
-            code_location=f"{self.context.bucket_folder}/runs/{self.context.execution_name}/scripts/",
-            source_dir="credit_fraud/pipeline/jobs/lgbm",
+            output_path=self.model_output_path,
+            code_location=f"{self.context.bucket_folder}/code/",
+            source_dir=self.source_dir,
+            dependencies=self.dependencies,
             model_uri=train_model_uri,
             entry_point="train.py",
             instance_count=self.context.cfg["Training"]["TrainInstanceCount"],
@@ -212,6 +316,23 @@ class LGBMAlgorithmStrategy(TrainingAlgorithmStrategy):
             instance_type=self.context.cfg["Training"]["TrainInstanceType"],
         )
 
+    def get_inference_environment(self) -> dict:
+        """
+        Versions the inference code that training copies into the model artifact.
+
+        Hot swaps only replace the model files of a running endpoint, so the
+        deploy Lambda compares this version to refuse swaps that would need the
+        inference code of the new artifact.
+
+        Returns:
+            dict: The inference environment variables.
+        """
+        return {
+            "INFERENCE_CODE_VERSION": ArtifactCache.fingerprint(
+                paths=["credit_fraud/pipeline/jobs/lgbm/js_inference_code"]
+            )
+        }
+
     def build(self, train_data_uri: str, validation_data_uri: str) -> TrainingStep:
         """
         Builds the training step for the LightGBM algorithm.
@@ -240,6 +361,7 @@ class LGBMAlgorithmStrategy(TrainingAlgorithmStrategy):
                 "train": training_dataset_s3_path,
                 "validation": validation_dataset_s3_path,
             },
+            cache_config=self.context.training_cache_config,
         )
         return train_step
 
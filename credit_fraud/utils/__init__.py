@@ -1,5 +1,7 @@
 from .logger import Logger
 from .helpers import EnvironHelper, S3ScriptManager, PyProjectHelper, SecretManager
+from .artifact_cache import ArtifactCache
+from .feature_store import FeatureStore
 
 __all__ = [
     "Logger",
@@ -7,4 +9,6 @@ __all__ = [
     "S3ScriptManager",
     "PyProjectHelper",
     "SecretManager",
+    "ArtifactCache",
+    "FeatureStore",
 ]
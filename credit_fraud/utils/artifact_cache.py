@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Iterable, Optional
+
+import boto3
+
+
+class ArtifactCache:
+    """Content-addressed store of pipeline step outputs, shared by every execution.
+
+    A step output is written under `{destination_folder}/{kind}/{fingerprint}`,
+    where the fingerprint hashes everything the step output depends on: upstream
+    fingerprints, configurations and the contents of the job scripts. When the
+    output of a fingerprint already exists, the pipeline builder points the
+    downstream steps to it instead of running the step again.
+
+    Args:
+        destination_bucket_name (str): S3 bucket holding the artifacts.
+        destination_folder (str): S3 prefix under which artifacts are stored.
+        region (str): AWS region of the S3 client.
+        logger: Logger object.
+    """
+
+    def __init__(
+        self,
+        destination_bucket_name: str,
+        destination_folder: str,
+        region: str = None,
+        logger=logging,
+    ):
+        self.logger = logger
+        self.destination_bucket_name = destination_bucket_name
+        self.destination_folder = destination_folder
+        self.s3_client = boto3.client("s3", region_name=region)
+
+    @staticmethod
+    def fingerprint(*values, paths: Iterable[str] = ()) -> str:
+        """Hash JSON serializable values and the contents of files or directories.
+
+        Args:
+            values: configurations and upstream fingerprints of the step.
+            paths (Iterable[str]): job scripts or source directories of the step.
+
+        Returns:
+            str: The first 16 hexadecimal digits of the SHA-256 digest.
+        """
+        digest = hashlib.sha256(json.dumps(values, sort_keys=True).encode())
+        for path in paths:
+            for file_path in ArtifactCache._source_files(path):
+                digest.update(file_path.encode())
+                with open(file_path, "rb") as file:
+                    for block in iter(lambda: file.read(1 << 20), b""):
+                        digest.update(block)
+        return digest.hexdigest()[:16]
+
+    def get_uri(self, kind: str, fingerprint: str) -> str:
+        return (
+            f"s3://{self.destination_bucket_name}/{self.destination_folder}"
+            f"/{kind}/{fingerprint}"
+        )
+
+    def exists(self, uri: str) -> bool:
+        """Whether at least one object was written under the S3 folder."""
+        response = self.s3_client.list_objects_v2(
+            Bucket=self.destination_bucket_name,
+            Prefix=self._folder_key(uri),
+            MaxKeys=1,
+        )
+        return response.get("KeyCount", 0) > 0
+
+    def find_latest(self, uri: str, file_name: str) -> Optional[str]:
+        """Find the newest object named `file_name` under the S3 folder.
+
+        Training jobs write their artifacts to a folder named after the job, so
+        the model of a fingerprint is searched below its output path.
+
+        Returns:
+            Optional[str]: The S3 URI of the object, None when there is none.
+        """
+        latest = None
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=self.destination_bucket_name, Prefix=self._folder_key(uri)
+        ):
+            for item in page.get("Contents", []):
+                if item["Key"].endswith(f"/{file_name}") and (
+                    latest is None or item["LastModified"] > latest["LastModified"]
+                ):
+                    latest = item
+        if latest is None:
+            return None
+        return f"s3://{self.destination_bucket_name}/{latest['Key']}"
+
+    def _folder_key(self, uri: str) -> str:
+        prefix = f"s3://{self.destination_bucket_name}/"
+        if not uri.startswith(prefix):
+            raise ValueError(f"{uri} is not in bucket {self.destination_bucket_name}")
+        return uri[len(prefix):].rstrip("/") + "/"
+
+    @staticmethod
+    def _source_files(path: str):
+        if os.path.isfile(path):
+            return [path]
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+            files.extend(
+                os.path.join(root, name)
+                for name in sorted(names)
+                if not name.endswith(".pyc")
+            )
+        return files
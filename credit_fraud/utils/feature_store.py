@@ -0,0 +1,89 @@
+import json
+import math
+from typing import List, Optional
+
+import fsspec
+import pandas as pd
+
+
+class FeatureStore:
+    """Reader of the time-partitioned store of scaled features.
+
+    The PySpark preprocessing writes the scaled rows of every run under
+    `{uri}/scaler_version={version}/time_bucket={bucket}/`, where the version
+    hashes the scaler statistics and the bucket width, and a bucket holds the
+    rows with `Time` in `[bucket * width, (bucket + 1) * width)`. Reads of a
+    time window prune the buckets outside of it, so training windows, backfill
+    scoring and drift analysis read the stored features instead of recomputing
+    them.
+
+    Args:
+        uri (str): S3 URI or local folder of the store.
+    """
+
+    def __init__(self, uri: str):
+        self.uri = uri.rstrip("/")
+
+    def _read_json(self, path: str) -> dict:
+        with fsspec.open(f"{self.uri}/{path}") as file:
+            return json.load(file)
+
+    def latest_version(self) -> str:
+        """The scaler version written by the last preprocessing."""
+        return self._read_json("latest.json")["scaler_version"]
+
+    def describe(self, version: str) -> dict:
+        """The scaler statistics and the time bucket width of a scaler version."""
+        return self._read_json(f"scaler_version={version}/_version.json")
+
+    def read(
+        self,
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+        version: Optional[str] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Read the rows of a scaler version with `Time` in `[start_time, end_time)`.
+
+        Args:
+            start_time (float, optional): Start of the window, unbounded if None.
+            end_time (float, optional): End of the window, unbounded if None.
+            version (str, optional): Scaler version, the latest one if None.
+            columns (List[str], optional): Columns to read, all of them if None.
+
+        Returns:
+            pd.DataFrame: The rows of the window, ordered by time bucket.
+        """
+        version = version or self.latest_version()
+        bucket_seconds = self.describe(version)["time_bucket_seconds"]
+        first_bucket = -math.inf if start_time is None else start_time // bucket_seconds
+        last_bucket = math.inf if end_time is None else end_time // bucket_seconds
+        filters = []
+        if start_time is not None:
+            filters.append(("Time", ">=", start_time))
+        if end_time is not None:
+            filters.append(("Time", "<", end_time))
+
+        file_system, folder = fsspec.core.url_to_fs(
+            f"{self.uri}/scaler_version={version}"
+        )
+        buckets = {}
+        for path in file_system.ls(folder, detail=False):
+            name = path.rstrip("/").rsplit("/", 1)[-1]
+            if name.startswith("time_bucket="):
+                buckets[int(name.removeprefix("time_bucket="))] = path
+        # Buckets hold contiguous Time ranges in Time order, only those of the
+        # window are opened
+        frames = [
+            pd.read_parquet(
+                buckets[bucket],
+                columns=columns,
+                filters=filters or None,
+                filesystem=file_system,
+            )
+            for bucket in sorted(buckets)
+            if first_bucket <= bucket <= last_bucket
+        ]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
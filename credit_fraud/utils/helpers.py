@@ -1,4 +1,5 @@
 import os
+import hashlib
 import logging
 import json
 
@@ -27,6 +28,12 @@ class EnvironHelper:
 
 
 class S3ScriptManager:
+    """Uploads job scripts under a prefix derived from their content.
+
+    The same script always gets the same S3 URI, so step arguments referencing
+    it only change when the script does, which keeps step cache keys stable.
+    """
+
     def __init__(
         self,
         region: str,
@@ -39,18 +46,58 @@ class S3ScriptManager:
         self.destination_bucket_name = destination_bucket_name
         self.destination_folder = destination_folder
         self.s3_client = boto3.client("s3", region_name=region)
+        self._script_keys = {}
+        self._folder_keys = {}
 
     def upload_script(self, source_directory, script_name):
+        with open(f"{source_directory}/{script_name}", "rb") as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()[:16]
+        key = f"{self.destination_folder}/{content_hash}/{script_name}"
+        self._script_keys[script_name] = key
         self.logger.info(f"Uploading script '{script_name}' to S3")
         res = self.s3_client.upload_file(
             Filename=f"{source_directory}/{script_name}",
             Bucket=self.destination_bucket_name,
-            Key=f"{self.destination_folder}/{script_name}",
+            Key=key,
         )
         return res
 
+    def upload_scripts(self, source_directory, script_names, folder_name):
+        """Uploads files to a folder under a prefix derived from all their contents.
+
+        Every file stays reachable with `get_script_uri`, and the folder with
+        `get_folder_uri`, to mount the files as a single processing input.
+        """
+        content_hash = hashlib.sha256()
+        for script_name in script_names:
+            with open(f"{source_directory}/{script_name}", "rb") as file:
+                content_hash.update(script_name.encode())
+                content_hash.update(file.read())
+        folder_key = (
+            f"{self.destination_folder}/{content_hash.hexdigest()[:16]}/{folder_name}"
+        )
+        self._folder_keys[folder_name] = folder_key
+        for script_name in script_names:
+            key = f"{folder_key}/{script_name}"
+            self._script_keys[script_name] = key
+            self.logger.info(f"Uploading script '{script_name}' to S3")
+            self.s3_client.upload_file(
+                Filename=f"{source_directory}/{script_name}",
+                Bucket=self.destination_bucket_name,
+                Key=key,
+            )
+
+    def get_folder_uri(self, folder_name):
+        key = self._folder_keys.get(
+            folder_name, f"{self.destination_folder}/{folder_name}"
+        )
+        return f"s3://{self.destination_bucket_name}/{key}/"
+
     def get_script_uri(self, script_name):
-        return f"s3://{self.destination_bucket_name}/{self.destination_folder}/{script_name}"
+        key = self._script_keys.get(
+            script_name, f"{self.destination_folder}/{script_name}"
+        )
+        return f"s3://{self.destination_bucket_name}/{key}"
 
 
 class SecretManager:
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+
+INFERENCE_CODE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "credit_fraud",
+    "pipeline",
+    "jobs",
+    "lgbm",
+    "js_inference_code",
+)
+INFERENCE_MODULES = ["boot", "constants", "inference", "model_watcher", "shadow"]
+JOBS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "credit_fraud",
+    "pipeline",
+    "jobs",
+)
+
+
+@pytest.fixture
+def inference_code(monkeypatch):
+    """Put the LightGBM serving code on sys.path, as the serving container does."""
+    monkeypatch.syspath_prepend(INFERENCE_CODE_DIR)
+    monkeypatch.setenv("SAGEMAKER_PROGRAM", "inference.py")
+    yield INFERENCE_CODE_DIR
+    for name in list(sys.modules):
+        if name.split(".")[0] in INFERENCE_MODULES:
+            del sys.modules[name]
+
+
+@pytest.fixture
+def preprocess_modules(monkeypatch):
+    """Put the shared preprocessing modules on sys.path, as the jobs import them."""
+    monkeypatch.syspath_prepend(JOBS_DIR)
+    yield JOBS_DIR
+    for name in list(sys.modules):
+        if name.startswith("preprocess_"):
+            del sys.modules[name]
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from credit_fraud.utils import ArtifactCache
+
+
+def _make_cache():
+    return ArtifactCache(
+        destination_bucket_name="dest-bucket",
+        destination_folder="artifacts",
+        region="us-east-1",
+    )
+
+
+def test_fingerprint_follows_values_and_sources(tmp_path):
+    (tmp_path / "train.py").write_text("print('hello')")
+    fingerprint = ArtifactCache.fingerprint({"a": 1}, paths=[str(tmp_path)])
+
+    (tmp_path / "__pycache__").mkdir()
+    (tmp_path / "__pycache__" / "train.cpython-311.pyc").write_bytes(b"\x00")
+    assert ArtifactCache.fingerprint({"a": 1}, paths=[str(tmp_path)]) == fingerprint
+    assert ArtifactCache.fingerprint({"a": 2}, paths=[str(tmp_path)]) != fingerprint
+
+    (tmp_path / "train.py").write_text("print('changed')")
+    assert ArtifactCache.fingerprint({"a": 1}, paths=[str(tmp_path)]) != fingerprint
+
+
+def test_find_latest_model(mocker):
+    cache = _make_cache()
+    paginator = mocker.Mock()
+    paginator.paginate.return_value = [
+        {
+            "Contents": [
+                {
+                    "Key": "artifacts/model/abc/job-1/output/model.tar.gz",
+                    "LastModified": datetime(2024, 1, 1),
+                },
+                {
+                    "Key": "artifacts/model/abc/job-2/output/model.tar.gz",
+                    "LastModified": datetime(2024, 1, 2),
+                },
+                {
+                    "Key": "artifacts/model/abc/job-3/debug-output/events.json",
+                    "LastModified": datetime(2024, 1, 3),
+                },
+            ]
+        }
+    ]
+    mocker.patch.object(cache.s3_client, "get_paginator", return_value=paginator)
+
+    uri = cache.find_latest(cache.get_uri("model", "abc"), "model.tar.gz")
+    assert uri == "s3://dest-bucket/artifacts/model/abc/job-2/output/model.tar.gz"
+    paginator.paginate.assert_called_once_with(
+        Bucket="dest-bucket", Prefix="artifacts/model/abc/"
+    )
+
+    paginator.paginate.return_value = [{}]
+    assert cache.find_latest(cache.get_uri("model", "abc"), "model.tar.gz") is None
@@ -0,0 +1,34 @@
+import json
+
+import pandas as pd
+
+from credit_fraud.utils import FeatureStore
+
+
+def _write_store(root, version="abc"):
+    folder = root / f"scaler_version={version}"
+    for bucket, times in {0: [10, 50], 1: [100, 150], 2: [210, 250]}.items():
+        (folder / f"time_bucket={bucket}").mkdir(parents=True)
+        pd.DataFrame(
+            {"Class": [0, 1], "V1": [0.1, 0.2], "Time": times}
+        ).to_parquet(folder / f"time_bucket={bucket}" / "part-0.parquet")
+    (folder / "_version.json").write_text(
+        json.dumps({"scaler_version": version, "time_bucket_seconds": 100})
+    )
+    (root / "latest.json").write_text(json.dumps({"scaler_version": version}))
+
+
+def test_read_prunes_time_buckets(tmp_path):
+    _write_store(tmp_path)
+    # A bucket outside of the window is never opened
+    (tmp_path / "scaler_version=abc" / "time_bucket=0" / "part-0.parquet").write_bytes(
+        b"not parquet"
+    )
+    store = FeatureStore(str(tmp_path))
+
+    df = store.read(start_time=100, end_time=250)
+    assert df["Time"].tolist() == [100, 150, 210]
+    assert list(df.columns) == ["Class", "V1", "Time"]
+    assert store.read(start_time=150, columns=["V1"]).to_dict("list") == {
+        "V1": [0.2, 0.1, 0.2]
+    }
@@ -1,6 +1,8 @@
 import os
 
+import boto3
 import pytest
+from moto import mock_aws
 from unittest.mock import patch, mock_open
 import credit_fraud.utils.helpers as helpers
 
@@ -47,3 +49,34 @@ def test_S3ScriptManager_instance(mocker):
     assert script_manager.destination_folder == "dest-folder"
     assert script_manager.logger
     assert type(script_manager.get_script_uri("test.py")) is str
+
+
+def test_S3ScriptManager_upload_scripts(tmp_path):
+    for name in ("a.py", "b.py"):
+        (tmp_path / name).write_text(f"# {name}")
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket="dest-bucket")
+        script_manager = helpers.S3ScriptManager(
+            region="us-east-1",
+            destination_bucket_name="dest-bucket",
+            destination_folder="dest-folder",
+        )
+        script_manager.upload_scripts(str(tmp_path), ["a.py", "b.py"], "common")
+        folder_uri = script_manager.get_folder_uri("common")
+        assert folder_uri.startswith("s3://dest-bucket/dest-folder/")
+        assert folder_uri.endswith("/common/")
+        assert script_manager.get_script_uri("a.py") == f"{folder_uri}a.py"
+        keys = [
+            item["Key"]
+            for item in s3_client.list_objects_v2(Bucket="dest-bucket")["Contents"]
+        ]
+        prefix = folder_uri.removeprefix("s3://dest-bucket/")
+        assert sorted(keys) == [f"{prefix}a.py", f"{prefix}b.py"]
+
+        # The prefix only changes with the contents of the files
+        script_manager.upload_scripts(str(tmp_path), ["a.py", "b.py"], "common")
+        assert script_manager.get_folder_uri("common") == folder_uri
+        (tmp_path / "b.py").write_text("# changed")
+        script_manager.upload_scripts(str(tmp_path), ["a.py", "b.py"], "common")
+        assert script_manager.get_folder_uri("common") != folder_uri
@@ -0,0 +1,154 @@
+import importlib
+import json
+import os
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+
+LAMBDA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "cloudformation",
+    "src",
+    "lambda",
+    "deploy_model",
+)
+BUCKET = "models"
+POINTER_KEY = "deployment/model-pointer.json"
+POINTER_URI = f"s3://{BUCKET}/{POINTER_KEY}"
+ENDPOINT_ARN = "arn:aws:sagemaker:us-east-1:1:endpoint/credit-fraud"
+
+
+@pytest.fixture
+def deploy_lambda(monkeypatch):
+    monkeypatch.syspath_prepend(LAMBDA_DIR)
+    monkeypatch.setenv("MODEL_MIN_CAPACITY", "1")
+    monkeypatch.setenv("MODEL_MAX_CAPACITY", "2")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    return importlib.import_module("lambda_deploy_model")
+
+
+@pytest.fixture
+def s3_client(deploy_lambda):
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def _container(image="lgbm:1", code_version="a", pointer=POINTER_URI):
+    env = {"INFERENCE_CODE_VERSION": code_version}
+    if pointer:
+        env["MODEL_POINTER_URI"] = pointer
+    return {"Image": image, "ModelDataUrl": "s3://m/model.tar.gz", "Environment": env}
+
+
+def _make_sm_client(mocker, containers, served_tag=None, status="InService"):
+    sm_client = mocker.MagicMock()
+    sm_client.describe_endpoint.return_value = {
+        "EndpointStatus": status,
+        "EndpointArn": ENDPOINT_ARN,
+        "EndpointConfigName": "config-model-a",
+    }
+    sm_client.describe_endpoint_config.return_value = {
+        "ProductionVariants": [{"ModelName": "model-a"}]
+    }
+    sm_client.list_tags.return_value = {
+        "Tags": [{"Key": "ServedModelName", "Value": served_tag}] if served_tag else []
+    }
+    sm_client.describe_model.side_effect = lambda ModelName: {
+        "PrimaryContainer": containers[ModelName]
+    }
+    return sm_client
+
+
+def _pointer(s3_client):
+    return json.loads(
+        s3_client.get_object(Bucket=BUCKET, Key=POINTER_KEY)["Body"].read()
+    )
+
+
+def test_hot_swap_moves_the_pointer_and_tags_the_served_model(
+    deploy_lambda, s3_client, mocker
+):
+    sm_client = _make_sm_client(
+        mocker,
+        {"model-a": _container(), "model-b": _container(), "model-c": _container()},
+        served_tag="model-b",
+    )
+    event = {"model_name": "model-c", "endpoint_name": "credit-fraud"}
+
+    assert deploy_lambda._hot_swap_model(sm_client, s3_client, event, _container())
+    assert _pointer(s3_client)["version"] == "model-c"
+    # Compared with the model served after the last hot swap, not the config one
+    sm_client.describe_model.assert_called_once_with(ModelName="model-b")
+    sm_client.add_tags.assert_called_once_with(
+        ResourceArn=ENDPOINT_ARN,
+        Tags=[{"Key": "ServedModelName", "Value": "model-c"}],
+    )
+
+
+@pytest.mark.parametrize(
+    "new_container",
+    [_container(image="lgbm:2"), _container(code_version="b")],
+)
+def test_hot_swap_requires_the_same_image_and_code(
+    deploy_lambda, s3_client, mocker, new_container
+):
+    sm_client = _make_sm_client(mocker, {"model-a": _container()})
+    event = {"model_name": "model-b", "endpoint_name": "credit-fraud"}
+
+    assert not deploy_lambda._hot_swap_model(sm_client, s3_client, event, new_container)
+    sm_client.add_tags.assert_not_called()
+
+
+def test_full_deploy_moves_the_pointer_once_in_service(
+    deploy_lambda, s3_client, mocker
+):
+    stale = {"version": "model-a", "model_data": "s3://m/a.tar.gz"}
+    s3_client.put_object(Bucket=BUCKET, Key=POINTER_KEY, Body=json.dumps(stale))
+    sm_client = _make_sm_client(
+        mocker, {"model-a": _container(), "model-b": _container(image="lgbm:2")}
+    )
+    pointers = []
+
+    def deploy_endpoint(*args):
+        # New instances booting during the deployment must not see model-a
+        pointers.append(s3_client.list_objects_v2(Bucket=BUCKET).get("KeyCount"))
+
+    mocker.patch.object(deploy_lambda, "_deploy_endpoint", side_effect=deploy_endpoint)
+    mocker.patch.object(
+        deploy_lambda.boto3,
+        "client",
+        side_effect=lambda name: s3_client if name == "s3" else sm_client,
+    )
+    event = {"model_name": "model-b", "endpoint_name": "credit-fraud", "hot_swap": True}
+
+    deploy_lambda.lambda_handler(event, None)
+
+    assert pointers == [0]
+    assert _pointer(s3_client)["version"] == "model-b"
+    sm_client.add_tags.assert_called_once()
+
+
+def test_failed_full_deploy_restores_the_pointer(deploy_lambda, s3_client, mocker):
+    stale = {"version": "model-a", "model_data": "s3://m/a.tar.gz"}
+    s3_client.put_object(Bucket=BUCKET, Key=POINTER_KEY, Body=json.dumps(stale))
+    sm_client = _make_sm_client(mocker, {"model-b": _container()})
+    mocker.patch.object(
+        deploy_lambda,
+        "_deploy_endpoint",
+        side_effect=ClientError({"Error": {"Code": "ValidationException"}}, "Update"),
+    )
+    mocker.patch.object(
+        deploy_lambda.boto3,
+        "client",
+        side_effect=lambda name: s3_client if name == "s3" else sm_client,
+    )
+    event = {"model_name": "model-b", "endpoint_name": "credit-fraud"}
+
+    with pytest.raises(ClientError):
+        deploy_lambda.lambda_handler(event, None)
+    assert _pointer(s3_client) == stale
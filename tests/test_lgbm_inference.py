@@ -0,0 +1,135 @@
+import json
+
+import joblib
+import numpy as np
+import pandas as pd
+from lightgbm import LGBMClassifier
+from sagemaker_inference.transformer import Transformer
+
+
+class _RequestProcessor:
+    def __init__(self, properties):
+        self.properties = properties
+
+    def get_request_properties(self):
+        return self.properties
+
+
+class _Context:
+    """Request context of the model server, as handed to the Transformer."""
+
+    def __init__(self, model_dir, properties):
+        self.system_properties = {"model_dir": str(model_dir)}
+        self.request_processor = [_RequestProcessor(properties)]
+        self.content_types = {}
+        self.status = None
+
+    def set_response_content_type(self, index, content_type):
+        self.content_types[index] = content_type
+
+    def set_response_status(self, code, phrase):
+        self.status = (code, phrase)
+
+
+def _make_model_dir(tmp_path, n_rows=50):
+    rng = np.random.default_rng(0)
+    features = pd.DataFrame(rng.normal(size=(n_rows, 3)), columns=["V1", "V2", "V3"])
+    model = LGBMClassifier(n_estimators=5, min_child_samples=2, verbose=-1)
+    model.fit(features, (features["V1"] > 0).astype(int))
+    joblib.dump(model, tmp_path / "model.pkl")
+    return features
+
+
+def test_transform_scores_ndjson_in_chunks(tmp_path, inference_code, monkeypatch):
+    features = _make_model_dir(tmp_path)
+    monkeypatch.setenv("SCORING_CHUNK_SIZE", "7")
+    body = features.to_csv(header=False, index=False).encode()
+    context = _Context(
+        tmp_path,
+        {"Content-Type": "text/csv", "Accept": "application/x-ndjson;verbose"},
+    )
+
+    [response] = Transformer().transform([{"body": body}], context)
+
+    # The model server only accepts complete str or bytes bodies
+    assert context.status is None
+    assert isinstance(response, bytes)
+    assert context.content_types == {0: "application/x-ndjson"}
+    records = [json.loads(line) for line in response.decode().splitlines()]
+    assert len(records) == len(features)
+    expected = joblib.load(tmp_path / "model.pkl").predict_proba(features)
+    np.testing.assert_allclose(
+        [record["probabilities"] for record in records], expected
+    )
+    assert [record["predicted_label"] for record in records] == list(
+        expected.argmax(axis=1)
+    )
+
+
+def test_transform_reorders_named_ndjson_columns(tmp_path, inference_code):
+    features = _make_model_dir(tmp_path, n_rows=20)
+    body = features[["V3", "V1", "V2"]].to_json(orient="records", lines=True)
+    context = _Context(
+        tmp_path,
+        {"Content-Type": "application/x-ndjson", "Accept": "application/x-ndjson"},
+    )
+
+    [response] = Transformer().transform([{"body": body.encode()}], context)
+
+    records = [json.loads(line) for line in response.decode().splitlines()]
+    expected = joblib.load(tmp_path / "model.pkl").predict_proba(features)
+    np.testing.assert_allclose(
+        [record["probabilities-1d"] for record in records], expected[:, 1:]
+    )
+
+
+def test_shadow_challenger_predicts_on_one_thread(tmp_path, inference_code, mocker):
+    _make_model_dir(tmp_path)
+    (tmp_path / "challenger").mkdir()
+    (tmp_path / "challenger" / "model.pkl").write_bytes(
+        (tmp_path / "model.pkl").read_bytes()
+    )
+    import inference
+
+    mocker.patch("shadow.atexit.register")
+    model = inference.model_fn(str(tmp_path))
+    scorer = inference.shadow_scorer
+    predict_proba = mocker.spy(scorer.challenger, "predict_proba")
+    data = pd.DataFrame(np.zeros((3, 3)), columns=["V1", "V2", "V3"])
+    scorer.submit(data, model.predict_proba(data))
+    scorer.close()
+
+    assert predict_proba.call_args.kwargs["num_threads"] == 1
+    assert scorer.dropped == 0
+
+
+def test_score_chunks_encodes_one_chunk_at_a_time(tmp_path, inference_code):
+    features = _make_model_dir(tmp_path, n_rows=20)
+    import inference
+
+    decoded = []
+
+    def chunks():
+        for start in range(0, len(features), 7):
+            decoded.append(start)
+            yield features.iloc[start : start + 7]
+
+    model = joblib.load(tmp_path / "model.pkl")
+    encoded_chunks = inference._score_chunks(model, chunks(), verbose=False)
+
+    assert len(next(encoded_chunks).splitlines()) == 7
+    assert decoded == [0]
+    assert [len(chunk.splitlines()) for chunk in encoded_chunks] == [7, 6]
+
+
+def test_transform_logs_ndjson_failures(tmp_path, inference_code, caplog):
+    _make_model_dir(tmp_path)
+    context = _Context(
+        tmp_path,
+        {"Content-Type": "text/csv", "Accept": "application/x-ndjson"},
+    )
+
+    Transformer().transform([{"body": b"0.1,0.2\n"}], context)
+
+    assert context.status[0] == 500
+    assert "Failed to do transform" in caplog.text
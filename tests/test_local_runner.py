@@ -0,0 +1,72 @@
+from credit_fraud.pipeline.local import LocalPipelineRunner
+
+
+def _make_runner():
+    runner = LocalPipelineRunner.__new__(LocalPipelineRunner)
+    runner.parameters = {"TrainRatio": "0.7", "ROCAUCMinThreshold": 0.85}
+    runner.execution_variables = {"PipelineExecutionId": "execution-1"}
+    runner.properties = {
+        "Preprocess": {
+            "ProcessingOutputConfig": {
+                "Outputs": {
+                    "train.parquet": {"S3Output": {"S3Uri": "s3://bucket/train"}}
+                }
+            }
+        },
+        "Evaluate": {
+            "PropertyFiles": {
+                "Report": {"metrics": {"ROC-AUC": {"value": 0.9}}, "folds": [0.8]}
+            }
+        },
+    }
+    return runner
+
+
+def test_resolve_definition_values():
+    runner = _make_runner()
+    value = runner.resolve(
+        {
+            "Folder": {
+                "Std:Join": {
+                    "On": "/",
+                    "Values": [
+                        {
+                            "Get": "Steps.Preprocess.ProcessingOutputConfig"
+                            ".Outputs['train.parquet'].S3Output.S3Uri"
+                        },
+                        {"Get": "Parameters.TrainRatio"},
+                        {"Get": "Execution.PipelineExecutionId"},
+                    ],
+                }
+            },
+            "Metric": {
+                "Std:JsonGet": {
+                    "PropertyFile": {"Get": "Steps.Evaluate.PropertyFiles.Report"},
+                    "Path": "metrics.ROC-AUC.value",
+                }
+            },
+            "Threshold": [{"Get": "Parameters.ROCAUCMinThreshold"}],
+        }
+    )
+    assert value == {
+        "Folder": "s3://bucket/train/0.7/execution-1",
+        "Metric": 0.9,
+        "Threshold": [0.85],
+    }
+    assert (
+        LocalPipelineRunner.walk(
+            runner.properties, "Evaluate.PropertyFiles.Report.folds[0]"
+        )
+        == 0.8
+    )
+
+
+def test_container_path():
+    assert (
+        LocalPipelineRunner.container_path("/tmp/job", "/opt/ml/processing/train")
+        == "/tmp/job/opt/ml/processing/train"
+    )
+    assert (
+        LocalPipelineRunner.container_path("/tmp/job", "/data/raw.csv")
+        == "/data/raw.csv"
+    )
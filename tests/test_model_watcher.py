@@ -0,0 +1,150 @@
+import hashlib
+import io
+import json
+import tarfile
+
+import boto3
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from lightgbm import LGBMClassifier
+from moto import mock_aws
+
+
+BUCKET = "models"
+POINTER_URI = f"s3://{BUCKET}/deployment/model-pointer.json"
+
+
+def _train(seed):
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame(rng.normal(size=(40, 2)), columns=["V1", "V2"])
+    model = LGBMClassifier(n_estimators=3, min_child_samples=2, verbose=-1)
+    return model.fit(features, (features["V1"] > 0).astype(int)), features
+
+
+def _put_artifact(s3_client, key, model, features, sample_predictions=True):
+    files = {"model.pkl": io.BytesIO()}
+    joblib.dump(model, files["model.pkl"])
+    if sample_predictions:
+        files["sample_predictions.json"] = io.BytesIO(
+            json.dumps(
+                {
+                    "feature_names": list(features.columns),
+                    "features": features.values.tolist(),
+                    "probabilities": model.predict_proba(features)[:, 1].tolist(),
+                }
+            ).encode()
+        )
+    files["manifest.json"] = io.BytesIO(
+        json.dumps(
+            {
+                "files": {
+                    name: {"sha256": hashlib.sha256(data.getvalue()).hexdigest()}
+                    for name, data in files.items()
+                }
+            }
+        ).encode()
+    )
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data.getvalue())
+            tar.addfile(info, io.BytesIO(data.getvalue()))
+    s3_client.put_object(Bucket=BUCKET, Key=key, Body=archive.getvalue())
+    return f"s3://{BUCKET}/{key}"
+
+
+def _point_to(s3_client, version, model_data):
+    s3_client.put_object(
+        Bucket=BUCKET,
+        Key="deployment/model-pointer.json",
+        Body=json.dumps({"version": version, "model_data": model_data}),
+    )
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def _make_watcher(model, model_data=None):
+    from inference import _predict_proba
+    from model_watcher import ModelWatcher
+
+    watcher = ModelWatcher(
+        model=model,
+        pointer_uri=POINTER_URI,
+        predict_fn=_predict_proba,
+        poll_seconds=3600,
+        tolerance=1e-6,
+        model_data=model_data,
+    )
+    watcher.stop()
+    return watcher
+
+
+def test_swaps_to_the_pointed_model_before_serving(s3_client, inference_code):
+    served, _ = _train(0)
+    new, features = _train(1)
+    _point_to(s3_client, "v2", _put_artifact(s3_client, "v2.tar.gz", new, features))
+
+    watcher = _make_watcher(served)
+
+    assert watcher.version == "v2"
+    np.testing.assert_allclose(
+        watcher.model.predict_proba(features), new.predict_proba(features)
+    )
+    assert not watcher.check()
+
+
+def test_rejects_artifacts_without_sample_predictions_once(
+    s3_client, inference_code, mocker
+):
+    served, _ = _train(0)
+    new, features = _train(1)
+    _point_to(
+        s3_client,
+        "v2",
+        _put_artifact(s3_client, "v2.tar.gz", new, features, sample_predictions=False),
+    )
+    watcher = _make_watcher(served)
+    download_file = mocker.spy(watcher._s3_client, "download_file")
+
+    # Rejected at start, the same pointer is not downloaded again
+    assert watcher.model is served
+    assert watcher.version is None
+    assert not watcher.check()
+    download_file.assert_not_called()
+
+    _point_to(s3_client, "v3", _put_artifact(s3_client, "v3.tar.gz", new, features))
+    assert watcher.check()
+    assert watcher.version == "v3"
+
+
+def test_keeps_serving_when_the_pointer_is_cleared(s3_client, inference_code):
+    served, _ = _train(0)
+    watcher = _make_watcher(served)
+
+    assert not watcher.check()
+    assert watcher.model is served
+
+
+def test_does_not_reload_the_served_artifact(s3_client, inference_code, mocker):
+    served, features = _train(0)
+    model_data = _put_artifact(s3_client, "v1.tar.gz", served, features)
+    _point_to(s3_client, "v1", model_data)
+    from model_watcher import ModelWatcher
+
+    load = mocker.spy(ModelWatcher, "_load")
+    watcher = _make_watcher(served, model_data=model_data)
+
+    assert watcher.model is served
+    assert watcher.version == "v1"
+    assert not watcher.check()
+    load.assert_not_called()
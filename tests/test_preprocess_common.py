@@ -0,0 +1,258 @@
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+def _quality_args(**kwargs):
+    return SimpleNamespace(
+        **{
+            "data_quality_max_null_fraction": 0.0,
+            "data_quality_max_row_change": 0.5,
+            "data_quality_amount_range": [0.0, 1e6],
+            "data_quality_fraud_rate_range": [1e-4, 0.05],
+            **kwargs,
+        }
+    )
+
+
+def _quality_stats(**kwargs):
+    from preprocess_schema import RAW_COLUMNS
+
+    return {
+        "columns": list(RAW_COLUMNS),
+        "rows": 1000,
+        "frauds": 2,
+        "invalid_class": 0,
+        "fractional_time": 0,
+        "nulls": {col: 0 for col in RAW_COLUMNS},
+        "non_finite": {col: 0 for col in RAW_COLUMNS},
+        "min": {"Time": 0, "Amount": 0.0},
+        "max": {"Time": 3600, "Amount": 250.0},
+        **kwargs,
+    }
+
+
+def _add_values(sketch, values):
+    for value in values:
+        if value == 0:
+            sketch.add("zero", None, 1)
+        else:
+            store = "positive" if value > 0 else "negative"
+            sketch.add(store, sketch.bucket_key(value), 1)
+
+
+def _partition(values, minimum, maximum):
+    from preprocess_sketch import DDSketch
+
+    sketch = DDSketch()
+    _add_values(sketch, values)
+    return {
+        "min": {"V1": minimum},
+        "max": {"V1": maximum},
+        "sketches": {"Amount": sketch.to_dict()},
+    }
+
+
+def test_split_sizes_follow_sequential_splits(preprocess_modules):
+    from preprocess_schema import split_sizes
+
+    args = SimpleNamespace(train_ratio=0.7, validation_ratio=0.1, test_ratio=0.2)
+    assert split_sizes(10, args) == {"train": 7, "validation": 1, "test": 2}
+    for num_rows in (0, 1, 7, 284807):
+        assert sum(split_sizes(num_rows, args).values()) == num_rows
+
+
+def test_sampling_hash_is_identical_on_integers_and_arrays(preprocess_modules):
+    from preprocess_sampling import (
+        ROW_SAMPLING_SALT,
+        SAMPLING_MODULUS,
+        sampling_hash,
+    )
+
+    times = np.array([0, 1, 406, 172792], dtype=np.int64)
+    units = np.array([-13598, 0, 11918, -24000], dtype=np.int64)
+    hashes = sampling_hash(times, units)
+    assert hashes.tolist() == [
+        sampling_hash(int(time), int(unit)) for time, unit in zip(times, units)
+    ]
+    assert ((hashes >= 0) & (hashes < SAMPLING_MODULUS)).all()
+    assert hashes.tolist() != sampling_hash(times, units, ROW_SAMPLING_SALT).tolist()
+
+
+def test_sampling_threshold_keeps_the_ratio(preprocess_modules):
+    from preprocess_sampling import sampling_hash, sampling_threshold
+
+    hashes = sampling_hash(
+        np.arange(100000, dtype=np.int64), np.zeros(100000, dtype=np.int64)
+    )
+    kept = (hashes < sampling_threshold(0.25)).mean()
+    assert kept == pytest.approx(0.25, abs=0.01)
+
+
+def test_ddsketch_quantiles_within_relative_accuracy(preprocess_modules):
+    from preprocess_sketch import DDSketch
+
+    generator = random.Random(0)
+    values = [generator.lognormvariate(3, 1.5) for _ in range(5000)]
+    values += [-value for value in values[:500]] + [0.0] * 100
+    sketch = DDSketch(0.01)
+    _add_values(sketch, values)
+
+    values.sort()
+    assert sketch.count == len(values)
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        expected = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+    assert DDSketch().quantile(0.5) is None
+
+
+def test_ddsketch_merge_and_round_trip(preprocess_modules):
+    from preprocess_sketch import DDSketch
+
+    left, right, both = DDSketch(), DDSketch(), DDSketch()
+    for index, value in enumerate([1.5, 2.0, -3.0, 40.0, 7.25, 0.5]):
+        key = left.bucket_key(value)
+        store = "positive" if value > 0 else "negative"
+        (left if index % 2 else right).add(store, key, 1)
+        both.add(store, key, 1)
+    left.merge(DDSketch.from_dict(right.to_dict()))
+
+    assert left.to_dict() == both.to_dict()
+    with pytest.raises(ValueError):
+        left.merge(DDSketch(0.01))
+
+
+def test_pending_files_selects_new_files(preprocess_modules):
+    from preprocess_incremental import new_state, pending_files
+
+    state = new_state()
+    state["partitions"] = {
+        "bucket/raw/day-1.csv": {"version": "a"},
+        "rds:None:100": {"version": None},
+    }
+    source_files = {
+        "s3://bucket/raw/day-1.csv": "a",
+        "s3://bucket/raw/day-2.csv": "b",
+    }
+    assert pending_files(state, source_files) == (["s3://bucket/raw/day-2.csv"], False)
+    assert pending_files(state, {"s3://bucket/raw/day-1.csv": "a"}) == ([], False)
+
+
+@pytest.mark.parametrize(
+    "source_files",
+    [
+        {"s3://bucket/raw/day-1.csv": "changed", "s3://bucket/raw/day-2.csv": "b"},
+        {"s3://bucket/raw/day-2.csv": "b"},
+    ],
+)
+def test_pending_files_reprocesses_changed_history(preprocess_modules, source_files):
+    from preprocess_incremental import new_state, pending_files
+
+    state = new_state()
+    state["partitions"] = {"bucket/raw/day-1.csv": {"version": "a"}}
+    assert pending_files(state, source_files) == (sorted(source_files), True)
+
+
+def test_merge_statistics(preprocess_modules):
+    from preprocess_incremental import merge_statistics
+
+    merged = merge_statistics(
+        [
+            _partition([1.0, 2.0, 3.0], -1.0, 4.0),
+            _partition([4.0, 5.0], None, None),
+            _partition([6.0, 7.0], -2.0, 3.0),
+        ]
+    )
+    assert merged["min_max"] == {"V1": {"min": -2.0, "max": 4.0}}
+    for key, expected in (("q1", 2.0), ("median", 4.0), ("q3", 5.0)):
+        assert merged["robust"]["Amount"][key] == pytest.approx(expected, rel=1e-3)
+
+
+def test_scalers_drifted(preprocess_modules):
+    from preprocess_incremental import scalers_drifted
+
+    frozen = {
+        "min_max": {"V1": {"min": 0.0, "max": 10.0}},
+        "robust": {"Amount": {"q1": 10.0, "median": 20.0, "q3": 30.0}},
+    }
+
+    def merged(v1_max=10.0, median=20.0, q3=30.0):
+        return {
+            "min_max": {"V1": {"min": 0.0, "max": v1_max}},
+            "robust": {"Amount": {"q1": 10.0, "median": median, "q3": q3}},
+        }
+
+    assert not scalers_drifted(frozen, merged(v1_max=10.4, median=20.8), 0.05)
+    assert scalers_drifted(frozen, merged(v1_max=11.0), 0.05)
+    assert scalers_drifted(frozen, merged(median=21.5), 0.05)
+    assert scalers_drifted(frozen, merged(q3=32.0), 0.05)
+
+
+def test_quality_failures(preprocess_modules):
+    from preprocess_quality import quality_failures
+
+    args = _quality_args()
+    assert quality_failures(_quality_stats(), args) == []
+    assert quality_failures(_quality_stats(rows=0), args) == ["No raw rows"]
+
+    stats = _quality_stats(
+        columns=_quality_stats()["columns"][:-1],
+        frauds=200,
+        fractional_time=3,
+        min={"Time": -5, "Amount": -1.0},
+    )
+    stats["non_finite"]["V3"] = 2
+    failures = quality_failures(stats, args, profile={**stats, "rows": 100})
+    assert failures == [
+        "Unexpected raw columns, missing ['Class'], extra []",
+        "2 infinite or NaN values in V3",
+        "Negative Time -5",
+        "3 Time values are not whole seconds",
+        "Amount range [-1.0, 250.0] outside [0.0, 1000000.0]",
+        "Fraud rate 0.200000 outside [0.0001, 0.05]",
+        "Row count changed by 900.0%, from 100 to 1000",
+    ]
+
+
+def test_load_state_commits_pending_state(preprocess_modules, tmp_path):
+    from preprocess_incremental import (
+        load_state,
+        new_state,
+        save_pending_state,
+        save_state,
+    )
+
+    uri, output = str(tmp_path / "state.json"), tmp_path / "train" / "part-0.parquet"
+    save_state(uri, new_state())
+    state = {**new_state(), "scalers": {"min_max": {}, "robust": {}}}
+    output.parent.mkdir()
+    output.write_bytes(b"rows")
+    save_pending_state(uri, state, [str(output)])
+
+    assert load_state(uri) == state
+    assert load_state(uri) == state
+    assert not (tmp_path / "state.json.pending").exists()
+
+
+def test_load_state_discards_partial_outputs(preprocess_modules, tmp_path):
+    from preprocess_incremental import (
+        load_state,
+        new_state,
+        save_pending_state,
+        save_state,
+    )
+
+    uri, written = str(tmp_path / "state.json"), tmp_path / "train.parquet"
+    save_state(uri, new_state())
+    written.write_bytes(b"rows")
+    save_pending_state(
+        uri,
+        {**new_state(), "scalers": {}},
+        [str(written), str(tmp_path / "test.parquet")],
+    )
+
+    assert load_state(uri) == new_state()
+    assert not written.exists()
+    assert not (tmp_path / "state.json.pending").exists()
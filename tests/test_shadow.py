@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def _make_scorer(
+    tmp_path, predict_fn, max_queued_rows=10, flush_size=100, shutdown_timeout=5
+):
+    from shadow import ShadowScorer
+
+    return ShadowScorer(
+        challenger=None,
+        predict_fn=predict_fn,
+        output_dir=str(tmp_path),
+        max_queued_rows=max_queued_rows,
+        flush_size=flush_size,
+        flush_interval=5,
+        shutdown_timeout=shutdown_timeout,
+    )
+
+
+def _request(rows):
+    output = np.tile([0.8, 0.2], (rows, 1))
+    return pd.DataFrame({"V1": range(rows)}), output
+
+
+def test_submit_drops_requests_over_the_queued_rows_limit(tmp_path, inference_code):
+    release = threading.Event()
+
+    def predict_fn(model, data):
+        release.wait(timeout=5)
+        return np.tile([0.7, 0.3], (len(data), 1))
+
+    scorer = _make_scorer(tmp_path, predict_fn, max_queued_rows=10)
+    assert scorer.submit(*_request(6))
+    assert not scorer.submit(*_request(6))
+    assert scorer.submit(*_request(4))
+    # A request larger than the limit is never queued
+    assert not scorer.submit(*_request(11))
+    release.set()
+    scorer.close()
+
+    records = [json.loads(line) for line in open(scorer.output_path)]
+    assert [record["rows"] for record in records] == [6, 4]
+    assert scorer.dropped == 2
+    assert scorer._queued_rows == 0
+
+
+def test_close_flushes_every_record_once(tmp_path, inference_code):
+    scorer = _make_scorer(
+        tmp_path,
+        lambda model, data: np.tile([0.5, 0.5], (len(data), 1)),
+        max_queued_rows=1000,
+        flush_size=3,
+    )
+    for _ in range(50):
+        assert scorer.submit(*_request(2))
+    scorer.close()
+
+    records = [json.loads(line) for line in open(scorer.output_path)]
+    assert len(records) == 50
+    assert records[0]["mean_abs_diff"] == 0.3
+    assert records[0]["label_agreement"] == 1.0
+
+
+def test_close_does_not_wait_for_a_slow_challenger(tmp_path, inference_code, caplog):
+    release = threading.Event()
+    scored = []
+
+    def predict_fn(model, data):
+        if scored:
+            release.wait(timeout=5)
+        scored.append(len(data))
+        return np.tile([0.5, 0.5], (len(data), 1))
+
+    scorer = _make_scorer(
+        tmp_path, predict_fn, max_queued_rows=100, shutdown_timeout=0.1
+    )
+    for rows in (1, 2, 3):
+        assert scorer.submit(*_request(rows))
+    while not scored:
+        time.sleep(0.01)
+    started_at = time.monotonic()
+    scorer.close()
+
+    assert time.monotonic() - started_at < 1
+    assert "5 queued rows were not scored" in caplog.text
+    records = [json.loads(line) for line in open(scorer.output_path)]
+    assert [record["rows"] for record in records] == [1]
+    release.set()
@@ -0,0 +1,149 @@
+import argparse
+import json
+
+import boto3
+import pytest
+import yaml
+from moto import mock_aws
+
+from credit_fraud.pipeline.context import CreditFraudPipelineContext
+from credit_fraud.pipeline.exceptions import InvalidProcessingFramework
+from credit_fraud.pipeline.steps.evaluate import EvaluateStepJob
+from credit_fraud.pipeline.steps.preprocess import PreprocessStepJob
+from credit_fraud.pipeline.steps.train import TrainStepJob
+
+
+BUCKET = "cache-bucket"
+
+
+@pytest.fixture
+def make_context(tmp_path, monkeypatch, mocker):
+    """Build pipeline contexts of cached executions against the AWS stand-ins."""
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_SAGEMAKER_S3_BUCKET_NAME", BUCKET)
+    monkeypatch.setenv("MLFLOW_ARN", f"file://{tmp_path}/mlruns")
+    monkeypatch.setenv("TRAINING_ALGORITHM", "xgboost")
+    monkeypatch.delenv("S3_RAW_DATA_KEY", raising=False)
+    monkeypatch.delenv("AWS_SAGEMAKER_S3_BUCKET_FOLDER_PREFIX", raising=False)
+    mocker.patch("credit_fraud.pipeline.context.load_dotenv", return_value=False)
+    with mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        s3_client.put_object(
+            Bucket=BUCKET, Key="case-credit-fraud/raw/creditcard.csv", Body=b"Time\n"
+        )
+
+        execution_names = []
+        mocker.patch.object(
+            CreditFraudPipelineContext,
+            "_CreditFraudPipelineContext__set_execution_name",
+            autospec=True,
+            side_effect=lambda self: setattr(
+                self, "execution_name", execution_names[-1]
+            ),
+        )
+
+        def make(execution_name, **flags):
+            execution_names.append(execution_name)
+            args = argparse.Namespace(
+                cache_preprocess=True,
+                cache_training=True,
+                cache_evaluate=True,
+                local_run=False,
+                smoke=False,
+            )
+            for flag, value in flags.items():
+                setattr(args, flag, value)
+            return CreditFraudPipelineContext(args=args)
+
+        yield make
+
+
+def _evaluation_arguments(context):
+    preprocess_step = PreprocessStepJob(context).build()
+    outputs = preprocess_step.properties.ProcessingOutputConfig.Outputs
+    train_step_job = TrainStepJob(context)
+    train_step = train_step_job.build(
+        train_data_uri=outputs["train.parquet"].S3Output.S3Uri,
+        validation_data_uri=outputs["validation.parquet"].S3Output.S3Uri,
+    )
+    strategy_algorithm = train_step_job.strategy_algorithm
+    evaluation_step = EvaluateStepJob(
+        context, strategy_algorithm.get_image_uri(scope="training")
+    ).build(
+        model_artifact_s3_uri=strategy_algorithm.get_model_only_artifact_uri(
+            train_step
+        ),
+        test_data_uri=outputs["test.parquet"].S3Output.S3Uri,
+        model_fingerprint=strategy_algorithm.model_fingerprint,
+    )
+    # Pipeline variables are serialized as their definition expressions
+    return json.dumps(
+        evaluation_step.arguments, default=lambda value: value.expr, sort_keys=True
+    )
+
+
+def test_cached_evaluation_arguments_do_not_depend_on_the_execution(make_context):
+    first = _evaluation_arguments(make_context("v1-0-0--20240101-000000"))
+    second = _evaluation_arguments(make_context("v1-0-0--20240102-000000"))
+
+    assert first == second
+    assert "v1-0-0--" not in first
+    assert '"output", "output.tar.gz"' in first
+
+
+def _patch_preprocess_config(mocker, **preprocess):
+    safe_load = yaml.safe_load
+
+    def load_config(stream):
+        cfg = safe_load(stream)
+        cfg["Preprocess"].update(preprocess)
+        return cfg
+
+    mocker.patch(
+        "credit_fraud.pipeline.context.yaml.safe_load", side_effect=load_config
+    )
+
+
+def test_preprocessing_caching_is_disabled_for_rds_sources(make_context, mocker):
+    _patch_preprocess_config(mocker, SourceMethod="rds")
+    context = make_context("v1-0-0--20240101-000000")
+
+    assert not context.preprocess_cache_config.enable_caching
+    assert context.training_cache_config.enable_caching
+    assert "/runs/v1-0-0--20240101-000000/" in context.processed_train_data_folder
+
+
+def test_artifact_cache_reuses_scikit_learn_outputs(make_context, mocker):
+    _patch_preprocess_config(
+        mocker, PreprocessFramework="scikit-learn", FeatureStore=False
+    )
+    context = make_context("v1-0-0--20240101-000000")
+    assert not context.processed_data_cached
+
+    # Stand in for the job, writing every declared output to its default folder
+    s3_client = boto3.client("s3", region_name="us-east-1")
+    for output in PreprocessStepJob(context).build().outputs:
+        _, default_folder = context.get_artifact_folder(
+            "processed", context.processed_data_fingerprint, output.output_name
+        )
+        bucket, key = default_folder.removeprefix("s3://").split("/", 1)
+        s3_client.put_object(Bucket=bucket, Key=f"{key}/part-0", Body=b"rows")
+
+    assert make_context("v1-0-0--20240102-000000").processed_data_cached
+
+
+@pytest.mark.parametrize(
+    "framework, accepted", [("spark", True), ("PySpark", True), ("duckdb", False)]
+)
+def test_feature_store_requires_the_pyspark_framework(
+    make_context, mocker, framework, accepted
+):
+    _patch_preprocess_config(mocker, PreprocessFramework=framework, FeatureStore=True)
+    context = make_context("v1-0-0--20240101-000000")
+
+    if accepted:
+        PreprocessStepJob(context)
+    else:
+        with pytest.raises(InvalidProcessingFramework):
+            PreprocessStepJob(context)